@@ -0,0 +1,286 @@
+"""
+Нормализация контактов из формы заявки: телефоны в E.164, email, Telegram @username.
+
+Всё работает офлайн: метаданные стран — небольшая таблица ниже, регулярки
+компилируются один раз при импорте. Модуль не зависит от telegram, поэтому
+им же можно прогнать выгрузку старых заявок:
+
+    python contacts.py leads.txt > leads_e164.tsv
+    python contacts.py --bench 1000000
+"""
+
+import re
+import sys
+import time
+import random
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# -------------------------
+# Метаданные стран
+# -------------------------
+
+# код страны -> [(регион, мин. длина национального номера, макс. длина, префикс
+# междугородней связи, шаблон национального номера или None)].
+# Если у кода несколько регионов (7 — RU/KZ), берётся первый, чей шаблон подошёл.
+COUNTRY_META: Dict[str, List[Tuple[str, int, int, str, Optional[str]]]] = {
+    "1": [("US", 10, 10, "1", r"[2-9]\d{2}[2-9]\d{6}")],
+    "7": [
+        ("KZ", 10, 10, "8", r"[67]\d{9}"),
+        ("RU", 10, 10, "8", r"[3489]\d{9}"),
+    ],
+    "20": [("EG", 9, 10, "0", None)],
+    "27": [("ZA", 9, 9, "0", None)],
+    "30": [("GR", 10, 10, "", None)],
+    "31": [("NL", 9, 9, "0", None)],
+    "32": [("BE", 8, 9, "0", None)],
+    "33": [("FR", 9, 9, "0", r"[1-9]\d{8}")],
+    "34": [("ES", 9, 9, "", r"[5-9]\d{8}")],
+    "36": [("HU", 8, 9, "06", None)],
+    "39": [("IT", 6, 11, "", None)],
+    "40": [("RO", 9, 9, "0", None)],
+    "41": [("CH", 9, 9, "0", None)],
+    "43": [("AT", 4, 13, "0", None)],
+    "44": [("GB", 9, 10, "0", r"[1-9]\d{8,9}")],
+    "45": [("DK", 8, 8, "", None)],
+    "46": [("SE", 7, 10, "0", None)],
+    "47": [("NO", 8, 8, "", None)],
+    "48": [("PL", 9, 9, "", None)],
+    "49": [("DE", 6, 13, "0", r"[1-9]\d{5,12}")],
+    "52": [("MX", 10, 10, "", None)],
+    "54": [("AR", 10, 11, "0", None)],
+    "55": [("BR", 10, 11, "0", None)],
+    "61": [("AU", 9, 9, "0", None)],
+    "62": [("ID", 8, 12, "0", None)],
+    "63": [("PH", 10, 10, "0", None)],
+    "64": [("NZ", 8, 10, "0", None)],
+    "65": [("SG", 8, 8, "", None)],
+    "66": [("TH", 8, 9, "0", None)],
+    "81": [("JP", 9, 10, "0", None)],
+    "82": [("KR", 8, 10, "0", None)],
+    "84": [("VN", 9, 10, "0", None)],
+    "86": [("CN", 10, 11, "0", None)],
+    "90": [("TR", 10, 10, "0", r"[2-5]\d{9}")],
+    "91": [("IN", 10, 10, "0", r"[6-9]\d{9}")],
+    "351": [("PT", 9, 9, "", None)],
+    "353": [("IE", 7, 9, "0", None)],
+    "358": [("FI", 5, 12, "0", None)],
+    "359": [("BG", 8, 9, "0", None)],
+    "370": [("LT", 8, 8, "8", None)],
+    "371": [("LV", 8, 8, "", None)],
+    "372": [("EE", 7, 8, "", None)],
+    "373": [("MD", 8, 8, "0", None)],
+    "374": [("AM", 8, 8, "0", None)],
+    "375": [("BY", 9, 9, "8", None)],
+    "380": [("UA", 9, 9, "0", None)],
+    "381": [("RS", 8, 9, "0", None)],
+    "420": [("CZ", 9, 9, "", None)],
+    "421": [("SK", 9, 9, "0", None)],
+    "971": [("AE", 8, 9, "0", None)],
+    "972": [("IL", 8, 9, "0", None)],
+    "992": [("TJ", 9, 9, "8", None)],
+    "993": [("TM", 8, 8, "8", None)],
+    "994": [("AZ", 9, 9, "0", None)],
+    "995": [("GE", 9, 9, "0", None)],
+    "996": [("KG", 9, 9, "0", None)],
+    "998": [("UZ", 9, 9, "8", None)],
+}
+
+
+class _Region(NamedTuple):
+    region: str
+    code: str
+    min_len: int
+    max_len: int
+    trunk: str
+    pattern: Optional["re.Pattern[str]"]
+
+
+def _compile_meta() -> Tuple[Dict[str, List[_Region]], Dict[str, _Region]]:
+    by_code: Dict[str, List[_Region]] = {}
+    by_region: Dict[str, _Region] = {}
+    for code, entries in COUNTRY_META.items():
+        for region, min_len, max_len, trunk, pattern in entries:
+            meta = _Region(region, code, min_len, max_len, trunk, re.compile(pattern) if pattern else None)
+            by_code.setdefault(code, []).append(meta)
+            by_region[region] = meta
+    return by_code, by_region
+
+
+REGIONS_BY_CODE, REGIONS = _compile_meta()
+
+# Разделители, которые люди ставят в номерах; удаляются одним str.translate
+_SEPARATORS = str.maketrans("", "", " \t-()./\u00a0\u2010\u2011\u2012\u2013\u2014")
+_PHONE_RE = re.compile(r"(\+|00)?([1-9]\d{3,16})")
+_EMAIL_RE = re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9\-]+(?:\.[A-Za-z0-9\-]+)*\.[A-Za-z]{2,24}")
+_HANDLE_RE = re.compile(r"(?:@|(?:https?://)?t(?:elegram)?\.me/)([A-Za-z][A-Za-z0-9_]{3,31})")
+
+
+# -------------------------
+# Телефоны
+# -------------------------
+
+class PhoneNumber(NamedTuple):
+    e164: str
+    region: Optional[str]  # None — код страны не из таблицы, проверена только длина
+
+
+def _match_international(digits: str) -> Optional[PhoneNumber]:
+    # Коды стран префиксные (ITU E.164), поэтому достаточно проверить 1–3 первые цифры
+    for size in (1, 2, 3):
+        entries = REGIONS_BY_CODE.get(digits[:size])
+        if entries is None:
+            continue
+        national = digits[size:]
+        for meta in entries:
+            if not meta.min_len <= len(national) <= meta.max_len:
+                continue
+            if meta.pattern is not None and not meta.pattern.fullmatch(national):
+                continue
+            if national.count("0") == len(national):
+                return None
+            return PhoneNumber("+" + digits, meta.region)
+        return None
+
+    # Страны, которых нет в таблице: только общие ограничения E.164
+    if 8 <= len(digits) <= 15 and len(set(digits[1:])) > 1:
+        return PhoneNumber("+" + digits, None)
+    return None
+
+
+def parse_phone(raw: str, default_region: Optional[str] = None, international: bool = False) -> Optional[PhoneNumber]:
+    """
+    Разбирает номер в E.164. Номер без "+" считается местным для default_region
+    (с отрезанием префикса вроде российской "8"), если international=False.
+    Telegram присылает номера из "Поделиться контактом" без "+", поэтому для них international=True.
+    Возвращает None, если номер невалиден.
+    """
+    if not raw or len(raw) > 40:
+        return None
+    m = _PHONE_RE.fullmatch(raw.strip().translate(_SEPARATORS))
+    if m is None:
+        return None
+    prefix, digits = m.groups()
+
+    if prefix or international:
+        return _match_international(digits)
+
+    meta = REGIONS.get(default_region or "")
+    if meta is None:
+        return None
+    if meta.trunk and digits.startswith(meta.trunk) and len(digits) - len(meta.trunk) >= meta.min_len:
+        national = digits[len(meta.trunk):]
+        parsed = _match_international(meta.code + national)
+        if parsed is not None:
+            return parsed
+    if digits.startswith(meta.code) and len(digits) - len(meta.code) >= meta.min_len:
+        # "79991234567" — код страны без "+"
+        parsed = _match_international(digits)
+        if parsed is not None:
+            return parsed
+    return _match_international(meta.code + digits)
+
+
+def normalize_phone(raw: str, default_region: Optional[str] = None, international: bool = False) -> Optional[str]:
+    parsed = parse_phone(raw, default_region, international)
+    return parsed.e164 if parsed else None
+
+
+def normalize_phones(values: Iterable[str], default_region: Optional[str] = None) -> List[Optional[str]]:
+    """Пакетная нормализация (выгрузки заявок): тот же разбор без лишних обращений к атрибутам."""
+    parse = parse_phone
+    out: List[Optional[str]] = []
+    append = out.append
+    for raw in values:
+        parsed = parse(raw, default_region)
+        append(parsed.e164 if parsed else None)
+    return out
+
+
+# -------------------------
+# Прочие контакты
+# -------------------------
+
+class Contact(NamedTuple):
+    kind: str  # "phone" / "email" / "telegram"
+    value: str
+
+
+def normalize_email(raw: str) -> Optional[str]:
+    text = raw.strip()
+    if len(text) > 254 or not _EMAIL_RE.fullmatch(text):
+        return None
+    local, domain = text.rsplit("@", 1)
+    return f"{local}@{domain.lower()}"
+
+
+def normalize_handle(raw: str) -> Optional[str]:
+    m = _HANDLE_RE.fullmatch(raw.strip())
+    if m is None or m.group(1).endswith("_"):
+        return None
+    return "@" + m.group(1)
+
+
+def parse_contact(raw: str, default_region: Optional[str] = None) -> Optional[Contact]:
+    """Для ветки «Другая форма связи»: email, @username / t.me-ссылка или телефон."""
+    text = (raw or "").strip()
+    if "@" in text and not text.startswith("@"):
+        email = normalize_email(text)
+        return Contact("email", email) if email else None
+    handle = normalize_handle(text)
+    if handle:
+        return Contact("telegram", handle)
+    phone = normalize_phone(text, default_region)
+    if phone:
+        return Contact("phone", phone)
+    return None
+
+
+# -------------------------
+# Выгрузки и бенчмарк
+# -------------------------
+
+def _sample_numbers(n: int, seed: int = 1) -> List[str]:
+    rnd = random.Random(seed)
+    shapes = (
+        lambda: f"+7 9{rnd.randrange(10**2):02d} {rnd.randrange(10**3):03d}-{rnd.randrange(10**2):02d}-{rnd.randrange(10**2):02d}",
+        lambda: f"8 (9{rnd.randrange(10**2):02d}) {rnd.randrange(10**7):07d}",
+        lambda: f"+44 20 {rnd.randrange(10**4):04d} {rnd.randrange(10**4):04d}",
+        lambda: f"+1 ({rnd.randrange(200, 1000)}) {rnd.randrange(200, 1000)}-{rnd.randrange(10**4):04d}",
+        lambda: f"00380{rnd.randrange(10**9):09d}",
+        lambda: f"+{rnd.randrange(10**9)}",
+        lambda: "+0000000000",
+    )
+    return [rnd.choice(shapes)() for _ in range(n)]
+
+
+def _bench(n: int) -> None:
+    numbers = _sample_numbers(n)
+    started = time.perf_counter()
+    result = normalize_phones(numbers, "RU")
+    elapsed = time.perf_counter() - started
+    valid = sum(1 for x in result if x)
+    print(f"{n} numbers: {elapsed:.2f}s, {elapsed / n * 1e6:.2f} µs/number, valid {valid}")
+
+
+def main(argv: List[str]) -> int:
+    region = "RU"
+    if "--region" in argv:
+        i = argv.index("--region")
+        region = argv[i + 1].upper()
+        del argv[i:i + 2]
+    if argv and argv[0] == "--bench":
+        _bench(int(argv[1]) if len(argv) > 1 else 1_000_000)
+        return 0
+
+    # Построчно: исходное значение -> нормализованное и тип контакта
+    src = open(argv[0], encoding="utf-8") if argv else sys.stdin
+    with src:
+        for line in src:
+            raw = line.rstrip("\n")
+            contact = parse_contact(raw, region)
+            print(f"{raw}\t{contact.value if contact else ''}\t{contact.kind if contact else 'invalid'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
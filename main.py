@@ -1,7 +1,21 @@
 import os
 import re
+import math
+import time
+import functools
+import hashlib
+import json
+import pickle
+import random
+import asyncio
+import signal
+import sqlite3
+import heapq
+import threading
 import logging
-from typing import Dict, Any, List, Optional
+import warnings
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, NamedTuple, Optional, Sequence, Set, Tuple
 
 from telegram import (
     Update,
@@ -9,17 +23,33 @@ from telegram import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     KeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+    TextQuote,
 )
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+from telegram.warnings import PTBUserWarning
 from telegram.ext import (
     Application,
+    BasePersistence,
+    PicklePersistence,
     CommandHandler,
     MessageHandler,
     filters,
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
+    TypeHandler,
 )
 
+from contacts import normalize_phone, parse_contact
+from profiling import HandlerTimings, StallWatchdog, sample_profile
+from templates import compile_template
+from privacy import FieldCipher
+
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
@@ -34,138 +64,418 @@ OWNER_CHAT_ID = int(os.environ.get("OWNER_CHAT_ID", "0"))
 # BOT_USERNAME=CarrierScreeningBot
 BOT_USERNAME = os.environ.get("BOT_USERNAME", "CarrierScreeningBot").lstrip("@").strip()
 
+# user_data/bot_data и состояние диалогов переживают перезапуск
+PERSISTENCE_FILE = os.environ.get("PERSISTENCE_FILE", "bot_data.pickle")
+
+# Через сколько часов напомнить о брошенной форме контактов (0 — не напоминать)
+CONTACT_REMINDER_HOURS = float(os.environ.get("CONTACT_REMINDER_HOURS", "3"))
+
+# Брошенная форма контактов завершается сама через столько часов
+CONTACT_TIMEOUT_HOURS = float(os.environ.get("CONTACT_TIMEOUT_HOURS", "24"))
+
+# Сколько храним user_data неактивных пользователей и сколько пользователей держим максимум.
+# Лишние удаляются совсем (и из persistence), а не выгружаются на диск — см. evict_idle_users
+USER_DATA_TTL_DAYS = float(os.environ.get("USER_DATA_TTL_DAYS", "30"))
+USER_DATA_MAX_USERS = int(os.environ.get("USER_DATA_MAX_USERS", "5000"))
+USER_DATA_SWEEP_MINUTES = float(os.environ.get("USER_DATA_SWEEP_MINUTES", "60"))
+# Доля апдейтов, после которых пересчитываем размер user_data пользователя для /stats
+# (pickle одного небольшого словаря — единицы микросекунд); новый пользователь меряется всегда
+USER_DATA_SIZE_SAMPLE = float(os.environ.get("USER_DATA_SIZE_SAMPLE", "0.2"))
+
+# Транспорт к Bot API: отдельные пулы для отправки и для long polling
+TELEGRAM_POOL_SIZE = int(os.environ.get("TELEGRAM_POOL_SIZE", "16"))
+TELEGRAM_POOL_TIMEOUT = float(os.environ.get("TELEGRAM_POOL_TIMEOUT", "5"))
+SEND_RETRIES = int(os.environ.get("SEND_RETRIES", "3"))
+SEND_RETRY_MAX_DELAY = float(os.environ.get("SEND_RETRY_MAX_DELAY", "5"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+
+# Исходящие владельцу сообщения сначала пишутся сюда, потом доставляются фоном
+OUTBOX_DB = os.environ.get("OUTBOX_DB", "outbox.sqlite3")
+# Как часто доставщик сам проверяет очередь, если его не будили (повтор после сбоя сети)
+OUTBOX_FLUSH_SECONDS = float(os.environ.get("OUTBOX_FLUSH_SECONDS", "30"))
+
+# HTTP-проверки здоровья (/healthz, /readyz, /metrics); 0 — выключено
+HEALTH_PORT = int(os.environ.get("HEALTH_PORT", os.environ.get("PORT", "0")))
+HEALTH_HOST = os.environ.get("HEALTH_HOST", "0.0.0.0")
+# Процесс считается «живым», пока задержка event loop меньше порога
+LOOP_LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD", "2"))
+# Сколько секунд при остановке даём на досылку очереди владельцу
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "10"))
+
+# Профилирование (по умолчанию выключено): время каждого обработчика, стеки при зависаниях
+# event loop дольше STALL_THRESHOLD_MS и сэмплирование по /flame или SIGUSR1
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+SLOW_HANDLER_MS = float(os.environ.get("SLOW_HANDLER_MS", "100"))
+STALL_THRESHOLD_MS = float(os.environ.get("STALL_THRESHOLD_MS", "250"))
+PROFILE_SAMPLE_HZ = float(os.environ.get("PROFILE_SAMPLE_HZ", "100"))
+PROFILE_SECONDS = float(os.environ.get("PROFILE_SECONDS", "30"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", ".")
+
+# Персональные данные: ключ Fernet для шифрования полей (python privacy.py --genkey),
+# сколько дней храним заявки и отправленные сообщения, как часто и какими порциями чистим
+PII_ENCRYPTION_KEY = os.environ.get("PII_ENCRYPTION_KEY", "")
+PII_RETENTION_DAYS = float(os.environ.get("PII_RETENTION_DAYS", "30"))
+RETENTION_SWEEP_MINUTES = float(os.environ.get("RETENTION_SWEEP_MINUTES", "10"))
+RETENTION_BATCH = int(os.environ.get("RETENTION_BATCH", "500"))
+
+# Сводки консультантам: свободные вопросы и контакты копятся и уходят одним сообщением
+# раз в DIGEST_INTERVAL_MINUTES (0 — выключено, каждое событие отдельно) или как только
+# у консультанта набралось DIGEST_MAX_EVENTS. Сообщения со словами из DIGEST_URGENT_WORDS
+# (части слов, без учёта регистра) отправляются сразу.
+DIGEST_INTERVAL_MINUTES = float(os.environ.get("DIGEST_INTERVAL_MINUTES", "0"))
+DIGEST_MAX_EVENTS = int(os.environ.get("DIGEST_MAX_EVENTS", "30"))
+DIGEST_URGENT_WORDS = tuple(
+    word.strip().lower()
+    for word in os.environ.get("DIGEST_URGENT_WORDS", "срочн,кровотеч,urgent,asap,bleeding").split(",")
+    if word.strip()
+)
+
+# Страна для номеров, введённых без "+" (8 999 ... / 999 ...)
+DEFAULT_PHONE_REGION = os.environ.get("DEFAULT_PHONE_REGION", "RU").upper()
+
 
 def deeplink(payload: str) -> str:
     # payload: question / plan / doctor
     return f"https://t.me/{BOT_USERNAME}?start={payload}"
 
 
-def t(label: str, lang: str = "ru") -> str:
-    texts = {
-        "greeting": {
-            "ru": (
-                "Здесь можно спокойно разобраться, касается ли вас тема генетики.\n\n"
-                "Без медицинских заумностей и без необходимости сразу что-то сдавать.\n\n"
-                "Обычно начинают с простого:\n"
-                "— «это вообще про меня или нет?»\n\n"
-                "Если откликается — можно выбрать свою ситуацию ниже\n"
-                "или просто написать, как есть."
-            ),
-            "en": (
-                "Here you can calmly check whether genetics is relevant to your situation.\n\n"
-                "No medical jargon and no need to do anything right away.\n\n"
-                "People usually start with a simple question:\n"
-                "— “Is this about me at all?”\n\n"
-                "If this feels relevant, choose the closest situation below\n"
-                "or write it in your own words."
-            ),
-        },
-        "main_menu_title": {"ru": "Выберите, что ближе:", "en": "Choose what fits best:"},
-
-        # Кнопки главного меню
-        "btn_plan": {"ru": "👶 Планируем/\nждём ребёнка", "en": "👶 Planning/\nexpecting a baby"},
-        "btn_family": {"ru": "🧬 Было что-то\nв семье", "en": "🧬 Family\nhistory"},
-        "btn_self": {"ru": "🤔 Просто хочу\nпонять про себя", "en": "🤔 Just want to\nunderstand myself"},
-        "btn_not_sure": {"ru": "🤷 Пока не понимаю,\nзачем это", "en": "🤷 Not sure yet\nwhy I need this"},
-        "btn_doctor": {"ru": "👨‍⚕️ Я врач", "en": "👨‍⚕️ I am a doctor"},
-        "btn_contact": {"ru": "📱 Оставить контакты", "en": "📱 Leave contacts"},
-        "btn_free_question": {"ru": "✍️ Написать свой\nвопрос", "en": "✍️ Write my\nquestion"},
-        "btn_end_free": {"ru": "Закончить диалог / Вернуться к меню", "en": "End dialog / Back to menu"},
-        "btn_faq": {"ru": "❓ FAQ", "en": "❓ FAQ"},
-
-        # Подсказки режима "свободного вопроса"
-        "free_q_button_explain": {
-            "ru": (
-                "Напишите здесь свой вопрос одним или несколькими сообщениями — как получается.\n\n"
-                "Не нужно формулировать идеально. Можно начать с одной фразы.\n\n"
-                "Контакты оставлять не обязательно.\n"
-                "Если захотите — сможете оставить телефон или @username после отправки вопроса."
-            ),
-            "en": (
-                "Type your question here in one or several messages — however it comes out.\n\n"
-                "No need to phrase it perfectly. You can start with one sentence.\n\n"
-                "Leaving contacts is optional.\n"
-                "If you want, you can leave a phone or @username after sending the question."
-            ),
-        },
-        "free_q_user": {
-            "ru": (
-                "Я передал ваше сообщение. Можно продолжать писать здесь, в боте — ответы будут приходить в этот же чат."
-            ),
-            "en": (
-                "I’ve forwarded your message. You can keep chatting here in this bot — replies will arrive in the same chat."
-            ),
-        },
-        "free_q_owner_title": {"ru": "Новое сообщение в боте (без заявки)", "en": "New bot message (no lead form)"},
-        "unknown_command": {
-            "ru": "Не совсем понял. Лучше выберите один из вариантов ниже или напишите вопрос своими словами.",
-            "en": "I didn’t quite understand. Please choose an option below or write your question in your own words.",
-        },
+LANGS = ("ru", "en")
+DEFAULT_LANG = "ru"
+
+# Все тексты для пользователя. Третий язык — ещё один ключ в каждой записи и в LANGS:
+# клавиатуры и готовые ответы ниже собираются для каждого языка один раз при старте.
+TEXTS: Dict[str, Dict[str, str]] = {
+    "greeting": {
+        "ru": (
+            "Здесь можно спокойно разобраться, касается ли вас тема генетики.\n\n"
+            "Без медицинских заумностей и без необходимости сразу что-то сдавать.\n\n"
+            "Обычно начинают с простого:\n"
+            "— «это вообще про меня или нет?»\n\n"
+            "Если откликается — можно выбрать свою ситуацию ниже\n"
+            "или просто написать, как есть."
+        ),
+        "en": (
+            "Here you can calmly check whether genetics is relevant to your situation.\n\n"
+            "No medical jargon and no need to do anything right away.\n\n"
+            "People usually start with a simple question:\n"
+            "— “Is this about me at all?”\n\n"
+            "If this feels relevant, choose the closest situation below\n"
+            "or write it in your own words."
+        ),
+    },
+    "main_menu_title": {"ru": "Выберите, что ближе:", "en": "Choose what fits best:"},
+
+    # Кнопки главного меню
+    "btn_plan": {"ru": "👶 Планируем/\nждём ребёнка", "en": "👶 Planning/\nexpecting a baby"},
+    "btn_family": {"ru": "🧬 Было что-то\nв семье", "en": "🧬 Family\nhistory"},
+    "btn_self": {"ru": "🤔 Просто хочу\nпонять про себя", "en": "🤔 Just want to\nunderstand myself"},
+    "btn_not_sure": {"ru": "🤷 Пока не понимаю,\nзачем это", "en": "🤷 Not sure yet\nwhy I need this"},
+    "btn_doctor": {"ru": "👨‍⚕️ Я врач", "en": "👨‍⚕️ I am a doctor"},
+    "btn_contact": {"ru": "📱 Оставить контакты", "en": "📱 Leave contacts"},
+    "btn_free_question": {"ru": "✍️ Написать свой\nвопрос", "en": "✍️ Write my\nquestion"},
+    "btn_end_free": {"ru": "Закончить диалог / Вернуться к меню", "en": "End dialog / Back to menu"},
+    "btn_faq": {"ru": "❓ FAQ", "en": "❓ FAQ"},
+
+    # Подсказки режима "свободного вопроса"
+    "free_q_button_explain": {
+        "ru": (
+            "Напишите здесь свой вопрос одним или несколькими сообщениями — как получается.\n\n"
+            "Не нужно формулировать идеально. Можно начать с одной фразы.\n\n"
+            "Контакты оставлять не обязательно.\n"
+            "Если захотите — сможете оставить телефон или @username после отправки вопроса."
+        ),
+        "en": (
+            "Type your question here in one or several messages — however it comes out.\n\n"
+            "No need to phrase it perfectly. You can start with one sentence.\n\n"
+            "Leaving contacts is optional.\n"
+            "If you want, you can leave a phone or @username after sending the question."
+        ),
+    },
+    "free_q_user": {
+        "ru": (
+            "Я передал ваше сообщение. Можно продолжать писать здесь, в боте — ответы будут приходить в этот же чат."
+        ),
+        "en": (
+            "I’ve forwarded your message. You can keep chatting here in this bot — replies will arrive in the same chat."
+        ),
+    },
+    "free_q_owner_title": {"ru": "Новое сообщение в боте (без заявки)", "en": "New bot message (no lead form)"},
+    "unknown_command": {
+        "ru": "Не совсем понял. Лучше выберите один из вариантов ниже или напишите вопрос своими словами.",
+        "en": "I didn’t quite understand. Please choose an option below or write your question in your own words.",
+    },
 
-        # Контакты / форма
-        "btn_back": {"ru": "⬅️ Назад", "en": "⬅️ Back"},
-        "btn_cancel": {"ru": "❌ Отмена", "en": "❌ Cancel"},
-        "name_ask": {"ru": "Как к вам обращаться? (имя или имя + фамилия)", "en": "How should I call you? (name or full name)"},
-        "phone_invalid": {
-            "ru": (
-                "Похоже, номер в неверном формате.\n\n"
-                "Например: +7 999 123-45-67 или +44 20 1234 5678.\n"
-                "Попробуйте ещё раз."
-            ),
-            "en": (
-                "The number seems to be in the wrong format.\n\n"
-                "For example: +1 212 555 1234.\n"
-                "Please try again."
-            ),
-        },
-        "comment_ask": {
-            "ru": "Если хотите, кратко напишите, что для вас сейчас актуально (по желанию):",
-            "en": "Optionally, write a short comment about your situation:",
-        },
-        "contact_done_user": {
-            "ru": (
-                "Спасибо! Я передал ваши данные.\n"
-                "С вами свяжутся и помогут подобрать подходящий формат генетического исследования."
-            ),
-            "en": (
-                "Thank you! I’ve passed your details on.\n"
-                "We’ll contact you to help choose an appropriate genetic test."
-            ),
-        },
-        "lead_sent_owner_title": {"ru": "Новая заявка", "en": "New Lead"},
+    # Контакты / форма
+    "btn_back": {"ru": "⬅️ Назад", "en": "⬅️ Back"},
+    "btn_cancel": {"ru": "❌ Отмена", "en": "❌ Cancel"},
+    "name_ask": {"ru": "Как к вам обращаться? (имя или имя + фамилия)", "en": "How should I call you? (name or full name)"},
+    "phone_invalid": {
+        "ru": (
+            "Похоже, номер в неверном формате.\n\n"
+            "Например: +7 999 123-45-67 или +44 20 1234 5678.\n"
+            "Попробуйте ещё раз."
+        ),
+        "en": (
+            "The number seems to be in the wrong format.\n\n"
+            "For example: +1 212 555 1234.\n"
+            "Please try again."
+        ),
+    },
+    "comment_ask": {
+        "ru": "Если хотите, кратко напишите, что для вас сейчас актуально (по желанию):",
+        "en": "Optionally, write a short comment about your situation:",
+    },
+    "contact_done_user": {
+        "ru": (
+            "Спасибо! Я передал ваши данные.\n"
+            "С вами свяжутся и помогут подобрать подходящий формат генетического исследования."
+        ),
+        "en": (
+            "Thank you! I’ve passed your details on.\n"
+            "We’ll contact you to help choose an appropriate genetic test."
+        ),
+    },
+    "lead_sent_owner_title": {"ru": "Новая заявка", "en": "New Lead"},
+    "contact_reminder": {
+        "ru": (
+            "Вы начали оставлять контакты, но не закончили.\n\n"
+            "Если это ещё актуально — просто ответьте на последний вопрос выше, продолжим с того же места. "
+            "Передумали — нажмите «❌ Отмена»."
+        ),
+        "en": (
+            "You started leaving your contacts but didn’t finish.\n\n"
+            "If it’s still relevant, just answer the last question above and we’ll continue from there. "
+            "Changed your mind? Tap “❌ Cancel”."
+        ),
+    },
+
+    # FAQ меню
+    "faq_menu_title": {
+        "ru": "❓ *FAQ по скринингу на носительство*\n\nВыберите вопрос:",
+        "en": "❓ *Carrier screening FAQ*\n\nChoose a question:",
+    },
+    "faq_doctor_title": {"ru": "👨‍⚕️ *FAQ для врачей*\n", "en": "👨‍⚕️ *Doctor FAQ*\n"},
+    "doctor_intro": {
+        "ru": (
+            "\n"
+            "Здесь собраны ответы на типичные вопросы врачей о тестах на носительство.\n"
+            "Выберите интересующую тему:"
+        ),
+        "en": (
+            "\n"
+            "Here are answers to typical doctors’ questions about carrier screening.\n"
+            "Choose a topic:"
+        ),
+    },
+
+    # Выбор языка
+    "lang_choose": {"ru": "Выберите язык:", "en": "Choose your language:"},
+    "lang_set": {"ru": "Готово, дальше общаемся по-русски.", "en": "Done, let’s continue in English."},
+    "btn_lang_ru": {"ru": "🇷🇺 Русский", "en": "🇷🇺 Русский"},
+    "btn_lang_en": {"ru": "🇬🇧 English", "en": "🇬🇧 English"},
+
+    # Ситуации из главного меню
+    "family_intro": {
+        "ru": (
+            "Это как раз та ситуация, где имеет смысл спокойно разобраться.\n\n"
+            "Но не обязательно сразу что-то делать.\n\n"
+            "Сначала важно понять:\n"
+            "то, что было в семье, вообще влияет на вас или нет.\n\n"
+            "Можно начать прямо здесь.\n\n"
+            "Напишите одним сообщением, как получится:\n"
+            "что именно было в семье и у кого.\n\n"
+            "Без медицинских формулировок. Я передам сообщение Сергею — он ответит лично."
+        ),
+        "en": (
+            "This is exactly the kind of situation worth sorting out calmly.\n\n"
+            "But there’s no need to do anything right away.\n\n"
+            "First it’s important to understand\n"
+            "whether what happened in the family affects you at all.\n\n"
+            "You can start right here.\n\n"
+            "Write in one message, however it comes out:\n"
+            "what exactly happened in the family and to whom.\n\n"
+            "No medical wording needed. I’ll pass your message to Sergey — he will reply personally."
+        ),
+    },
+    "self_intro": {
+        "ru": (
+            "Это самая частая точка входа.\n\n"
+            "Нет конкретной проблемы — просто хочется понять:\n"
+            "«а вдруг это всё-таки про меня?»\n\n"
+            "Здесь не нужно разбираться во всём.\n"
+            "Достаточно начать с одной фразы.\n\n"
+            "Можно написать прямо здесь:\n"
+            "«Хочу понять, касается ли меня тема генетики».\n\n"
+            "Я передам сообщение Сергею — он ответит лично."
+        ),
+        "en": (
+            "This is the most common starting point.\n\n"
+            "No specific problem — you just want to understand:\n"
+            "“what if this is about me after all?”\n\n"
+            "You don’t need to figure everything out.\n"
+            "One sentence is enough to start.\n\n"
+            "You can write right here:\n"
+            "“I want to understand whether genetics is relevant to me.”\n\n"
+            "I’ll pass your message to Sergey — he will reply personally."
+        ),
+    },
+    "not_sure_intro": {
+        "ru": (
+            "Это нормальная точка.\n\n"
+            "Большинство людей начинают именно с этого:\n"
+            "непонятно, нужно ли вообще в это погружаться.\n\n"
+            "Можно не решать сейчас.\n"
+            "Можно просто задать самый общий вопрос.\n\n"
+            "Напишите прямо здесь, как есть:\n"
+            "«Я пока не понимаю, зачем мне это, но хочу разобраться».\n\n"
+            "Я передам сообщение Сергею — он ответит лично."
+        ),
+        "en": (
+            "That’s a perfectly normal place to be.\n\n"
+            "Most people start exactly here:\n"
+            "it’s unclear whether it’s worth looking into at all.\n\n"
+            "You don’t have to decide now.\n"
+            "You can simply ask the most general question.\n\n"
+            "Write right here, as it is:\n"
+            "“I don’t understand yet why I need this, but I want to figure it out.”\n\n"
+            "I’ll pass your message to Sergey — he will reply personally."
+        ),
+    },
+    "free_end": {
+        "ru": "Диалог завершён. Возвращаю вас в главное меню.",
+        "en": "Dialog ended. Taking you back to the main menu.",
+    },
+    "question_detected": {
+        "ru": "Похоже, вы хотите задать вопрос.\n\nНапишите его одним или несколькими сообщениями — как получается.",
+        "en": "Looks like you want to ask a question.\n\nWrite it in one or several messages — however it comes out.",
+    },
+    "question_detected_suggest": {
+        "ru": "Похоже, вы хотите задать вопрос. Я передам его Сергею.\n\nВозможно, ответ уже есть здесь:",
+        "en": "Looks like you want to ask a question. I’ll pass it to Sergey.\n\nThe answer may already be here:",
+    },
+    "back_to_main": {"ru": "Возвращаю в главное меню…", "en": "Back to the main menu…"},
+    "btn_to_main": {"ru": "В главное меню", "en": "Main menu"},
+    "btn_contacts_inline": {"ru": "Оставить контакты", "en": "Leave contacts"},
+    "faq_choose": {"ru": "Выберите вопрос из меню ниже.", "en": "Choose a question from the menu below."},
+    "inline_ask_own": {"ru": "Задать свой вопрос:", "en": "Ask your own question:"},
+
+    # Контакт в режиме свободного вопроса и в форме
+    "free_contact_offer": {
+        "ru": "Если захотите, можно оставить контакт (не обязательно):",
+        "en": "If you like, you can leave a contact (optional):",
+    },
+    "btn_leave_phone": {"ru": "Оставить номер телефона", "en": "Leave a phone number"},
+    "btn_use_username": {"ru": "Использовать мой @username", "en": "Use my @username"},
+    "btn_other_contact": {"ru": "Другая форма связи (email и т.п.)", "en": "Another way (email etc.)"},
+    "btn_send_phone": {"ru": "Отправить номер телефона", "en": "Send phone number"},
+    "send_phone_prompt": {
+        "ru": "Нажмите кнопку ниже, чтобы отправить номер телефона:",
+        "en": "Tap the button below to send your phone number:",
+    },
+    "no_username_free": {
+        "ru": "У вас не установлен username в Telegram. Можно оставить номер телефона.",
+        "en": "You don’t have a Telegram username. You can leave a phone number instead.",
+    },
+    "no_username_form": {
+        "ru": "У вас не установлен username в Telegram. Выберите другой способ связи.",
+        "en": "You don’t have a Telegram username. Please choose another way to contact you.",
+    },
+    "username_saved": {
+        "ru": "Спасибо! Я сохранил ваш @username как контакт.",
+        "en": "Thank you! I’ve saved your @username as a contact.",
+    },
+    "phone_saved": {"ru": "Спасибо! Я сохранил ваш номер телефона.", "en": "Thank you! I’ve saved your phone number."},
+    "contact_how_ask": {"ru": "Как с вами связаться?", "en": "How can we reach you?"},
+    "other_contact_ask": {
+        "ru": "Напишите удобный способ связи: email, @username в Telegram или номер телефона (например, для WhatsApp):",
+        "en": "Write how it’s convenient to reach you: email, Telegram @username or a phone number (e.g. for WhatsApp):",
+    },
+    "other_contact_invalid": {
+        "ru": "Не получилось распознать контакт. Пример: name@example.com, @username или +7 999 123-45-67.",
+        "en": "I couldn’t recognise this contact. For example: name@example.com, @username or +1 212 555 1234.",
+    },
+    "choose_option": {
+        "ru": "Пожалуйста, выберите один из предложенных вариантов.",
+        "en": "Please choose one of the options.",
+    },
+    "cancelled": {
+        "ru": "Отменено. Возвращаю вас в главное меню.",
+        "en": "Cancelled. Taking you back to the main menu.",
+    },
+
+    # Заголовки inline-меню
+    "btn_flow_close": {"ru": "Закрыть анкету", "en": "Close questionnaire"},
+    "btn_flow_ask": {"ru": "✍️ Задать вопрос", "en": "✍️ Ask a question"},
+    "flow_closed": {
+        "ru": "Анкету можно пройти позже. А вопрос можно просто написать здесь.",
+        "en": "You can fill in the questionnaire later. Or just write your question here.",
+    },
+    "flow_expired": {"ru": "Эта анкета уже закрыта.", "en": "This questionnaire is already closed."},
+    "forget_confirm": {
+        "ru": (
+            "Удалить всё, что бот о вас хранит: ответы анкеты, контакты из заявок и ваши сообщения "
+            "в очереди консультанту?\n\nСообщения, которые консультант уже получил в Telegram, "
+            "бот удалить не может."
+        ),
+        "en": (
+            "Delete everything the bot stores about you: questionnaire answers, contacts from requests "
+            "and your messages queued for the consultant?\n\nMessages the consultant has already received "
+            "in Telegram can’t be deleted by the bot."
+        ),
+    },
+    "btn_forget_yes": {"ru": "Да, удалить", "en": "Yes, delete"},
+    "btn_forget_no": {"ru": "Нет", "en": "No"},
+    "forget_done": {"ru": "Готово, ваши данные удалены.", "en": "Done, your data has been deleted."},
+    "forget_kept": {"ru": "Хорошо, ничего не удаляю.", "en": "OK, nothing was deleted."},
+    "plan_title": {
+        "ru": "Планируем / ждём ребёнка\n\nВыберите, что именно вам интересно:",
+        "en": "Planning / expecting a baby\n\nChoose what you’d like to know:",
+    },
+    "doctor_title": {
+        "ru": "Я врач\n\nВыберите, что вам интересно:",
+        "en": "I am a doctor\n\nChoose a topic:",
+    },
+    "btn_doctor_faq": {"ru": "FAQ для врачей", "en": "Doctor FAQ"},
+}
+
+
+def t(label: str, lang: str = DEFAULT_LANG) -> str:
+    entry = TEXTS[label]
+    return entry.get(lang) or entry[DEFAULT_LANG]
+
+
+def per_lang(build) -> Dict[str, Any]:
+    """Собираем объект (клавиатуру, таблицу ответов) для каждого языка заранее."""
+    return {lang: build(lang) for lang in LANGS}
+
+
+# Текст кнопки -> метка, по всем языкам: нажатие распознаётся, даже если клавиатура
+# осталась от другого языка (пользователь сменил его через /language)
+BUTTON_LABELS: Dict[str, str] = {
+    text: label for label, entry in TEXTS.items() if label.startswith("btn_") for text in entry.values()
+}
 
-        # FAQ меню
-        "faq_menu_title": {
-            "ru": "❓ *FAQ по скринингу на носительство*\n\nВыберите вопрос:",
-            "en": "❓ *Carrier screening FAQ*\n\nChoose a question:",
-        },
-        "faq_doctor_title": {"ru": "👨‍⚕️ *FAQ для врачей*\n", "en": "👨‍⚕️ *Doctor FAQ*\n"},
-        "doctor_intro": {
-            "ru": (
-                "\n"
-                "Здесь собраны ответы на типичные вопросы врачей о тестах на носительство.\n"
-                "Выберите интересующую тему:"
-            ),
-            "en": (
-                "\n"
-                "Here are answers to typical doctors’ questions about carrier screening.\n"
-                "Choose a topic:"
-            ),
-        },
-    }
-    return texts[label].get(lang, texts[label]["ru"])
 
+def is_button(txt: str, label: str) -> bool:
+    return BUTTON_LABELS.get(txt) == label
 
-def get_lang(update: Update) -> str:
+
+def get_lang(update: Update, context: Optional[ContextTypes.DEFAULT_TYPE] = None) -> str:
+    # Выбор через /language важнее языка клиента Telegram
+    if context is not None and context.user_data is not None:
+        chosen = context.user_data.get("lang")
+        if chosen in LANGS:
+            return chosen
     user_lang = None
     if update.effective_user and update.effective_user.language_code:
-        user_lang = update.effective_user.language_code
-    if user_lang and user_lang.startswith("en"):
-        return "en"
-    return "ru"
+        user_lang = update.effective_user.language_code.split("-")[0].lower()
+    if user_lang in LANGS:
+        return user_lang
+    return DEFAULT_LANG
 
 
-def main_menu_keyboard(lang: str, free_mode: bool = False) -> ReplyKeyboardMarkup:
+def build_main_menu_keyboard(lang: str, free_mode: bool = False) -> ReplyKeyboardMarkup:
     rows = [
         [t("btn_plan", lang), t("btn_family", lang)],
         [t("btn_self", lang), t("btn_not_sure", lang)],
@@ -176,24 +486,36 @@ def main_menu_keyboard(lang: str, free_mode: bool = False) -> ReplyKeyboardMarku
     return ReplyKeyboardMarkup(rows, resize_keyboard=True)
 
 
-def back_cancel_keyboard(lang: str) -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True)
+MAIN_MENU_KEYBOARDS: Dict[Tuple[str, bool], ReplyKeyboardMarkup] = {
+    (lang, free_mode): build_main_menu_keyboard(lang, free_mode) for lang in LANGS for free_mode in (False, True)
+}
 
 
-def is_back(txt: str, lang: str) -> bool:
-    return txt == t("btn_back", lang)
+def main_menu_keyboard(lang: str, free_mode: bool = False) -> ReplyKeyboardMarkup:
+    return MAIN_MENU_KEYBOARDS[(lang, free_mode)]
 
 
-def is_cancel(txt: str, lang: str) -> bool:
-    return txt == t("btn_cancel", lang)
+CANCEL_KEYBOARD = per_lang(
+    lambda lang: ReplyKeyboardMarkup([[t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True)
+)
+BACK_CANCEL_KEYBOARD = per_lang(
+    lambda lang: ReplyKeyboardMarkup(
+        [[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True
+    )
+)
 
 
-def is_valid_phone(phone: str) -> bool:
-    cleaned = re.sub(r"[^\d+]", "", phone).strip()
-    if not cleaned.startswith("+"):
-        return False
-    digits = re.findall(r"\d", cleaned)
-    return 10 <= len(digits) <= 15
+def back_cancel_keyboard(lang: str) -> ReplyKeyboardMarkup:
+    return BACK_CANCEL_KEYBOARD[lang]
+
+
+# Кнопка узнаётся на любом языке: пользователь мог сменить язык посреди формы
+def is_back(txt: str) -> bool:
+    return is_button(txt, "btn_back")
+
+
+def is_cancel(txt: str) -> bool:
+    return is_button(txt, "btn_cancel")
 
 
 def looks_like_question(text: str) -> bool:
@@ -222,180 +544,1086 @@ def looks_like_question(text: str) -> bool:
         "генетик",
         "анализ",
         "тест",
+        "should i",
+        "do we need",
+        "pregnan",
+        "screening",
+        "carrier",
+        "genetic",
+        "test",
     ]
     low = ttxt.lower()
     return any(x in low for x in triggers)
 
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
+# -------------------------
+# Шаблоны сообщений консультантам
+# -------------------------
 
-    # Deeplink payload: /start <payload>
-    payload: Optional[str] = None
-    if context.args:
-        payload = (context.args[0] or "").strip().lower()
+# По строке "User ID: ..." owner_auto_reply находит, кому отправить ответ — не менять
+USER_HEADER = (
+    "User ID: {user_id|–}\n"
+    "{?username}Username: @{username}\n"
+    "{!username}Username: –\n"
+)
 
-    # По payload можно сразу увести в нужный сценарий
-    if payload == "question":
-        # сразу включаем режим вопроса
-        context.user_data["free_mode"] = True
-        await update.message.reply_text(
-            t("free_q_button_explain", lang),
-            reply_markup=main_menu_keyboard(lang, free_mode=True),
+MESSAGE_TEMPLATE_SOURCES = {
+    "free_message": (
+        "{@free_q_owner_title}\n" + USER_HEADER + "{?full_name}Имя: {full_name}\nСообщение:\n{text}"
+    ),
+    "free_contact_username": (
+        "Контакт из режима свободного вопроса (username)\n" + USER_HEADER + "{?full_name}Имя: {full_name}"
+    ),
+    "free_contact_phone": (
+        "Контакт из режима свободного вопроса (телефон)\n"
+        + USER_HEADER
+        + "{?full_name}Имя: {full_name}\n"
+        "Телефон: {phone}"
+    ),
+    "lead": (
+        "{@lead_sent_owner_title}\n"
+        + USER_HEADER
+        + "{?full_name}Имя в Telegram: {full_name}\n"
+        "Имя (из заявки): {name|-}\n"
+        "Контакт: {contact|-}\n"
+        "Как связаться удобнее: {how|-}\n"
+        "Комментарий: {comment|-}\n"
+        "Источник: {source|-}\n"
+        "{?flow_summary}{flow_title}:\n"
+        "{?flow_summary}{flow_summary}"
+    ),
+    "reassign": "Диалог передан вам: пользователь ждёт ответа {minutes} мин.\n\n{text}",
+    "digest_header": (
+        "Сводка с {since}: {events} сообщ. от {users} польз.\n"
+        "Чтобы ответить, выделите текст в блоке пользователя и ответьте на цитату."
+    ),
+    "digest_user": USER_HEADER + "{?full_name}Имя: {full_name}\n{events}",
+    "digest_message": "{at} — {text}",
+    "digest_contact": "{at} — оставил(а) контакт: {text}",
+    "lead_line": "{at} — {name|-}, {contact|-} (User ID: {user_id|–}, {source|-})",
+}
+
+# Компилируем один раз на язык: {@label} подставляется из TEXTS на этапе компиляции
+MESSAGE_TEMPLATES = {
+    name: per_lang(lambda lang, source=source: compile_template(source, lang, t))
+    for name, source in MESSAGE_TEMPLATE_SOURCES.items()
+}
+
+
+def render(template: str, lang: str = DEFAULT_LANG, **fields) -> str:
+    return MESSAGE_TEMPLATES[template][lang].render(fields)
+
+
+def user_fields(user) -> Dict[str, Any]:
+    return {
+        "user_id": user.id if user else None,
+        "username": getattr(user, "username", None),
+        "full_name": getattr(user, "full_name", None),
+    }
+
+
+# -------------------------
+# Отправка в Bot API: пулы соединений, ретраи, circuit breaker
+# -------------------------
+
+def telegram_http_version() -> str:
+    # HTTP/2 — только если установлен h2 (pip install "httpx[http2]")
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return "1.1"
+    return "2"
+
+
+def build_send_request() -> HTTPXRequest:
+    return HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=5.0,
+        read_timeout=10.0,
+        write_timeout=10.0,
+        http_version=telegram_http_version(),
+    )
+
+
+def build_polling_request() -> HTTPXRequest:
+    # getUpdates держит одно долгое соединение — ему хватает своего маленького пула
+    return HTTPXRequest(connection_pool_size=1, read_timeout=30.0, http_version="1.1")
+
+
+class TelegramUnavailable(NetworkError):
+    """Circuit breaker открыт: Bot API сейчас не отвечает, не ждём таймаутов."""
+
+
+class CircuitBreaker:
+    """
+    После threshold подряд сетевых ошибок «размыкаемся» на reset_timeout секунд:
+    отправки сразу падают с TelegramUnavailable, а не копят висящие корутины.
+    По истечении таймаута пропускаем ровно один пробный запрос (half-open), остальные
+    по-прежнему падают сразу: успех пробы замыкает цепь, ошибка — размыкает заново.
+    Если проба не вернулась за reset_timeout (задачу отменили), пускаем следующую.
+    Проверяется в транспорте (CircuitBreakerRequest), поэтому касается всех вызовов
+    бота — и ответов в обработчиках, и outbox; getUpdates идёт своим запросом мимо него.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and (
+            time.monotonic() - self.opened_at < self.reset_timeout or self.probe_started is not None
         )
-        return
-    if payload == "plan":
-        await update.message.reply_text(t("greeting", lang), reply_markup=main_menu_keyboard(lang))
-        return await plan_start(update, context)
-    if payload == "doctor":
-        await update.message.reply_text(t("greeting", lang), reply_markup=main_menu_keyboard(lang))
-        return await doctor_menu_start(update, context)
 
-    # обычный /start
-    await update.message.reply_text(t("greeting", lang), reply_markup=main_menu_keyboard(lang))
+    def allow_request(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+            return False
+        self.probe_started = now
+        return True
 
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    msg = update.message or update.callback_query.message
-    await msg.reply_text(t("main_menu_title", lang), reply_markup=main_menu_keyboard(lang))
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.probe_started is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self.probe_started = None
 
 
-async def explain_free_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    context.user_data["free_mode"] = True
-    await update.message.reply_text(
-        t("free_q_button_explain", lang),
-        reply_markup=main_menu_keyboard(lang, free_mode=True),
-    )
+TELEGRAM_CIRCUIT = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
 
 
-async def forward_free_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+class CircuitBreakerRequest(BaseRequest):
     """
-    Пересылаем любое сообщение пользователя владельцу.
+    Транспорт бота поверх HTTPXRequest (или FakeBotAPI в simulation.py): каждый вызов
+    Bot API — reply_text в обработчике, edit_message_text, отправка из outbox — сначала
+    спрашивает circuit breaker. Пока цепь разомкнута, вызов сразу падает с
+    TelegramUnavailable, а не ждёт таймаутов httpx. Любой HTTP-ответ, кроме 5xx, значит,
+    что API жив (400/403/429 — тоже); сетевые ошибки и 5xx считаются сбоями.
     """
-    if not OWNER_CHAT_ID:
-        return
-    user = update.effective_user
-    if user and user.id == OWNER_CHAT_ID:
-        return
-    if update.message.from_user and update.message.from_user.is_bot:
-        return
 
-    lang = get_lang(update)
-    text = update.message.text or ""
-    lines_out = [
-        t("free_q_owner_title", lang),
-        "",
-        f"User ID: {user.id if user else '–'}",
-        f"Username: @{user.username}" if getattr(user, "username", None) else "Username: –",
-        f"Имя: {user.full_name}" if getattr(user, "full_name", None) else "",
-        "",
-        "Сообщение:",
-        text,
-    ]
-    msg_text = "\n".join([ln for ln in lines_out if ln != ""])
-    await context.bot.send_message(chat_id=OWNER_CHAT_ID, text=msg_text)
+    def __init__(self, inner: BaseRequest, circuit: CircuitBreaker):
+        self.inner = inner
+        self.circuit = circuit
+
+    async def initialize(self) -> None:
+        await self.inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self.inner.shutdown()
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data=None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        if not self.circuit.allow_request():
+            raise TelegramUnavailable(f"circuit open, skip {url.rsplit('/', 1)[-1]}")
+        try:
+            status, payload = await self.inner.do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        except (TimedOut, NetworkError):
+            self.circuit.record_failure()
+            raise
+        if status >= 500:
+            self.circuit.record_failure()
+        else:
+            self.circuit.record_success()
+        return status, payload
+
+
+def retry_delay(attempt: int) -> float:
+    # экспоненциальная задержка с полным джиттером: 0..0.5с, 0..1с, 0..2с, ...
+    return random.uniform(0, min(SEND_RETRY_MAX_DELAY, 0.5 * 2 ** attempt))
+
+
+async def send_with_retry(bot, chat_id: int, text: str, retries: int = SEND_RETRIES, **kwargs):
+    """
+    send_message с повторами на временных ошибках (таймауты, сеть, flood control).
+    Постоянные ошибки (BadRequest, Forbidden — например, пользователь заблокировал бота)
+    и разомкнутый circuit breaker (TelegramUnavailable) не повторяем. Итоговую ошибку
+    пробрасываем вызывающему.
+    retries=0 — одна попытка: так шлёт outbox, у которого свои отложенные повторы.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except (BadRequest, Forbidden, TelegramUnavailable):
+            # постоянная ошибка или разомкнутый circuit breaker — повтор не поможет
+            raise
+        except RetryAfter as e:
+            delay = float(e.retry_after)
+            if attempt >= retries or delay > SEND_RETRY_MAX_DELAY:
+                raise
+        except (TimedOut, NetworkError):
+            if attempt >= retries:
+                raise
+            delay = retry_delay(attempt)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def safe_send(bot, chat_id: int, text: str, **kwargs) -> bool:
+    """То же, что send_with_retry, но ошибки только логируются. Возвращает, удалось ли отправить."""
+    try:
+        await send_with_retry(bot, chat_id, text, **kwargs)
+    except Exception as e:
+        logger.error("Failed to send message to %s: %s", chat_id, e)
+        return False
+    return True
 
-    await update.message.reply_text(
-        t("free_q_user", lang),
-        reply_markup=main_menu_keyboard(lang, free_mode=True),
-    )
 
-    contact_keyboard = InlineKeyboardMarkup(
-        [
-            [InlineKeyboardButton("Оставить номер телефона", callback_data="free_contact_phone")],
-            [InlineKeyboardButton("Использовать мой @username", callback_data="free_contact_username")],
-        ]
-    )
-    await update.message.reply_text(
-        "Если захотите, можно оставить контакт (не обязательно):",
-        reply_markup=contact_keyboard,
-    )
+# -------------------------
+# Outbox: заявки владельцу не теряются, даже если Telegram недоступен
+# -------------------------
 
+class Outbox:
+    """
+    Таблица SQLite с исходящими сообщениями. Запись — один INSERT в WAL-режиме
+    (десятки микросекунд), доставка — фоном, «как минимум один раз».
+    key — ключ идемпотентности: повторная постановка того же сообщения
+    (например, Telegram прислал апдейт ещё раз после перезапуска) игнорируется.
+    Текст шифруется cipher, user_id — чей это текст (для /forget и ответа консультанта).
+    Сводка несёт данные нескольких пользователей — их блоки (user_id и смещение в тексте)
+    записываются в outbox_users. После доставки запоминаем message_id: ответ консультанта
+    адресуется по сообщению, на которое он ответил, а не по тексту внутри него.
+    """
 
-async def free_contact_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
-    user = query.from_user
-    lang = get_lang(update)
+    def __init__(self, path: str, cipher: Optional[FieldCipher] = None):
+        self.cipher = cipher or FieldCipher()
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " key TEXT NOT NULL UNIQUE,"
+            " chat_id INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(outbox)")}
+        if "user_id" not in columns:
+            self.db.execute("ALTER TABLE outbox ADD COLUMN user_id INTEGER")
+        if "message_id" not in columns:
+            self.db.execute("ALTER TABLE outbox ADD COLUMN message_id INTEGER")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_pending ON outbox(id) WHERE status = 'pending'")
+        # для очистки по сроку хранения и /forget — без обхода всей таблицы
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_done ON outbox(updated_at) WHERE status != 'pending'")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_user ON outbox(user_id) WHERE user_id IS NOT NULL")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_message ON outbox(chat_id, message_id) WHERE message_id IS NOT NULL"
+        )
+        # строки уходят вместе с сообщением: и при sweep, и при /forget
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_users ("
+            " outbox_id INTEGER NOT NULL REFERENCES outbox(id) ON DELETE CASCADE,"
+            " user_id INTEGER NOT NULL,"
+            " offset INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (outbox_id, user_id)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_users_user ON outbox_users(user_id)")
+        # счётчик в памяти, чтобы /stats и /queue не считали строки в таблице
+        self.pending_total = self.pending_count()
+
+    def put(
+        self, chat_id: int, text: str, key: str, user_id: Optional[int] = None, blocks: Sequence[Tuple[int, int]] = ()
+    ) -> bool:
+        now = time.time()
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO outbox (key, chat_id, text, user_id, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, chat_id, self.cipher.encrypt(text), user_id, now, now),
+        )
+        if cur.rowcount > 0:
+            if blocks:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO outbox_users (outbox_id, user_id, offset) VALUES (?, ?, ?)",
+                    [(cur.lastrowid, uid, offset) for uid, offset in blocks],
+                )
+            self.pending_total += 1
+            return True
+        return False
 
-    if data == "free_contact_phone":
-        kb = ReplyKeyboardMarkup(
-            [[KeyboardButton("Отправить номер телефона", request_contact=True)]],
-            resize_keyboard=True,
-            one_time_keyboard=True,
+    def pending(self, after_id: int = 0, limit: int = 100) -> List[Tuple[int, int, str]]:
+        rows = self.db.execute(
+            "SELECT id, chat_id, text FROM outbox WHERE status = 'pending' AND id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [(row_id, chat_id, self.cipher.decrypt(text)) for row_id, chat_id, text in rows]
+
+    def pending_count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def mark(self, row_id: int, status: str, message_id: Optional[int] = None) -> None:
+        cur = self.db.execute(
+            "UPDATE outbox SET status = ?, message_id = ?, attempts = attempts + 1, updated_at = ?"
+            " WHERE id = ? AND status = 'pending'",
+            (status, message_id, time.time(), row_id),
         )
-        await query.answer()
-        await query.message.reply_text(
-            "Нажмите кнопку ниже, чтобы отправить номер телефона:",
-            reply_markup=kb,
+        if cur.rowcount > 0 and status != "pending":
+            self.pending_total -= 1
+
+    def recipients(self, chat_id: int, message_id: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Чьи данные в доставленном сообщении: [(user_id, смещение блока)] по возрастанию смещения.
+        None — такого сообщения в outbox нет (отправлено мимо очереди или уже удалено по сроку).
+        """
+        row = self.db.execute(
+            "SELECT id, user_id FROM outbox WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+        ).fetchone()
+        if row is None:
+            return None
+        row_id, user_id = row
+        if user_id is not None:
+            return [(user_id, 0)]
+        return self.db.execute(
+            "SELECT user_id, offset FROM outbox_users WHERE outbox_id = ? ORDER BY offset", (row_id,)
+        ).fetchall()
+
+    def sweep(self, before: float, limit: int) -> int:
+        # Одна порция старых отправленных/отклонённых: по частичному индексу, не сканируя таблицу
+        cur = self.db.execute(
+            "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox WHERE status != 'pending' AND updated_at < ? LIMIT ?)",
+            (before, limit),
         )
-        return
+        return cur.rowcount
 
-    if data == "free_contact_username":
-        username = getattr(user, "username", None)
-        if not username:
-            await query.answer()
-            await query.message.reply_text("У вас не установлен username в Telegram. Можно оставить номер телефона.")
-            return
+    def forget(self, user_id: int) -> int:
+        where = "user_id = ? OR id IN (SELECT outbox_id FROM outbox_users WHERE user_id = ?)"
+        pending = self.db.execute(
+            f"SELECT COUNT(*) FROM outbox WHERE ({where}) AND status = 'pending'", (user_id, user_id)
+        ).fetchone()[0]
+        cur = self.db.execute(f"DELETE FROM outbox WHERE {where}", (user_id, user_id))
+        self.pending_total -= pending
+        return cur.rowcount
 
-        if OWNER_CHAT_ID:
-            lines = [
-                "Контакт из режима свободного вопроса (username)",
-                f"User ID: {user.id if user else '–'}",
-                f"Username: @{username}",
-                f"Имя: {user.full_name}" if getattr(user, "full_name", None) else "",
-            ]
-            msg_text = "\n".join([ln for ln in lines if ln])
-            await context.bot.send_message(chat_id=OWNER_CHAT_ID, text=msg_text)
+    def close(self) -> None:
+        self.db.close()
 
-        await query.message.reply_text(
-            "Спасибо! Я сохранил ваш @username как контакт.",
-            reply_markup=main_menu_keyboard(lang, free_mode=True),
-        )
-        return
 
+class ChatBackoff:
+    """
+    Когда снова пробовать чат консультанта. После flood control — не раньше retry_after,
+    после временной ошибки — с экспоненциальной задержкой. Чаты в паузе outbox пропускает,
+    не задерживая доставку остальным консультантам.
+    """
 
-async def free_contact_phone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user and update.effective_user.id == OWNER_CHAT_ID:
-        return
+    def __init__(self):
+        self.retry_at: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
 
-    contact = update.message.contact
-    user = update.effective_user
-    lang = get_lang(update)
-    if not contact:
-        return
+    def ready(self, chat_id: int, now: float) -> bool:
+        return self.retry_at.get(chat_id, 0.0) <= now
 
-    if OWNER_CHAT_ID:
-        lines = [
-            "Контакт из режима свободного вопроса (телефон)",
-            f"User ID: {user.id if user else '–'}",
-            f"Username: @{user.username}" if getattr(user, "username", None) else "Username: –",
-            f"Имя: {user.full_name}" if getattr(user, "full_name", None) else "",
-            f"Телефон: {contact.phone_number}",
-        ]
-        msg_text = "\n".join([ln for ln in lines if ln])
-        await context.bot.send_message(chat_id=OWNER_CHAT_ID, text=msg_text)
+    def flood(self, chat_id: int, retry_after: float) -> None:
+        self.retry_at[chat_id] = time.monotonic() + retry_after
 
-    await update.message.reply_text(
-        "Спасибо! Я сохранил ваш номер телефона.",
-        reply_markup=main_menu_keyboard(lang, free_mode=True),
-    )
+    def failed(self, chat_id: int) -> None:
+        attempt = self.failures.get(chat_id, 0)
+        self.failures[chat_id] = attempt + 1
+        self.retry_at[chat_id] = time.monotonic() + min(SEND_RETRY_MAX_DELAY, 0.5 * 2 ** attempt)
 
+    def succeeded(self, chat_id: int) -> None:
+        self.retry_at.pop(chat_id, None)
+        self.failures.pop(chat_id, None)
 
-async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    if update.effective_user and update.effective_user.id == OWNER_CHAT_ID:
-        return
+    def next_retry(self) -> Optional[float]:
+        return min(self.retry_at.values(), default=None)
 
-    text = (update.message.text or "").strip()
+    def clear(self) -> None:
+        self.retry_at.clear()
+        self.failures.clear()
 
-    # Совместимость со старыми кнопками, которые могли сохраниться у пользователей
-    legacy_plan = ["👶 Планируем / ждём ребёнка", "👶 Planning / expecting a baby"]
-    legacy_family = ["🧬 Было что-то в семье", "🧬 Family history"]
-    legacy_self = ["🤔 Просто хочу понять про себя", "🤔 Just exploring"]
-    legacy_not_sure = ["🤷 Пока не понимаю, зачем это", "🤷 Not sure yet"]
+
+PII = FieldCipher(PII_ENCRYPTION_KEY)
+OUTBOX: Optional[Outbox] = None
+OUTBOX_BACKOFF = ChatBackoff()
+# Создаются в post_init, внутри работающего event loop
+OUTBOX_LOCK: Optional[asyncio.Lock] = None
+OUTBOX_WAKE: Optional[asyncio.Event] = None
+# Выставляется при остановке: после этого момента доставка не начинает новых сообщений
+DRAIN_DEADLINE: Optional[float] = None
+
+
+async def deliver_outbox(bot) -> int:
+    """
+    Один проход по очереди: каждое сообщение — одна попытка. Чат, который ответил
+    flood control или временной ошибкой, уходит в паузу (OUTBOX_BACKOFF) до конца прохода
+    и дальше, его сообщения остаются pending по порядку, остальные чаты доставляются.
+    Постоянная ошибка — помечаем failed, чтобы не зациклиться. Circuit breaker открыт —
+    проход прекращается: Bot API недоступен для всех.
+    Возвращает число доставленных.
+    """
+    if OUTBOX is None or OUTBOX_LOCK is None:
+        return 0
+    delivered = 0
+    async with OUTBOX_LOCK:
+        last_id = 0
+        while True:
+            batch = OUTBOX.pending(last_id)
+            if not batch:
+                return delivered
+            for row_id, chat_id, text in batch:
+                last_id = row_id
+                if DRAIN_DEADLINE is not None and time.monotonic() > DRAIN_DEADLINE:
+                    # недоставленное остаётся pending и уйдёт после перезапуска
+                    return delivered
+                if not OUTBOX_BACKOFF.ready(chat_id, time.monotonic()):
+                    continue
+                try:
+                    message = await send_with_retry(bot, chat_id, text, retries=0)
+                except (BadRequest, Forbidden) as e:
+                    logger.error("Outbox message %s to %s rejected: %s", row_id, chat_id, e)
+                    OUTBOX.mark(row_id, "failed")
+                    continue
+                except RetryAfter as e:
+                    logger.warning("Outbox: flood control for chat %s, retry in %s s", chat_id, e.retry_after)
+                    OUTBOX_BACKOFF.flood(chat_id, float(e.retry_after))
+                    continue
+                except TelegramUnavailable as e:
+                    logger.warning("Outbox delivery paused at message %s: %s", row_id, e)
+                    return delivered
+                except Exception as e:
+                    logger.warning("Outbox message %s to %s failed, will retry: %s", row_id, chat_id, e)
+                    OUTBOX_BACKOFF.failed(chat_id)
+                    continue
+                OUTBOX_BACKOFF.succeeded(chat_id)
+                OUTBOX.mark(row_id, "sent", message.message_id)
+                delivered += 1
+
+
+def wake_outbox() -> None:
+    if OUTBOX_WAKE is not None:
+        OUTBOX_WAKE.set()
+
+
+async def outbox_worker(bot) -> None:
+    """
+    Единственный доставщик: новые сообщения его будят (wake_outbox), а не порождают
+    по задаче на каждое. Без событий просыпается к концу ближайшей паузы чата
+    или раз в OUTBOX_FLUSH_SECONDS — повторить после сбоя.
+    """
+    while True:
+        timeout = OUTBOX_FLUSH_SECONDS
+        next_retry = OUTBOX_BACKOFF.next_retry()
+        if next_retry is not None:
+            timeout = min(timeout, max(0.0, next_retry - time.monotonic()) + 0.01)
+        try:
+            await asyncio.wait_for(OUTBOX_WAKE.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        OUTBOX_WAKE.clear()
+        try:
+            await deliver_outbox(bot)
+        except Exception:
+            logger.exception("Outbox worker pass failed")
+
+
+def update_key(update: Update, kind: str) -> str:
+    """
+    Ключ идемпотентности: повторная доставка того же апдейта даёт тот же ключ. update_id
+    сам по себе не уникален навсегда — после недели без апдейтов Telegram начинает со случайного,
+    а отправленные строки outbox хранятся PII_RETENTION_DAYS. Поэтому в ключе ещё пользователь
+    и время сообщения: новая заявка не совпадёт со старой и не потеряется в INSERT OR IGNORE.
+    """
+    user_id = update.effective_user.id if update.effective_user else 0
+    message = update.effective_message
+    sent_at = int(message.date.timestamp()) if message and message.date else 0
+    return f"{kind}:{user_id}:{update.update_id}:{sent_at}"
+
+
+async def enqueue_message(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    text: str,
+    key: str,
+    user_id: Optional[int] = None,
+    blocks: Sequence[Tuple[int, int]] = (),
+) -> None:
+    """
+    Сначала на диск, потом — фоновая попытка доставки,
+    чтобы обработчик не ждал ретраев и не блокировал остальные апдейты.
+    """
+    if OUTBOX is None:
+        await safe_send(context.bot, chat_id, text)
+        return
+    if OUTBOX.put(chat_id, text, key, user_id, blocks):
+        wake_outbox()
+
+
+# -------------------------
+# Консультанты: кому отправлять вопросы и заявки
+# -------------------------
+
+def parse_operators(spec: str) -> Dict[int, frozenset]:
+    """
+    OPERATORS="111:ru,patient;222:en;333" — chat_id и теги через запятую.
+    Теги: язык (ru/en) и аудитория (patient/doctor). Нет тегов одного вида — подходит любой.
+    """
+    operators: Dict[int, frozenset] = {}
+    for part in spec.replace(" ", "").split(";"):
+        if not part:
+            continue
+        chat_id, _, tags = part.partition(":")
+        operators[int(chat_id)] = frozenset(tag for tag in tags.lower().split(",") if tag)
+    return operators
+
+
+# Без OPERATORS всё по-прежнему уходит владельцу
+OPERATORS: Dict[int, frozenset] = parse_operators(os.environ.get("OPERATORS", "")) or (
+    {OWNER_CHAT_ID: frozenset()} if OWNER_CHAT_ID else {}
+)
+# least_active — тому, у кого меньше всего неотвеченных диалогов; round_robin — по кругу
+OPERATOR_STRATEGY = os.environ.get("OPERATOR_STRATEGY", "least_active")
+# Если консультант столько минут молчит, а пользователь ждёт — передаём диалог другому
+OPERATOR_IDLE_MINUTES = float(os.environ.get("OPERATOR_IDLE_MINUTES", "60"))
+# Сколько раз один неотвеченный вопрос можно передать другому (каждый раз — новому консультанту)
+OPERATOR_MAX_REASSIGNS = int(os.environ.get("OPERATOR_MAX_REASSIGNS", "1"))
+
+LANG_TAGS = {"ru", "en"}
+AUDIENCE_TAGS = {"patient", "doctor"}
+
+
+# Владелец отвечает пользователям, даже если его нет в OPERATORS, и его сообщения
+# никогда не считаются вопросами пользователя
+def staff_chat_ids(operators: Dict[int, frozenset]) -> List[int]:
+    return sorted(set(operators) | ({OWNER_CHAT_ID} if OWNER_CHAT_ID else set()))
+
+
+STAFF_CHAT_IDS: List[int] = staff_chat_ids(OPERATORS)
+
+
+def is_operator(user_id: Optional[int]) -> bool:
+    return user_id is not None and user_id in STAFF_CHAT_IDS
+
+
+def operator_matches(tags: frozenset, lang: str, audience: str) -> bool:
+    lang_ok = not (tags & LANG_TAGS) or lang in tags
+    audience_ok = not (tags & AUDIENCE_TAGS) or audience in tags
+    return lang_ok and audience_ok
+
+
+def routing_state(bot_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Живёт в bot_data, поэтому переживает перезапуск:
+    assigned — закреплённый консультант пользователя,
+    waiting — пользователи без ответа (с какого момента, язык, аудитория, последнее сообщение,
+    сколько раз и когда передавали другому),
+    open — сколько неотвеченных диалогов у консультанта (чтобы least_active не обходил waiting),
+    last_reply — когда консультант отвечал в последний раз.
+    Записи живут, пока жив user_data пользователя: evict_idle_users убирает их вместе с ним.
+    """
+    state = bot_data.setdefault("routing", {"assigned": {}, "waiting": {}, "open": {}, "last_reply": {}, "rr": 0})
+    if "open" not in state:
+        # состояние из версии без счётчика — пересчитываем один раз
+        state["open"] = {}
+        for user_id in state["waiting"]:
+            op = state["assigned"].get(user_id)
+            state["open"][op] = state["open"].get(op, 0) + 1
+    return state
+
+
+def assign_operator(state: Dict[str, Any], user_id: int, op: Optional[int]) -> None:
+    # Неотвеченный диалог переезжает к новому консультанту вместе со счётчиком
+    current = state["assigned"].get(user_id)
+    if user_id in state["waiting"] and current != op:
+        state["open"][current] = max(0, state["open"].get(current, 1) - 1)
+        state["open"][op] = state["open"].get(op, 0) + 1
+    state["assigned"][user_id] = op
+
+
+def open_thread(state: Dict[str, Any], user_id: int, lang: str, audience: str) -> Dict[str, Any]:
+    waiting = state["waiting"].get(user_id)
+    if waiting is None:
+        waiting = state["waiting"][user_id] = {"since": time.time(), "lang": lang, "audience": audience}
+        op = state["assigned"].get(user_id)
+        state["open"][op] = state["open"].get(op, 0) + 1
+    return waiting
+
+
+def close_thread(state: Dict[str, Any], user_id: int) -> None:
+    if state["waiting"].pop(user_id, None) is not None:
+        op = state["assigned"].get(user_id)
+        state["open"][op] = max(0, state["open"].get(op, 1) - 1)
+
+
+def forget_routing(state: Dict[str, Any], user_id: int) -> None:
+    close_thread(state, user_id)
+    state["assigned"].pop(user_id, None)
+
+
+def pick_operator(state: Dict[str, Any], lang: str, audience: str, exclude: Sequence[int] = ()) -> Optional[int]:
+    candidates = [op for op, tags in OPERATORS.items() if op not in exclude and operator_matches(tags, lang, audience)]
+    if not candidates:
+        # лучше отправить «не тому», чем потерять
+        candidates = [op for op in OPERATORS if op not in exclude] or list(OPERATORS)
+    if not candidates:
+        return None
+
+    state["rr"] += 1
+    if OPERATOR_STRATEGY == "round_robin":
+        return candidates[state["rr"] % len(candidates)]
+
+    # при равной нагрузке — по кругу, чтобы не заваливать первого в списке
+    offset = state["rr"] % len(candidates)
+    rotated = candidates[offset:] + candidates[:offset]
+    return min(rotated, key=lambda op: state["open"].get(op, 0))
+
+
+def route_user(state: Dict[str, Any], user_id: int, lang: str, audience: str) -> Optional[int]:
+    # Закрепление: пока консультант есть в конфиге, пользователь пишет ему же
+    op = state["assigned"].get(user_id)
+    if op not in OPERATORS:
+        op = pick_operator(state, lang, audience)
+        assign_operator(state, user_id, op)
+    return op
+
+
+async def send_to_operator(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    key: str,
+    awaits_reply: bool = False,
+    digest: Optional[Tuple[str, str]] = None,
+) -> None:
+    """
+    Отправляем сообщение закреплённому за пользователем консультанту.
+    awaits_reply — пользователь ждёт ответа в боте (свободный вопрос), а не просто оставил заявку.
+    digest — (вид, текст) события для сводки: в режиме сводок несрочное событие
+    не отправляется сразу, а копится (см. digest_add).
+    """
+    user = update.effective_user
+    if not OPERATORS or not user:
+        return
+    if user.id in context.bot_data.get("muted", ()):
+        return
+    state = routing_state(context.bot_data)
+    lang = get_lang(update, context)
+    audience = context.user_data.get("audience", "patient")
+    op = route_user(state, user.id, lang, audience)
+    if op is None:
+        return
+    if awaits_reply:
+        waiting = open_thread(state, user.id, lang, audience)
+        waiting["text"] = PII.encrypt(text)
+    if digest is not None and DIGEST_INTERVAL_MINUTES > 0:
+        kind, event_text = digest
+        if not is_urgent(event_text):
+            if digest_add(context.bot_data, op, user, kind, event_text, key) >= DIGEST_MAX_EVENTS:
+                await flush_digest(context, op)
+            return
+        # срочное — сразу, но сначала накопленное от того же пользователя, чтобы не терять контекст
+        await flush_digest(context, op, user.id)
+    await enqueue_message(context, op, text, key, user.id)
+
+
+def record_operator_reply(bot_data: Dict[str, Any], operator_id: int, user_id: int) -> None:
+    state = routing_state(bot_data)
+    state["last_reply"][operator_id] = time.time()
+    close_thread(state, user_id)
+    # ответил другой консультант — дальше диалог ведёт он
+    state["assigned"][user_id] = operator_id
+
+
+async def reassign_idle_threads(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Пользователь ждёт дольше OPERATOR_IDLE_MINUTES (с вопроса или с прошлой передачи),
+    а его консультант за это время никому не отвечал — передаём диалог другому и пересылаем
+    ему последнее сообщение. Не больше OPERATOR_MAX_REASSIGNS раз за вопрос и каждый раз
+    тому, у кого диалога ещё не было: ночью вопрос не ходит по кругу между молчащими.
+    """
+    if len(OPERATORS) < 2 or OPERATOR_MAX_REASSIGNS <= 0:
+        return
+    state = routing_state(context.bot_data)
+    now = time.time()
+    idle = OPERATOR_IDLE_MINUTES * 60
+    for user_id, waiting in list(state["waiting"].items()):
+        tried = waiting.setdefault("tried", [])
+        if len(tried) >= OPERATOR_MAX_REASSIGNS:
+            continue
+        if now - waiting.get("reassigned_at", waiting["since"]) < idle:
+            continue
+        current = state["assigned"].get(user_id)
+        if now - state["last_reply"].get(current, 0) < idle:
+            continue
+        new_op = pick_operator(state, waiting["lang"], waiting["audience"], exclude=tried + [current])
+        if new_op is None or new_op == current or new_op in tried:
+            continue
+        assign_operator(state, user_id, new_op)
+        tried.append(current)
+        waiting["reassigned_at"] = now
+        minutes = int((now - waiting["since"]) // 60)
+        text = render("reassign", minutes=minutes, text=PII.decrypt(waiting.get("text", "")))
+        await enqueue_message(context, new_op, text, f"reassign:{user_id}:{int(waiting['since'])}:{len(tried)}", user_id)
+        logger.info("Reassigned user %s from operator %s to %s", user_id, current, new_op)
+
+
+# -------------------------
+# Сводки консультантам (DIGEST_INTERVAL_MINUTES)
+# -------------------------
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+def digest_state(bot_data: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    """
+    Живёт в bot_data, поэтому накопленное переживает перезапуск:
+    консультант -> {"since", "count", "users": {user_id: {username, full_name, events}}}.
+    Тексты событий и имя зашифрованы так же, как заявки.
+    """
+    return bot_data.setdefault("digest", {})
+
+
+def is_urgent(text: str) -> bool:
+    lowered = text.lower()
+    return any(word in lowered for word in DIGEST_URGENT_WORDS)
+
+
+def digest_add(bot_data: Dict[str, Any], op: int, user, kind: str, text: str, key: str) -> int:
+    """Добавляет событие в сводку консультанта и возвращает, сколько их там теперь."""
+    now = time.time()
+    batch = digest_state(bot_data).setdefault(op, {"since": now, "count": 0, "users": {}})
+    entry = batch["users"].get(user.id)
+    if entry is None:
+        fields = user_fields(user)
+        fields["full_name"] = PII.encrypt(fields["full_name"])
+        entry = batch["users"][user.id] = {**fields, "events": []}
+    # тот же апдейт после перезапуска — как INSERT OR IGNORE в outbox
+    if any(event["key"] == key for event in entry["events"]):
+        return batch["count"]
+    entry["events"].append({"at": now, "kind": kind, "text": PII.encrypt(text), "key": key})
+    batch["count"] += 1
+    return batch["count"]
+
+
+def pop_digest_user(bot_data: Dict[str, Any], op: int, user_id: int) -> Optional[Dict[str, Any]]:
+    state = digest_state(bot_data)
+    batch = state.get(op)
+    entry = batch["users"].pop(user_id, None) if batch else None
+    if entry is not None:
+        batch["count"] -= len(entry["events"])
+        if not batch["users"]:
+            del state[op]
+    return entry
+
+
+def utf16_len(text: str) -> int:
+    # Telegram считает позиции (TextQuote.position, entities) в UTF-16
+    return len(text.encode("utf-16-le")) // 2
+
+
+def render_digest(batch: Dict[str, Any], users: List[Dict[str, Any]]) -> List[Tuple[str, List[Tuple[int, int]]]]:
+    # Блок пользователя целиком в одном сообщении. К каждому сообщению — чьи блоки в нём
+    # и с какой позиции: по ним /forget находит сообщение в outbox, а ответ на цитату — адресата
+    blocks = []
+    for entry in users:
+        events = "\n".join(
+            render(
+                f"digest_{event['kind']}",
+                at=time.strftime("%d.%m %H:%M", time.localtime(event["at"])),
+                text=PII.decrypt(event["text"]),
+            )
+            for event in entry["events"]
+        )
+        block = render("digest_user", **{**entry, "full_name": PII.decrypt(entry["full_name"]), "events": events})
+        blocks.append(block if len(block) <= TELEGRAM_TEXT_LIMIT else block[:TELEGRAM_TEXT_LIMIT - 1] + "…")
+
+    header = render(
+        "digest_header",
+        since=time.strftime("%d.%m %H:%M", time.localtime(batch["since"])),
+        events=sum(len(entry["events"]) for entry in users),
+        users=len(users),
+    )
+    chunks: List[Tuple[str, List[Tuple[int, int]]]] = [(header, [])]
+    for entry, block in zip(users, blocks):
+        text, placed = chunks[-1]
+        if len(text) + 2 + len(block) > TELEGRAM_TEXT_LIMIT:
+            chunks.append((block, [(entry["user_id"], 0)]))
+        else:
+            chunks[-1] = (text + "\n\n" + block, placed + [(entry["user_id"], utf16_len(text) + 2)])
+    return chunks
+
+
+def take_digest(
+    bot_data: Dict[str, Any], op: int, user_id: Optional[int] = None
+) -> List[Tuple[str, str, List[Tuple[int, int]]]]:
+    """
+    Забирает накопленное для консультанта (или только события одного пользователя)
+    и возвращает сообщения для outbox: ключ, текст, блоки пользователей в тексте.
+    Ключ выводится из ключей событий: повторный сброс той же сводки — тот же ключ.
+    """
+    state = digest_state(bot_data)
+    batch = state.get(op)
+    if batch is None:
+        return []
+    if user_id is None:
+        users = list(state.pop(op)["users"].values())
+    else:
+        entry = pop_digest_user(bot_data, op, user_id)
+        if entry is None:
+            return []
+        users = [entry]
+    events = sorted(event["key"] for entry in users for event in entry["events"])
+    stamp = hashlib.sha1("\n".join(events).encode()).hexdigest()[:16]
+    return [
+        (f"digest:{op}:{stamp}:{i}", text, blocks)
+        for i, (text, blocks) in enumerate(render_digest(batch, users))
+    ]
+
+
+async def flush_digest(context: ContextTypes.DEFAULT_TYPE, op: int, user_id: Optional[int] = None) -> None:
+    for key, text, blocks in take_digest(context.bot_data, op, user_id):
+        await enqueue_message(context, op, text, key, blocks=blocks)
+
+
+async def digest_job(context: ContextTypes.DEFAULT_TYPE):
+    for op in list(digest_state(context.bot_data)):
+        await flush_digest(context, op)
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+
+    # Deeplink payload: /start <payload>
+    payload: Optional[str] = None
+    if context.args:
+        payload = (context.args[0] or "").strip().lower()
+
+    # По payload можно сразу увести в нужный сценарий
+    if payload == "question":
+        # сразу включаем режим вопроса
+        context.user_data["free_mode"] = True
+        await update.message.reply_text(
+            t("free_q_button_explain", lang),
+            reply_markup=main_menu_keyboard(lang, free_mode=True),
+        )
+        return
+    if payload == "plan":
+        await update.message.reply_text(t("greeting", lang), reply_markup=main_menu_keyboard(lang))
+        return await plan_start(update, context)
+    if payload == "doctor":
+        await update.message.reply_text(t("greeting", lang), reply_markup=main_menu_keyboard(lang))
+        return await doctor_menu_start(update, context)
+
+    # обычный /start
+    await update.message.reply_text(t("greeting", lang), reply_markup=main_menu_keyboard(lang))
+
+
+LANGUAGE_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(t(f"btn_lang_{lang}"), callback_data=f"lang_{lang}") for lang in LANGS]]
+)
+
+
+async def choose_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    await update.message.reply_text(t("lang_choose", lang), reply_markup=LANGUAGE_KEYBOARD)
+
+
+async def language_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    lang = query.data.replace("lang_", "", 1)
+    if lang not in LANGS:
+        await query.answer()
+        return
+    context.user_data["lang"] = lang
+    await query.answer()
+    await query.edit_message_text(t("lang_set", lang))
+    await query.message.reply_text(t("main_menu_title", lang), reply_markup=main_menu_keyboard(lang, context.user_data.get("free_mode", False)))
+
+
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    msg = update.message or update.callback_query.message
+    await msg.reply_text(t("main_menu_title", lang), reply_markup=main_menu_keyboard(lang))
+
+
+class Rendered(NamedTuple):
+    """Готовый ответ на нажатие inline-кнопки: собирается один раз при старте."""
+
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    parse_mode: Optional[str] = None
+
+
+async def edit_rendered(query, rendered: Rendered) -> None:
+    """
+    Пользователи часто жмут одну и ту же кнопку дважды. Если на экране уже ровно этот
+    текст и эта клавиатура, не ходим в Telegram за заведомым «message is not modified».
+    С parse_mode сравнить нельзя (в message.text разметки уже нет) — там полагаемся на ошибку.
+    """
+    await query.answer()
+    msg = query.message
+    if (
+        rendered.parse_mode is None
+        and getattr(msg, "text", None) == rendered.text
+        and getattr(msg, "reply_markup", None) == rendered.reply_markup
+    ):
+        return
+    try:
+        await query.edit_message_text(rendered.text, reply_markup=rendered.reply_markup, parse_mode=rendered.parse_mode)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def explain_free_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    context.user_data["free_mode"] = True
+    await update.message.reply_text(
+        t("free_q_button_explain", lang),
+        reply_markup=main_menu_keyboard(lang, free_mode=True),
+    )
+
+
+async def forward_free_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Пересылаем любое сообщение пользователя его консультанту.
+    """
+    if not OPERATORS:
+        return
+    user = update.effective_user
+    if user and is_operator(user.id):
+        return
+    if update.message.from_user and update.message.from_user.is_bot:
+        return
+
+    lang = get_lang(update, context)
+    text = update.message.text or ""
+    msg_text = render("free_message", lang, text=text, **user_fields(user))
+    await send_to_operator(
+        update, context, msg_text, update_key(update, "free_message"), awaits_reply=True, digest=("message", text)
+    )
+
+    await update.message.reply_text(
+        t("free_q_user", lang),
+        reply_markup=main_menu_keyboard(lang, free_mode=True),
+    )
+
+    # Предложение оставить контакт показываем один раз за сессию свободного вопроса
+    # и не показываем вовсе, если контакт уже оставлен — иначе каждое сообщение
+    # болтливого пользователя стоило бы лишнего запроса к Bot API.
+    if context.user_data.get("free_contact_left") or context.user_data.get("free_contact_offered"):
+        return
+    context.user_data["free_contact_offered"] = True
+
+    await update.message.reply_text(t("free_contact_offer", lang), reply_markup=FREE_CONTACT_KEYBOARD[lang])
+
+
+FREE_CONTACT_KEYBOARD = per_lang(
+    lambda lang: InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton(t("btn_leave_phone", lang), callback_data="free_contact_phone")],
+            [InlineKeyboardButton(t("btn_use_username", lang), callback_data="free_contact_username")],
+        ]
+    )
+)
+SEND_PHONE_KEYBOARD = per_lang(
+    lambda lang: ReplyKeyboardMarkup(
+        [[KeyboardButton(t("btn_send_phone", lang), request_contact=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+)
+
+
+async def free_contact_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    user = query.from_user
+    lang = get_lang(update, context)
+
+    if data == "free_contact_phone":
+        await query.answer()
+        await query.message.reply_text(t("send_phone_prompt", lang), reply_markup=SEND_PHONE_KEYBOARD[lang])
+        return
+
+    if data == "free_contact_username":
+        username = getattr(user, "username", None)
+        if not username:
+            await query.answer()
+            await query.message.reply_text(t("no_username_free", lang))
+            return
+
+        if OPERATORS:
+            msg_text = render("free_contact_username", lang, **user_fields(user))
+            await send_to_operator(
+                update, context, msg_text, update_key(update, "free_contact_username"), digest=("contact", f"@{username}")
+            )
+
+        context.user_data["free_contact_left"] = True
+        await query.answer()
+        await query.message.reply_text(t("username_saved", lang), reply_markup=main_menu_keyboard(lang, free_mode=True))
+        return
+
+
+async def free_contact_phone_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user and is_operator(update.effective_user.id):
+        return
+
+    contact = update.message.contact
+    user = update.effective_user
+    lang = get_lang(update, context)
+    if not contact:
+        return
+
+    if OPERATORS:
+        phone = normalize_phone(contact.phone_number, international=True) or contact.phone_number
+        msg_text = render("free_contact_phone", lang, phone=phone, **user_fields(user))
+        await send_to_operator(
+            update, context, msg_text, update_key(update, "free_contact_phone"), digest=("contact", phone)
+        )
+
+    context.user_data["free_contact_left"] = True
+    await update.message.reply_text(t("phone_saved", lang), reply_markup=main_menu_keyboard(lang, free_mode=True))
+
+
+async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    if update.effective_user and is_operator(update.effective_user.id):
+        return
+
+    text = (update.message.text or "").strip()
+
+    # Совместимость со старыми кнопками, которые могли сохраниться у пользователей
+    legacy_plan = ["👶 Планируем / ждём ребёнка", "👶 Planning / expecting a baby"]
+    legacy_family = ["🧬 Было что-то в семье", "🧬 Family history"]
+    legacy_self = ["🤔 Просто хочу понять про себя", "🤔 Just exploring"]
+    legacy_not_sure = ["🤷 Пока не понимаю, зачем это", "🤷 Not sure yet"]
     legacy_free_question = [
         "✍️ Написать свой вопрос",
         "✍️ Write my question",
@@ -403,72 +1631,40 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/Write my question",
     ]
 
-    if text == t("btn_plan", lang) or text in legacy_plan:
+    if is_button(text, "btn_plan") or text in legacy_plan:
         return await plan_start(update, context)
 
-    if text == t("btn_family", lang) or text in legacy_family:
+    if is_button(text, "btn_family") or text in legacy_family:
         context.user_data["free_mode"] = True
-        await update.message.reply_text(
-            "Это как раз та ситуация, где имеет смысл спокойно разобраться.\n\n"
-            "Но не обязательно сразу что-то делать.\n\n"
-            "Сначала важно понять:\n"
-            "то, что было в семье, вообще влияет на вас или нет.\n\n"
-            "Можно начать прямо здесь.\n\n"
-            "Напишите одним сообщением, как получится:\n"
-            "что именно было в семье и у кого.\n\n"
-            "Без медицинских формулировок. Я передам сообщение Сергею — он ответит лично.",
-            reply_markup=main_menu_keyboard(lang, free_mode=True),
-        )
-        return
+        await update.message.reply_text(t("family_intro", lang), reply_markup=main_menu_keyboard(lang, free_mode=True))
+        return await start_flow(update, context, "prescreen")
 
-    if text == t("btn_self", lang) or text in legacy_self:
+    if is_button(text, "btn_self") or text in legacy_self:
         context.user_data["free_mode"] = True
-        await update.message.reply_text(
-            "Это самая частая точка входа.\n\n"
-            "Нет конкретной проблемы — просто хочется понять:\n"
-            "«а вдруг это всё-таки про меня?»\n\n"
-            "Здесь не нужно разбираться во всём.\n"
-            "Достаточно начать с одной фразы.\n\n"
-            "Можно написать прямо здесь:\n"
-            "«Хочу понять, касается ли меня тема генетики».\n\n"
-            "Я передам сообщение Сергею — он ответит лично.",
-            reply_markup=main_menu_keyboard(lang, free_mode=True),
-        )
-        return
+        await update.message.reply_text(t("self_intro", lang), reply_markup=main_menu_keyboard(lang, free_mode=True))
+        return await start_flow(update, context, "prescreen")
 
-    if text == t("btn_not_sure", lang) or text in legacy_not_sure:
+    if is_button(text, "btn_not_sure") or text in legacy_not_sure:
         context.user_data["free_mode"] = True
-        await update.message.reply_text(
-            "Это нормальная точка.\n\n"
-            "Большинство людей начинают именно с этого:\n"
-            "непонятно, нужно ли вообще в это погружаться.\n\n"
-            "Можно не решать сейчас.\n"
-            "Можно просто задать самый общий вопрос.\n\n"
-            "Напишите прямо здесь, как есть:\n"
-            "«Я пока не понимаю, зачем мне это, но хочу разобраться».\n\n"
-            "Я передам сообщение Сергею — он ответит лично.",
-            reply_markup=main_menu_keyboard(lang, free_mode=True),
-        )
-        return
+        await update.message.reply_text(t("not_sure_intro", lang), reply_markup=main_menu_keyboard(lang, free_mode=True))
+        return await start_flow(update, context, "prescreen")
 
-    if text == t("btn_doctor", lang):
+    if is_button(text, "btn_doctor"):
         return await doctor_menu_start(update, context)
 
-    if text == t("btn_contact", lang):
+    if is_button(text, "btn_contact"):
         return await contact_start(update, context)
 
-    if text == t("btn_faq", lang):
+    if is_button(text, "btn_faq"):
         return await faq_menu_entry(update, context)
 
-    if text == t("btn_free_question", lang) or text in legacy_free_question:
+    if is_button(text, "btn_free_question") or text in legacy_free_question:
         return await explain_free_question(update, context)
 
-    if text == t("btn_end_free", lang):
+    if is_button(text, "btn_end_free"):
         context.user_data["free_mode"] = False
-        await update.message.reply_text(
-            "Диалог завершён. Возвращаю вас в главное меню.",
-            reply_markup=main_menu_keyboard(lang),
-        )
+        context.user_data.pop("free_contact_offered", None)
+        await update.message.reply_text(t("free_end", lang), reply_markup=main_menu_keyboard(lang))
         return
 
     # Если мы уже в режиме свободного вопроса — всё пересылаем
@@ -478,10 +1674,13 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Если НЕ в free_mode, но текст выглядит как вопрос — тоже считаем это вопросом
     if looks_like_question(text):
         context.user_data["free_mode"] = True
-        await update.message.reply_text(
-            "Похоже, вы хотите задать вопрос.\n\nНапишите его одним или несколькими сообщениями — как получается.",
-            reply_markup=main_menu_keyboard(lang, free_mode=True),
-        )
+        # Если ответ уже есть в FAQ — предлагаем его сразу, но вопрос всё равно пересылаем.
+        # Клавиатура режима вопроса придёт следующим сообщением из forward_free_message.
+        suggestions = build_suggestions_keyboard(text, lang)
+        if suggestions:
+            await update.message.reply_text(t("question_detected_suggest", lang), reply_markup=suggestions)
+            return await forward_free_message(update, context)
+        await update.message.reply_text(t("question_detected", lang), reply_markup=main_menu_keyboard(lang, free_mode=True))
         return await forward_free_message(update, context)
 
     await update.message.reply_text(t("unknown_command", lang), reply_markup=main_menu_keyboard(lang))
@@ -499,61 +1698,44 @@ PLAN_BENEFIT = "plan_benefit"
 PLAN_IF_FOUND = "plan_if_found"
 PLAN_HOW = "plan_how"
 
-
-def build_plan_main_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("Что вообще проверяют?", callback_data=PLAN_WHAT)],
-        [InlineKeyboardButton("Какой риск может быть?", callback_data=PLAN_RISK)],
-        [InlineKeyboardButton("Чем это полезно паре?", callback_data=PLAN_BENEFIT)],
-        [InlineKeyboardButton("Что если найдут риск?", callback_data=PLAN_IF_FOUND)],
-        [InlineKeyboardButton("Как проходит анализ?", callback_data=PLAN_HOW)],
-        [InlineKeyboardButton("Оставить контакты", callback_data="contact_from_plan")],
-        [InlineKeyboardButton("В главное меню", callback_data=PLAN_BACK_MAIN)],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-
-async def plan_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = build_plan_main_keyboard()
-    await update.message.reply_text(
-        "Планируем / ждём ребёнка\n\nВыберите, что именно вам интересно:",
-        reply_markup=keyboard,
-    )
-
-
-async def plan_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
-    if data == PLAN_BACK_MAIN:
-        await query.edit_message_text("Возвращаю в главное меню…")
-        return await show_main_menu(update, context)
-
-    text = ""
-    keyboard = None
-
-    if data == PLAN_WHAT:
-        text = (
+# Первая строка каждого текста — заголовок, он же надпись на кнопке
+PLAN_TEXTS: Dict[str, Dict[str, str]] = {
+    PLAN_WHAT: {
+        "ru": (
             "Что вообще проверяют?\n\n"
             "Скрининг на носительство — это анализ ДНК, который смотрит, "
             "есть ли у человека изменения в генах, связанные с тяжёлыми наследственными заболеваниями.\n\n"
             "Важно: у самого носителя заболевание обычно не проявляется. "
             "Риск появляется, когда два носителя одного и того же заболевания планируют ребёнка."
-        )
-        keyboard = build_plan_main_keyboard()
-
-    elif data == PLAN_RISK:
-        text = (
+        ),
+        "en": (
+            "What is actually tested?\n\n"
+            "Carrier screening is a DNA test that checks "
+            "whether a person has gene changes linked to severe inherited diseases.\n\n"
+            "Important: carriers themselves usually have no symptoms. "
+            "The risk appears when two carriers of the same disease plan a child."
+        ),
+    },
+    PLAN_RISK: {
+        "ru": (
             "Какой риск может быть?\n\n"
             "Если оба родителя — носители одного и того же заболевания, то в каждой беременности:\n"
             "• 25% — ребёнок с заболеванием;\n"
             "• 50% — ребёнок здоров, но носитель;\n"
             "• 25% — ребёнок без мутации.\n\n"
             "Скрининг помогает узнать об этом риске заранее."
-        )
-        keyboard = build_plan_main_keyboard()
-
-    elif data == PLAN_BENEFIT:
-        text = (
+        ),
+        "en": (
+            "What could the risk be?\n\n"
+            "If both parents carry the same disease, then in each pregnancy:\n"
+            "• 25% — the child has the disease;\n"
+            "• 50% — the child is healthy but a carrier;\n"
+            "• 25% — the child has no mutation.\n\n"
+            "Screening helps you learn about this risk in advance."
+        ),
+    },
+    PLAN_BENEFIT: {
+        "ru": (
             "Чем это полезно паре?\n\n"
             "Если риск обнаружен заранее, у пары появляется выбор вариантов. Например:\n"
             "• обсудить планирование беременности с учётом риска;\n"
@@ -561,31 +1743,423 @@ async def plan_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "• рассмотреть донорские клетки;\n"
             "• принять своё решение, но уже понимая риски.\n\n"
             "Главная идея — больше ясности и меньше неожиданностей."
-        )
-        keyboard = build_plan_main_keyboard()
-
-    elif data == PLAN_IF_FOUND:
-        text = (
+        ),
+        "en": (
+            "How does it help a couple?\n\n"
+            "If a risk is found in advance, the couple has options. For example:\n"
+            "• plan the pregnancy with the risk in mind;\n"
+            "• consider IVF with PGT;\n"
+            "• consider donor cells;\n"
+            "• make their own decision, but with the risks understood.\n\n"
+            "The main idea is more clarity and fewer surprises."
+        ),
+    },
+    PLAN_IF_FOUND: {
+        "ru": (
             "Что если найдут риск?\n\n"
             "Обычно дальше:\n"
             "1) врач-генетик объясняет, о каком заболевании речь;\n"
             "2) обсуждает варианты действий;\n"
             "3) помогает спланировать дальнейшие шаги.\n\n"
             "Наличие риска — не приговор, а информация для выбора."
-        )
-        keyboard = build_plan_main_keyboard()
-
-    elif data == PLAN_HOW:
-        text = (
+        ),
+        "en": (
+            "What if a risk is found?\n\n"
+            "Usually next:\n"
+            "1) a geneticist explains which disease it is about;\n"
+            "2) discusses the options;\n"
+            "3) helps plan the next steps.\n\n"
+            "A risk is not a verdict — it is information for making a choice."
+        ),
+    },
+    PLAN_HOW: {
+        "ru": (
             "Как проходит анализ?\n\n"
             "Обычно это кровь из вены или мазок из щеки. Дальше лаборатория анализирует ДНК, "
             "и вы получаете отчёт.\n\n"
             "Сроки и формат отчёта зависят от конкретного теста."
+        ),
+        "en": (
+            "How is the test done?\n\n"
+            "Usually it is a blood draw or a cheek swab. The lab then analyses the DNA "
+            "and you receive a report.\n\n"
+            "Turnaround time and report format depend on the specific test."
+        ),
+    },
+}
+
+
+def build_plan_main_keyboard(lang: str) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(texts[lang].partition("\n")[0], callback_data=key)] for key, texts in PLAN_TEXTS.items()
+    ]
+    keyboard.append([InlineKeyboardButton(t("btn_contacts_inline", lang), callback_data="contact_from_plan")])
+    keyboard.append([InlineKeyboardButton(t("btn_to_main", lang), callback_data=PLAN_BACK_MAIN)])
+    return InlineKeyboardMarkup(keyboard)
+
+
+PLAN_MAIN_KEYBOARD = per_lang(build_plan_main_keyboard)
+
+
+async def plan_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    await update.message.reply_text(t("plan_title", lang), reply_markup=PLAN_MAIN_KEYBOARD[lang])
+
+
+PLAN_RESPONSES: Dict[Tuple[str, str], Rendered] = {
+    (key, lang): Rendered(texts[lang], PLAN_MAIN_KEYBOARD[lang]) for key, texts in PLAN_TEXTS.items() for lang in LANGS
+}
+
+
+async def plan_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    lang = get_lang(update, context)
+    if data == PLAN_BACK_MAIN:
+        await query.edit_message_text(t("back_to_main", lang))
+        return await show_main_menu(update, context)
+
+    rendered = PLAN_RESPONSES.get((data, lang))
+    if rendered:
+        await edit_rendered(query, rendered)
+
+
+# -------------------------
+# Анкеты: декларативные сценарии с inline-кнопками
+# -------------------------
+
+# Сценарий — данные: шаги по порядку, у каждого варианта можно указать "next" (ветвление),
+# иначе переход на следующий шаг; после последнего — итог по правилам results.
+# label — подпись шага в сводке для консультанта (по-русски, как и остальные уведомления).
+FLOWS: Dict[str, Dict[str, Any]] = {
+    "prescreen": {
+        "title": "Анкета перед скринингом",
+        "steps": [
+            {
+                "id": "preg",
+                "label": "Беременность",
+                "text": {
+                    "ru": (
+                        "Если удобно, ответьте на несколько коротких вопросов — "
+                        "так консультанту будет проще подсказать, с чего начать.\n\n"
+                        "Вы сейчас:"
+                    ),
+                    "en": (
+                        "If you like, answer a few short questions — "
+                        "it will help the consultant suggest where to start.\n\n"
+                        "Right now you are:"
+                    ),
+                },
+                "options": [
+                    ("plan", {"ru": "Планируем беременность", "en": "Planning a pregnancy"}),
+                    ("now", {"ru": "Уже беременны", "en": "Already pregnant"}),
+                    ("no", {"ru": "Пока не планируем", "en": "Not planning yet"}),
+                ],
+            },
+            {
+                "id": "rel",
+                "label": "Родство партнёров",
+                "text": {
+                    "ru": "Вы с партнёром в родстве между собой (есть общие предки)?",
+                    "en": "Are you and your partner related (do you share ancestors)?",
+                },
+                "options": [
+                    ("no", {"ru": "Нет", "en": "No"}),
+                    ("yes", {"ru": "Да", "en": "Yes"}),
+                    ("unknown", {"ru": "Не знаю", "en": "Not sure"}),
+                ],
+            },
+            {
+                "id": "fam",
+                "label": "Случаи в семье",
+                "text": {
+                    "ru": "Были ли в семье (у вас или у партнёра) наследственные заболевания?",
+                    "en": "Has anyone in your or your partner’s family had a hereditary condition?",
+                },
+                "options": [
+                    ("no", {"ru": "Нет", "en": "No"}, "tested"),
+                    ("me", {"ru": "Да, в моей семье", "en": "Yes, in my family"}),
+                    ("partner", {"ru": "Да, в семье партнёра", "en": "Yes, in my partner’s family"}),
+                    ("unknown", {"ru": "Не знаю", "en": "Not sure"}, "tested"),
+                ],
+            },
+            {
+                "id": "diag",
+                "label": "Диагноз известен",
+                "text": {
+                    "ru": "Известно, какое именно это заболевание?",
+                    "en": "Do you know which condition it was?",
+                },
+                "options": [
+                    ("yes", {"ru": "Да, диагноз известен", "en": "Yes, the diagnosis is known"}),
+                    ("no", {"ru": "Нет / не уверены", "en": "No / not sure"}),
+                ],
+            },
+            {
+                "id": "tested",
+                "label": "Генетические тесты",
+                "text": {
+                    "ru": "Вы или партнёр уже сдавали генетические тесты?",
+                    "en": "Have you or your partner had any genetic tests?",
+                },
+                "options": [
+                    ("no", {"ru": "Нет", "en": "No"}),
+                    ("yes", {"ru": "Да", "en": "Yes"}),
+                    ("unknown", {"ru": "Не помню", "en": "Don’t remember"}),
+                ],
+            },
+        ],
+        # Первое подошедшее правило определяет итог
+        "results": [
+            ({"rel": {"yes"}}, "priority"),
+            ({"fam": {"me", "partner"}}, "priority"),
+            ({"preg": {"now"}}, "pregnant"),
+        ],
+        "default_result": "general",
+        "result_texts": {
+            "priority": {
+                "ru": (
+                    "Спасибо! По вашим ответам есть смысл обсудить скрининг со специалистом: "
+                    "родство партнёров или случаи в семье — как раз та ситуация, где он особенно полезен.\n\n"
+                    "Это не диагноз и не повод для тревоги — просто хороший повод разобраться. "
+                    "Оставьте контакт, и вам помогут выбрать подходящее исследование."
+                ),
+                "en": (
+                    "Thank you! Based on your answers it makes sense to discuss screening with a specialist: "
+                    "related partners or cases in the family are exactly where it is most useful.\n\n"
+                    "This is not a diagnosis and not a reason to worry — just a good reason to look into it. "
+                    "Leave a contact and we’ll help you choose a suitable test."
+                ),
+            },
+            "pregnant": {
+                "ru": (
+                    "Спасибо! Во время беременности скрининг тоже возможен, но важны сроки — "
+                    "лучше обсудить его как можно раньше.\n\n"
+                    "Оставьте контакт или напишите вопрос — подскажем, с чего начать."
+                ),
+                "en": (
+                    "Thank you! Screening is possible during pregnancy too, but timing matters — "
+                    "it’s best to discuss it as early as possible.\n\n"
+                    "Leave a contact or write your question — we’ll suggest where to start."
+                ),
+            },
+            "general": {
+                "ru": (
+                    "Спасибо! Особых факторов по ответам не видно — это хорошая новость.\n\n"
+                    "Скрининг на носительство рекомендуют и парам без случаев в семье: "
+                    "большинство носителей о себе ничего не знают. "
+                    "Если хотите разобраться подробнее — оставьте контакт или задайте вопрос."
+                ),
+                "en": (
+                    "Thank you! Your answers don’t show any particular factors — that’s good news.\n\n"
+                    "Carrier screening is also recommended for couples without family cases: "
+                    "most carriers don’t know about it. "
+                    "If you’d like to learn more, leave a contact or ask a question."
+                ),
+            },
+        },
+    },
+}
+
+FLOW_BACK = "<"
+FLOW_CLOSE = "x"
+FLOW_ASK = "?"
+FLOW_RESULT_STEP = "="
+
+
+class CompiledFlow(NamedTuple):
+    first: str
+    # (шаг, вариант) -> следующий шаг или None, если это был последний вопрос
+    transitions: Dict[Tuple[str, str], Optional[str]]
+    screens: Dict[Tuple[str, str], Rendered]
+    results: Dict[Tuple[str, str], Rendered]
+    rules: List[Tuple[Dict[str, set], str]]
+    default_result: str
+    summary_labels: Dict[Tuple[str, str], Tuple[str, str]]
+
+
+def compile_flow(flow_id: str, flow: Dict[str, Any]) -> CompiledFlow:
+    """
+    Один раз при импорте: таблица переходов и готовые экраны (текст + клавиатура) на каждый язык.
+    Ошибки в описании (ссылка на несуществующий шаг, слишком длинный callback) падают сразу при старте.
+    """
+    steps = flow["steps"]
+    ids = [step["id"] for step in steps]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Flow {flow_id}: duplicate step ids")
+
+    transitions: Dict[Tuple[str, str], Optional[str]] = {}
+    summary_labels: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    for index, step in enumerate(steps):
+        default_next = ids[index + 1] if index + 1 < len(ids) else None
+        for option in step["options"]:
+            option_id, labels = option[0], option[1]
+            next_step = option[2] if len(option) > 2 else default_next
+            if next_step is not None and next_step not in ids:
+                raise ValueError(f"Flow {flow_id}: unknown step {next_step!r}")
+            transitions[(step["id"], option_id)] = next_step
+            summary_labels[(step["id"], option_id)] = (step["label"], labels[DEFAULT_LANG])
+
+    def callback(step_id: str, action: str) -> str:
+        data = f"flow:{flow_id}:{step_id}:{action}"
+        if len(data.encode()) > 64:
+            raise ValueError(f"Flow {flow_id}: callback_data too long: {data}")
+        return data
+
+    screens: Dict[Tuple[str, str], Rendered] = {}
+    results: Dict[Tuple[str, str], Rendered] = {}
+    for lang in LANGS:
+        for index, step in enumerate(steps):
+            keyboard = [
+                [InlineKeyboardButton(labels[lang], callback_data=callback(step["id"], option_id))]
+                for option_id, labels, *_ in step["options"]
+            ]
+            nav = [InlineKeyboardButton(t("btn_flow_close", lang), callback_data=callback(step["id"], FLOW_CLOSE))]
+            if index > 0:
+                nav.insert(0, InlineKeyboardButton(t("btn_back", lang), callback_data=callback(step["id"], FLOW_BACK)))
+            keyboard.append(nav)
+            screens[(step["id"], lang)] = Rendered(step["text"][lang], InlineKeyboardMarkup(keyboard))
+
+        result_keyboard = InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton(t("btn_contacts_inline", lang), callback_data=f"contact_from_flow:{flow_id}")],
+                [InlineKeyboardButton(t("btn_flow_ask", lang), callback_data=callback(FLOW_RESULT_STEP, FLOW_ASK))],
+            ]
+        )
+        for result_id, texts in flow["result_texts"].items():
+            results[(result_id, lang)] = Rendered(texts[lang], result_keyboard)
+
+    rules = [(conditions, result_id) for conditions, result_id in flow["results"]]
+    for _, result_id in rules + [({}, flow["default_result"])]:
+        if result_id not in flow["result_texts"]:
+            raise ValueError(f"Flow {flow_id}: no text for result {result_id!r}")
+    return CompiledFlow(ids[0], transitions, screens, results, rules, flow["default_result"], summary_labels)
+
+
+COMPILED_FLOWS: Dict[str, CompiledFlow] = {flow_id: compile_flow(flow_id, flow) for flow_id, flow in FLOWS.items()}
+
+
+def flow_current_step(flow: CompiledFlow, answers: List[Tuple[str, str]]) -> Optional[str]:
+    if not answers:
+        return flow.first
+    return flow.transitions[tuple(answers[-1])]
+
+
+def flow_result(flow: CompiledFlow, answers: List[Tuple[str, str]]) -> str:
+    given = dict(answers)
+    for conditions, result_id in flow.rules:
+        if all(given.get(step) in options for step, options in conditions.items()):
+            return result_id
+    return flow.default_result
+
+
+def flow_summary_text(summary: Optional[Dict[str, Any]]) -> str:
+    # Сводка для консультанта: «Беременность: Планируем беременность» по строке на ответ
+    if not summary or summary.get("flow") not in COMPILED_FLOWS:
+        return ""
+    labels = COMPILED_FLOWS[summary["flow"]].summary_labels
+    lines = [": ".join(labels[tuple(answer)]) for answer in summary["answers"] if tuple(answer) in labels]
+    return "\n".join(lines)
+
+
+# Ответы анкеты — сведения о здоровье: в user_data (и в файле persistence) только через PII
+
+def save_flow_state(user_data: Dict[str, Any], flow_id: str, answers: List[Tuple[str, str]]) -> None:
+    # Прогресс хранится компактно: id сценария и список пар (шаг, вариант) — текущий шаг выводится из них
+    user_data["flow"] = [flow_id, PII.encrypt(json.dumps(answers))]
+
+
+def load_flow_state(user_data: Dict[str, Any]) -> Optional[Tuple[str, List[Tuple[str, str]]]]:
+    state = user_data.get("flow")
+    if not state:
+        return None
+    flow_id, answers = state
+    if isinstance(answers, str):
+        try:
+            answers = json.loads(PII.decrypt(answers))
+        except ValueError:
+            return None
+    return flow_id, [tuple(answer) for answer in answers]
+
+
+def save_flow_summary(user_data: Dict[str, Any], summary: Dict[str, Any]) -> None:
+    # at — для срока хранения (evict_idle_users удаляет сводки старше PII_RETENTION_DAYS)
+    user_data["flow_summary"] = {"at": time.time(), "data": PII.encrypt(json.dumps(summary))}
+
+
+def load_flow_summary(user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    stored = user_data.get("flow_summary")
+    if not stored or "data" not in stored:
+        # сохранённое до шифрования — как есть
+        return stored
+    try:
+        return json.loads(PII.decrypt(stored["data"]))
+    except ValueError:
+        return None
+
+
+async def start_flow(update: Update, context: ContextTypes.DEFAULT_TYPE, flow_id: str) -> None:
+    lang = get_lang(update, context)
+    flow = COMPILED_FLOWS[flow_id]
+    save_flow_state(context.user_data, flow_id, [])
+    rendered = flow.screens[(flow.first, lang)]
+    await update.effective_message.reply_text(rendered.text, reply_markup=rendered.reply_markup)
+
+
+async def flow_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    lang = get_lang(update, context)
+    _, flow_id, step_id, action = query.data.split(":", 3)
+    flow = COMPILED_FLOWS.get(flow_id)
+    if flow is None:
+        await query.answer()
+        return
+
+    if step_id == FLOW_RESULT_STEP and action == FLOW_ASK:
+        await query.answer()
+        context.user_data["free_mode"] = True
+        await query.message.reply_text(
+            t("free_q_button_explain", lang), reply_markup=main_menu_keyboard(lang, free_mode=True)
         )
-        keyboard = build_plan_main_keyboard()
+        return
+
+    state = load_flow_state(context.user_data)
+    if not state or state[0] != flow_id:
+        # кнопка из старой, уже закрытой анкеты
+        await query.answer(t("flow_expired", lang))
+        return
+    answers = state[1]
+
+    if action == FLOW_CLOSE:
+        context.user_data.pop("flow", None)
+        await query.answer()
+        await query.edit_message_text(t("flow_closed", lang))
+        return
+
+    current = flow_current_step(flow, answers)
+    if step_id != current:
+        # нажали кнопку под устаревшим экраном — просто показываем актуальный шаг
+        return await edit_rendered(query, flow.screens[(current, lang)])
+
+    if action == FLOW_BACK:
+        if answers:
+            answers.pop()
+            save_flow_state(context.user_data, flow_id, answers)
+        return await edit_rendered(query, flow.screens[(flow_current_step(flow, answers), lang)])
+
+    if (step_id, action) not in flow.transitions:
+        await query.answer()
+        return
+    answers.append((step_id, action))
+    next_step = flow.transitions[(step_id, action)]
+    if next_step is not None:
+        save_flow_state(context.user_data, flow_id, answers)
+        return await edit_rendered(query, flow.screens[(next_step, lang)])
 
-    if text and keyboard:
-        await query.edit_message_text(text, reply_markup=keyboard)
+    result_id = flow_result(flow, answers)
+    context.user_data.pop("flow", None)
+    save_flow_summary(context.user_data, {"flow": flow_id, "answers": answers, "result": result_id})
+    await edit_rendered(query, flow.results[(result_id, lang)])
 
 
 # -------------------------
@@ -594,529 +2168,1794 @@ async def plan_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 CONTACT_NAME, CONTACT_PHONE, CONTACT_HOW, CONTACT_COMMENT = range(4)
 
+# На этих шагах люди чаще всего бросают форму — по ним и напоминаем
+CONTACT_REMINDER_STATES = (CONTACT_HOW, CONTACT_PHONE)
 
-def build_contact_method_keyboard(lang: str, user) -> ReplyKeyboardMarkup:
-    rows = [["Оставить номер телефона"]]
-    username = getattr(user, "username", None) if user else None
-    if username:
-        rows.append(["Использовать мой @username"])
-    rows.append(["Другая форма связи (email и т.п.)"])
+
+def schedule_contact_reminder_job(application: Application, user_id: int, reminder: Dict[str, Any]) -> None:
+    """
+    Отмену не ищем по всей очереди: задача сама проверяет, что напоминание в user_data
+    всё ещё то же самое. Устаревшие задачи просто ничего не делают.
+    """
+    if application.job_queue is None:
+        return
+    application.job_queue.run_once(
+        contact_reminder,
+        when=max(reminder["at"] - time.time(), 0),
+        data=reminder["at"],
+        chat_id=reminder["chat_id"],
+        user_id=user_id,
+        name=f"contact_reminder_{user_id}",
+    )
+
+
+def with_contact_reminder(callback):
+    """
+    Обёртка для шагов формы контактов: если шаг оставил пользователя на CONTACT_HOW/CONTACT_PHONE,
+    заводим напоминание, иначе (отмена, готово, другой шаг) — снимаем.
+    """
+
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        state = await callback(update, context)
+        if state is None or not update.effective_user:
+            return state
+        if state in CONTACT_REMINDER_STATES and CONTACT_REMINDER_HOURS > 0 and update.effective_chat:
+            reminder = {
+                "at": time.time() + CONTACT_REMINDER_HOURS * 3600,
+                "chat_id": update.effective_chat.id,
+                "lang": get_lang(update, context),
+            }
+            context.user_data["contact_reminder"] = reminder
+            schedule_contact_reminder_job(context.application, update.effective_user.id, reminder)
+        else:
+            context.user_data.pop("contact_reminder", None)
+        return state
+
+    return wrapper
+
+
+async def contact_reminder(context: ContextTypes.DEFAULT_TYPE):
+    job = context.job
+    reminder = context.user_data.get("contact_reminder") if context.user_data is not None else None
+    if not reminder or reminder["at"] != job.data:
+        return
+    context.user_data.pop("contact_reminder", None)
+    await safe_send(context.bot, job.chat_id, t("contact_reminder", reminder["lang"]))
+
+
+async def contact_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Диалог завершён по таймауту: данные незаконченной формы больше не нужны,
+    а напоминание «ответьте на последний вопрос» уже не имеет смысла.
+    """
+    context.user_data.pop("contact", None)
+    context.user_data.pop("contact_reminder", None)
+
+
+async def restore_contact_reminders(application: Application) -> None:
+    """
+    JobQueue живёт только в памяти, поэтому после перезапуска поднимаем напоминания
+    из сохранённых user_data.
+    """
+    for user_id, data in application.user_data.items():
+        reminder = data.get("contact_reminder")
+        if reminder:
+            schedule_contact_reminder_job(application, user_id, reminder)
+
+
+def _contact_method_keyboard(lang: str, with_username: bool) -> ReplyKeyboardMarkup:
+    rows = [[t("btn_leave_phone", lang)]]
+    if with_username:
+        rows.append([t("btn_use_username", lang)])
+    rows.append([t("btn_other_contact", lang)])
     rows.append([t("btn_back", lang), t("btn_cancel", lang)])
     return ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
 
 
+CONTACT_METHOD_KEYBOARDS: Dict[Tuple[str, bool], ReplyKeyboardMarkup] = {
+    (lang, with_username): _contact_method_keyboard(lang, with_username) for lang in LANGS for with_username in (False, True)
+}
+PHONE_FORM_KEYBOARD = per_lang(
+    lambda lang: ReplyKeyboardMarkup(
+        [[KeyboardButton(t("btn_send_phone", lang), request_contact=True)], [t("btn_back", lang), t("btn_cancel", lang)]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+)
+
+
+def build_contact_method_keyboard(lang: str, user) -> ReplyKeyboardMarkup:
+    username = getattr(user, "username", None) if user else None
+    return CONTACT_METHOD_KEYBOARDS[(lang, bool(username))]
+
+
+# Черновик заявки переживает перезапуск в persistence — имя и контакт храним через PII
+CONTACT_PII_FIELDS = ("name", "phone")
+
+
+def set_contact_field(context: ContextTypes.DEFAULT_TYPE, field: str, value: str) -> None:
+    draft = context.user_data.setdefault("contact", {})
+    draft[field] = PII.encrypt(value) if field in CONTACT_PII_FIELDS else value
+
+
+def contact_draft(context: ContextTypes.DEFAULT_TYPE) -> Dict[str, Any]:
+    return {field: PII.decrypt(value) for field, value in context.user_data.get("contact", {}).items()}
+
+
 async def contact_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
+    lang = get_lang(update, context)
     context.user_data["contact"] = {}
     await update.message.reply_text(
         t("name_ask", lang),
-        reply_markup=ReplyKeyboardMarkup([[t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
+        reply_markup=CANCEL_KEYBOARD[lang],
     )
     return CONTACT_NAME
 
 
 async def contact_start_from_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
+    lang = get_lang(update, context)
     context.user_data["contact"] = {"source": "plan"}
     query = update.callback_query
     await query.answer()
     await query.message.reply_text(
         t("name_ask", lang),
-        reply_markup=ReplyKeyboardMarkup([[t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
+        reply_markup=CANCEL_KEYBOARD[lang],
     )
     return CONTACT_NAME
 
 
 async def contact_start_from_doctor(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
+    lang = get_lang(update, context)
     context.user_data["contact"] = {"source": "doctor"}
+    context.user_data["audience"] = "doctor"
     query = update.callback_query
     await query.answer()
     await query.message.reply_text(
         t("name_ask", lang),
-        reply_markup=ReplyKeyboardMarkup([[t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
+        reply_markup=CANCEL_KEYBOARD[lang],
     )
     return CONTACT_NAME
 
 
-async def contact_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    text = (update.message.text or "").strip()
-    if is_cancel(text, lang):
-        await update.message.reply_text("Отменено. Возвращаю вас в главное меню.", reply_markup=main_menu_keyboard(lang))
-        return ConversationHandler.END
+async def contact_start_from_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    query = update.callback_query
+    flow_id = query.data.partition(":")[2]
+    context.user_data["contact"] = {"source": f"flow:{flow_id}"}
+    await query.answer()
+    await query.message.reply_text(
+        t("name_ask", lang),
+        reply_markup=CANCEL_KEYBOARD[lang],
+    )
+    return CONTACT_NAME
+
+
+async def contact_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    text = (update.message.text or "").strip()
+    if is_cancel(text):
+        context.user_data.pop("contact", None)
+        await update.message.reply_text(t("cancelled", lang), reply_markup=main_menu_keyboard(lang))
+        return ConversationHandler.END
+
+    set_contact_field(context, "name", text)
+    kb = build_contact_method_keyboard(lang, update.effective_user)
+    await update.message.reply_text(t("contact_how_ask", lang), reply_markup=kb)
+    return CONTACT_HOW
+
+
+async def contact_how(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    text = (update.message.text or "").strip()
+
+    if is_cancel(text):
+        context.user_data.pop("contact", None)
+        await update.message.reply_text(t("cancelled", lang), reply_markup=main_menu_keyboard(lang))
+        return ConversationHandler.END
+
+    if is_back(text):
+        await update.message.reply_text(
+            t("name_ask", lang),
+            reply_markup=CANCEL_KEYBOARD[lang],
+        )
+        return CONTACT_NAME
+
+    if is_button(text, "btn_leave_phone"):
+        set_contact_field(context, "how", "Телефон")
+        await update.message.reply_text(t("send_phone_prompt", lang), reply_markup=PHONE_FORM_KEYBOARD[lang])
+        return CONTACT_PHONE
+
+    if is_button(text, "btn_use_username"):
+        user = update.effective_user
+        username = getattr(user, "username", None) if user else None
+        if not username:
+            await update.message.reply_text(t("no_username_form", lang))
+            return CONTACT_HOW
+
+        set_contact_field(context, "how", "Telegram username")
+        set_contact_field(context, "phone", f"@{username}")
+        await update.message.reply_text(
+            t("comment_ask", lang),
+            reply_markup=BACK_CANCEL_KEYBOARD[lang],
+        )
+        return CONTACT_COMMENT
+
+    if is_button(text, "btn_other_contact") or text.startswith("Другая форма связи"):
+        set_contact_field(context, "how", "Другая форма связи")
+        await update.message.reply_text(
+            t("other_contact_ask", lang),
+            reply_markup=BACK_CANCEL_KEYBOARD[lang],
+        )
+        return CONTACT_PHONE
+
+    await update.message.reply_text(t("choose_option", lang), reply_markup=build_contact_method_keyboard(lang, update.effective_user))
+    return CONTACT_HOW
+
+
+async def contact_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    data = context.user_data.get("contact", {})
+    how = data.get("how")
+
+    if update.message.contact:
+        phone_number = update.message.contact.phone_number
+        set_contact_field(context, "phone", normalize_phone(phone_number, international=True) or phone_number)
+        if not how:
+            set_contact_field(context, "how", "Телефон")
+
+        await update.message.reply_text(
+            t("comment_ask", lang),
+            reply_markup=BACK_CANCEL_KEYBOARD[lang],
+        )
+        return CONTACT_COMMENT
+
+    text = (update.message.text or "").strip()
+
+    if is_cancel(text):
+        context.user_data.pop("contact", None)
+        await update.message.reply_text(t("cancelled", lang), reply_markup=main_menu_keyboard(lang))
+        return ConversationHandler.END
+
+    if is_back(text):
+        kb = build_contact_method_keyboard(lang, update.effective_user)
+        await update.message.reply_text(t("contact_how_ask", lang), reply_markup=kb)
+        return CONTACT_HOW
+
+    if how == "Другая форма связи":
+        parsed = parse_contact(text, DEFAULT_PHONE_REGION)
+        if parsed is None:
+            await update.message.reply_text(
+                t("other_contact_invalid", lang),
+                reply_markup=BACK_CANCEL_KEYBOARD[lang],
+            )
+            return CONTACT_PHONE
+        set_contact_field(context, "phone", parsed.value)
+        await update.message.reply_text(
+            t("comment_ask", lang),
+            reply_markup=BACK_CANCEL_KEYBOARD[lang],
+        )
+        return CONTACT_COMMENT
+
+    phone = normalize_phone(text, DEFAULT_PHONE_REGION)
+    if phone is None:
+        await update.message.reply_text(
+            t("phone_invalid", lang),
+            reply_markup=BACK_CANCEL_KEYBOARD[lang],
+        )
+        return CONTACT_PHONE
+
+    set_contact_field(context, "phone", phone)
+    if not how:
+        set_contact_field(context, "how", "Телефон")
+
+    await update.message.reply_text(
+        t("comment_ask", lang),
+        reply_markup=BACK_CANCEL_KEYBOARD[lang],
+    )
+    return CONTACT_COMMENT
+
+
+async def contact_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    text = (update.message.text or "").strip()
+
+    if is_cancel(text):
+        context.user_data.pop("contact", None)
+        await update.message.reply_text(t("cancelled", lang), reply_markup=main_menu_keyboard(lang))
+        return ConversationHandler.END
+
+    if is_back(text):
+        kb = build_contact_method_keyboard(lang, update.effective_user)
+        await update.message.reply_text(t("contact_how_ask", lang), reply_markup=kb)
+        return CONTACT_HOW
+
+    # комментарий сразу уходит в заявку — в черновик его не пишем
+    data = {**contact_draft(context), "comment": text}
+    flow_summary = load_flow_summary(context.user_data)
+    user = update.effective_user
+    owner_text = render(
+        "lead",
+        lang,
+        name=data.get("name"),
+        contact=data.get("phone"),
+        how=data.get("how"),
+        comment=data.get("comment"),
+        source=data.get("source"),
+        flow_title=FLOWS.get(flow_summary.get("flow"), {}).get("title") if flow_summary else None,
+        flow_summary=flow_summary_text(flow_summary),
+        **user_fields(user),
+    )
+
+    await send_to_operator(update, context, owner_text, update_key(update, "lead"))
+    record_lead(context.bot_data, user.id if user else None, data.get("name"), data.get("phone"), data.get("source"))
+    # Заявка ушла — черновик с именем, телефоном и комментарием больше не храним
+    context.user_data.pop("contact", None)
+    context.user_data.pop("flow_summary", None)
+
+    await update.message.reply_text(t("contact_done_user", lang), reply_markup=main_menu_keyboard(lang))
+    return ConversationHandler.END
+
+
+# -------------------------
+# FAQ (пациенты)
+# -------------------------
+
+PatientFaqItem = Dict[str, Any]
+
+PATIENT_FAQ_LIST: List[PatientFaqItem] = [
+    {
+        "id": "what_is_screening",
+        "title": {
+            "ru": "Что такое скрининг на носительство наследственных заболеваний?",
+            "en": "What is carrier screening for inherited diseases?",
+        },
+        "answer": {
+            "ru": (
+                "Скрининг на носительство — это анализ ДНК, который показывает, "
+                "является ли человек носителем генетических изменений, "
+                "связанных с тяжёлыми наследственными заболеваниями.\n\n"
+                "Важно: у самого носителя заболевание, как правило, не проявляется. "
+                "Риск возникает, если оба будущих родителя являются носителями одного и того же заболевания."
+            ),
+            "en": (
+                "Carrier screening is a DNA test that shows "
+                "whether a person carries genetic changes "
+                "linked to severe inherited diseases.\n\n"
+                "Important: carriers themselves usually have no symptoms. "
+                "The risk arises when both future parents carry the same disease."
+            ),
+        },
+    },
+    {
+        "id": "who_needs",
+        "title": {
+            "ru": "Кому имеет смысл проходить такой скрининг?",
+            "en": "Who should consider this screening?",
+        },
+        "answer": {
+            "ru": (
+                "Чаще всего скрининг на носительство рекомендуют парам, которые планируют беременность "
+                "или уже ждут ребёнка.\n\n"
+                "Особенно полезен анализ, если:\n"
+                "• в семье были случаи тяжёлых наследственных заболеваний;\n"
+                "• супруги состоят в родстве;\n"
+                "• пара хочет заранее оценить возможные генетические риски.\n\n"
+                "Но пройти скрининг может и любой взрослый человек, который задумывается о здоровье будущих детей."
+            ),
+            "en": (
+                "Carrier screening is most often recommended to couples who are planning a pregnancy "
+                "or already expecting a baby.\n\n"
+                "The test is especially useful if:\n"
+                "• there have been severe inherited diseases in the family;\n"
+                "• the partners are blood relatives;\n"
+                "• the couple wants to assess possible genetic risks in advance.\n\n"
+                "But any adult who thinks about the health of future children can take the screening."
+            ),
+        },
+    },
+    {
+        "id": "when_to_do",
+        "title": {
+            "ru": "Когда лучше проходить скрининг на носительство?",
+            "en": "When is the best time for carrier screening?",
+        },
+        "answer": {
+            "ru": (
+                "Оптимальное время — ещё до зачатия. Так у пары есть максимальный выбор вариантов.\n\n"
+                "Но пройти скрининг можно и во время беременности — это тоже даёт полезную информацию "
+                "и помогает планировать дальнейшие шаги вместе с врачами."
+            ),
+            "en": (
+                "The best time is before conception — that gives the couple the widest range of options.\n\n"
+                "But screening during pregnancy is also possible — it still gives useful information "
+                "and helps plan the next steps together with doctors."
+            ),
+        },
+    },
+]
+
+
+def build_patient_faq_keyboard(lang: str) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(item["title"][lang], callback_data=f"faq_{item['id']}")] for item in PATIENT_FAQ_LIST
+    ]
+    keyboard.append([InlineKeyboardButton(t("btn_to_main", lang), callback_data="faq_back")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+PATIENT_FAQ_KEYBOARD = per_lang(build_patient_faq_keyboard)
+FAQ_RESPONSES: Dict[Tuple[str, str], Rendered] = {
+    (f"faq_{item['id']}", lang): Rendered(item["answer"][lang], PATIENT_FAQ_KEYBOARD[lang])
+    for item in PATIENT_FAQ_LIST
+    for lang in LANGS
+}
+FAQ_FALLBACK = per_lang(lambda lang: Rendered(t("faq_choose", lang), PATIENT_FAQ_KEYBOARD[lang]))
+FAQ_MENU = per_lang(lambda lang: Rendered(t("faq_menu_title", lang), PATIENT_FAQ_KEYBOARD[lang], "Markdown"))
+
+
+async def faq_menu_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    rendered = FAQ_MENU[lang]
+    if update.message:
+        await update.message.reply_text(rendered.text, reply_markup=rendered.reply_markup, parse_mode=rendered.parse_mode)
+    else:
+        await edit_rendered(update.callback_query, rendered)
+
+
+async def faq_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    lang = get_lang(update, context)
+    if data == "faq_back":
+        await query.edit_message_text(t("back_to_main", lang))
+        return await show_main_menu(update, context)
+
+    await edit_rendered(query, FAQ_RESPONSES.get((data, lang), FAQ_FALLBACK[lang]))
+
+
+# -------------------------
+# Меню для врачей
+# -------------------------
+
+DOCTOR_MENU_SCREENING = "doctor_menu_screening"
+DOCTOR_MENU_HOW_TO_RECOMMEND = "doctor_menu_how_to_recommend"
+DOCTOR_MENU_WHICH_TEST = "doctor_menu_which_test"
+DOCTOR_MENU_PATIENT_TYPES = "doctor_menu_patient_types"
+DOCTOR_MENU_CONTACT = "doctor_menu_contact"
+DOCTOR_MENU_FAQ = "doctor_menu_faq"
+
+DOCTOR_BUTTONS: Dict[str, Dict[str, str]] = {
+    DOCTOR_MENU_SCREENING: {
+        "ru": "Что такое скрининг на носительство для практикующего врача?",
+        "en": "What is carrier screening for a practising doctor?",
+    },
+    DOCTOR_MENU_HOW_TO_RECOMMEND: {
+        "ru": "Как объяснить пациенту, зачем это нужно?",
+        "en": "How to explain to a patient why it matters?",
+    },
+    DOCTOR_MENU_WHICH_TEST: {
+        "ru": "Какой тест выбрать в практике?",
+        "en": "Which test to choose in practice?",
+    },
+    DOCTOR_MENU_PATIENT_TYPES: {
+        "ru": "Каким пациентам особенно важно предложить тест?",
+        "en": "Which patients should especially be offered the test?",
+    },
+}
+
+
+def build_doctor_main_keyboard(lang: str) -> InlineKeyboardMarkup:
+    keyboard = [[InlineKeyboardButton(labels[lang], callback_data=key)] for key, labels in DOCTOR_BUTTONS.items()]
+    keyboard += [
+        [InlineKeyboardButton(t("btn_contacts_inline", lang), callback_data="contact_from_doctor")],
+        [InlineKeyboardButton(t("btn_doctor_faq", lang), callback_data=DOCTOR_MENU_FAQ)],
+        [InlineKeyboardButton(t("btn_to_main", lang), callback_data="doc_back_main")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+DOCTOR_MAIN_KEYBOARD = per_lang(build_doctor_main_keyboard)
+
+
+async def doctor_menu_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # для маршрутизации: вопросы врачей уходят консультантам с тегом doctor
+    context.user_data["audience"] = "doctor"
+    lang = get_lang(update, context)
+    await update.message.reply_text(t("doctor_title", lang), reply_markup=DOCTOR_MAIN_KEYBOARD[lang])
+
+
+DOCTOR_TEXTS: Dict[str, Dict[str, str]] = {
+    DOCTOR_MENU_SCREENING: {
+        "ru": (
+            "Скрининг на носительство для практикующего врача\n\n"
+            "Инструмент, который помогает заранее выявить пары с повышенным риском "
+            "рождения ребёнка с наследственным заболеванием.\n\n"
+            "Для врача это может быть полезно:\n"
+            "• как часть планирования беременности;\n"
+            "• чтобы экономить время на объяснениях;\n"
+            "• чтобы снижать число неожиданных тяжёлых случаев."
+        ),
+        "en": (
+            "Carrier screening for a practising doctor\n\n"
+            "A tool that helps identify in advance couples with an increased risk "
+            "of having a child with an inherited disease.\n\n"
+            "For a doctor it can be useful:\n"
+            "• as part of pregnancy planning;\n"
+            "• to save time on explanations;\n"
+            "• to reduce the number of unexpected severe cases."
+        ),
+    },
+    DOCTOR_MENU_HOW_TO_RECOMMEND: {
+        "ru": (
+            "Как объяснить пациенту, зачем это нужно?\n\n"
+            "Часто помогают простые формулировки:\n"
+            "• «Это анализ, который помогает заранее понять риски наследственных заболеваний у детей»\n"
+            "• «Он не ставит диагноз — он отвечает на вопрос: есть ли у пары скрытый риск»\n"
+            "• «Если риск есть, появляется выбор вариантов, что делать дальше»"
+        ),
+        "en": (
+            "How to explain to a patient why it matters?\n\n"
+            "Simple phrases often help:\n"
+            "• “This test helps understand the risk of inherited diseases in children in advance”\n"
+            "• “It doesn’t make a diagnosis — it answers whether the couple has a hidden risk”\n"
+            "• “If there is a risk, you get options for what to do next”"
+        ),
+    },
+    DOCTOR_MENU_WHICH_TEST: {
+        "ru": (
+            "Какой тест выбрать в практике?\n\n"
+            "Обычно отталкиваются от:\n"
+            "• семейного анамнеза;\n"
+            "• этнических особенностей;\n"
+            "• тактики планирования беременности.\n\n"
+            "Если нужно — можно оставить контакты, чтобы обсудить сценарии под вашу практику."
+        ),
+        "en": (
+            "Which test to choose in practice?\n\n"
+            "The choice usually depends on:\n"
+            "• family history;\n"
+            "• ethnic background;\n"
+            "• the pregnancy planning approach.\n\n"
+            "If needed, leave your contacts to discuss options for your practice."
+        ),
+    },
+    DOCTOR_MENU_PATIENT_TYPES: {
+        "ru": (
+            "Каким пациентам особенно важно предложить тест?\n\n"
+            "Часто выделяют группы:\n"
+            "• семейный анамнез по наследственным заболеваниям;\n"
+            "• близкородственные браки;\n"
+            "• неблагоприятные исходы беременности в прошлом;\n"
+            "• популяции с высокой частотой отдельных заболеваний.\n\n"
+            "Но скрининг может быть и частью обычной подготовки к беременности."
+        ),
+        "en": (
+            "Which patients should especially be offered the test?\n\n"
+            "Commonly highlighted groups:\n"
+            "• family history of inherited diseases;\n"
+            "• consanguineous couples;\n"
+            "• adverse pregnancy outcomes in the past;\n"
+            "• populations with a high frequency of certain diseases.\n\n"
+            "But screening can also be part of routine pregnancy preparation."
+        ),
+    },
+    DOCTOR_MENU_CONTACT: {
+        "ru": "Оставить контакты можно в главном меню.",
+        "en": "You can leave your contacts from the main menu.",
+    },
+}
+
+DOCTOR_RESPONSES: Dict[Tuple[str, str], Rendered] = {
+    (key, lang): Rendered(texts[lang], DOCTOR_MAIN_KEYBOARD[lang]) for key, texts in DOCTOR_TEXTS.items() for lang in LANGS
+}
+
+
+async def doctor_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    lang = get_lang(update, context)
+
+    if data == "doc_back_main":
+        await query.edit_message_text(t("back_to_main", lang))
+        return await show_main_menu(update, context)
+
+    if data == DOCTOR_MENU_FAQ:
+        return await doctor_faq_menu_entry(update, context)
+
+    rendered = DOCTOR_RESPONSES.get((data, lang))
+    if rendered:
+        await edit_rendered(query, rendered)
+
+
+DoctorFaqItem = Dict[str, Any]
+
+DOCTOR_FAQ_LIST: List[DoctorFaqItem] = [
+    {
+        "id": "how_to_start",
+        "title": {
+            "ru": "С чего начать внедрение скрининга на носительство в практике?",
+            "en": "Where to start with carrier screening in your practice?",
+        },
+        "answer": {
+            "ru": (
+                "1) Определить, в каких группах пациентов это наиболее уместно.\n"
+                "2) Понять, какие панели вы используете как базовые.\n"
+                "3) Подготовить 2–3 простые фразы для объяснения пациентам.\n"
+                "4) При необходимости — иметь «материал для чтения», чтобы пациент пришёл на повторный разговор подготовленным."
+            ),
+            "en": (
+                "1) Decide which patient groups it is most relevant for.\n"
+                "2) Choose which panels you use as the baseline.\n"
+                "3) Prepare 2–3 simple phrases to explain it to patients.\n"
+                "4) If needed, have “reading material” so the patient comes to the follow-up conversation prepared."
+            ),
+        },
+    },
+    {
+        "id": "what_if_patient_afraid",
+        "title": {
+            "ru": "Что делать, если пациент боится анализа?",
+            "en": "What if the patient is afraid of the test?",
+        },
+        "answer": {
+            "ru": (
+                "Обычно помогает спокойная рамка:\n"
+                "«Этот анализ не говорит, что обязательно будет проблема. Он помогает понять, есть ли скрытый риск — "
+                "и если да, у нас появляется выбор, что делать дальше»."
+            ),
+            "en": (
+                "A calm framing usually helps:\n"
+                "“This test doesn’t say there will definitely be a problem. It helps understand whether there is a hidden risk — "
+                "and if there is, we get a choice of what to do next.”"
+            ),
+        },
+    },
+]
+
+
+def build_doctor_faq_keyboard(lang: str) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(item["title"][lang], callback_data=f"dfaq_{item['id']}")] for item in DOCTOR_FAQ_LIST
+    ]
+    keyboard.append([InlineKeyboardButton(t("btn_to_main", lang), callback_data="dfaq_back")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+DOCTOR_FAQ_KEYBOARD = per_lang(build_doctor_faq_keyboard)
+DOCTOR_FAQ_RESPONSES: Dict[Tuple[str, str], Rendered] = {
+    (f"dfaq_{item['id']}", lang): Rendered(item["answer"][lang], DOCTOR_FAQ_KEYBOARD[lang])
+    for item in DOCTOR_FAQ_LIST
+    for lang in LANGS
+}
+DOCTOR_FAQ_FALLBACK = per_lang(lambda lang: Rendered(t("faq_choose", lang), DOCTOR_FAQ_KEYBOARD[lang]))
+DOCTOR_FAQ_MENU = per_lang(
+    lambda lang: Rendered(t("faq_doctor_title", lang) + t("doctor_intro", lang), DOCTOR_FAQ_KEYBOARD[lang], "Markdown")
+)
+
+
+async def doctor_faq_menu_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    rendered = DOCTOR_FAQ_MENU[lang]
+    if update.message:
+        await update.message.reply_text(rendered.text, reply_markup=rendered.reply_markup, parse_mode=rendered.parse_mode)
+    else:
+        await edit_rendered(update.callback_query, rendered)
+
+
+async def doctor_faq_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    data = query.data
+    lang = get_lang(update, context)
+    if data == "dfaq_back":
+        await query.edit_message_text(t("back_to_main", lang))
+        return await show_main_menu(update, context)
+
+    await edit_rendered(query, DOCTOR_FAQ_RESPONSES.get((data, lang), DOCTOR_FAQ_FALLBACK[lang]))
+
+
+# -------------------------
+# Поиск по FAQ и текстам меню
+# -------------------------
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+_STEM_LEN = 5
+_STOP_WORDS = {
+    "что", "как", "это", "если", "или", "для", "при", "уже", "так", "она", "они", "его", "еще",
+    "the", "and", "for", "what", "how", "this", "that", "with", "are", "you", "can",
+}
+
+
+def search_tokens(text: str) -> List[str]:
+    """
+    Грубый, но быстрый стемминг: слово обрезается до первых пяти букв.
+    Для наших текстов этого хватает, чтобы «носитель», «носителя» и «носительство» совпали.
+    """
+    words = _WORD_RE.findall((text or "").lower().replace("ё", "е"))
+    return [w[:_STEM_LEN] for w in words if len(w) > 2 and w not in _STOP_WORDS]
+
+
+def build_search_documents() -> List[Dict[str, str]]:
+    """
+    Собираем всё, что можно показать пользователю, на всех языках: FAQ для пациентов и врачей
+    и тексты inline-меню. callback — данные кнопки, по которой этот ответ открывается в боте.
+    """
+    docs: List[Dict[str, str]] = []
+    for lang in LANGS:
+        for prefix, items, audience in (("faq", PATIENT_FAQ_LIST, "patient"), ("dfaq", DOCTOR_FAQ_LIST, "doctor")):
+            for item in items:
+                callback = f"{prefix}_{item['id']}"
+                docs.append(
+                    {
+                        "id": f"{lang}_{callback}",
+                        "title": item["title"][lang],
+                        "text": item["answer"][lang],
+                        "callback": callback,
+                        "audience": audience,
+                        "lang": lang,
+                    }
+                )
+        for texts, audience in ((PLAN_TEXTS, "patient"), (DOCTOR_TEXTS, "doctor")):
+            for key, body in texts.items():
+                title, _, text = body[lang].partition("\n\n")
+                if not text:
+                    continue
+                docs.append(
+                    {"id": f"{lang}_{key}", "title": title, "text": text, "callback": key, "audience": audience, "lang": lang}
+                )
+    return docs
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс с ранжированием BM25.
+    Веса считаются один раз при построении, поиск — это просуммировать готовые числа
+    по нескольким спискам, так что на нашем объёме он укладывается в микросекунды.
+    """
+
+    TITLE_BOOST = 2
+
+    def __init__(self, docs: List[Dict[str, str]], k1: float = 1.5, b: float = 0.75):
+        self.docs = docs
+        self.postings: Dict[str, List[Tuple[int, float]]] = {}
+
+        doc_tokens = [search_tokens(d["title"]) * self.TITLE_BOOST + search_tokens(d["text"]) for d in docs]
+        avg_len = sum(len(toks) for toks in doc_tokens) / max(len(doc_tokens), 1)
+
+        tfs: List[Dict[str, int]] = []
+        df: Dict[str, int] = {}
+        for toks in doc_tokens:
+            tf: Dict[str, int] = {}
+            for tok in toks:
+                tf[tok] = tf.get(tok, 0) + 1
+            tfs.append(tf)
+            for tok in tf:
+                df[tok] = df.get(tok, 0) + 1
+
+        n = len(docs)
+        for i, tf in enumerate(tfs):
+            norm = k1 * (1 - b + b * len(doc_tokens[i]) / avg_len) if avg_len else k1
+            for tok, freq in tf.items():
+                idf = math.log(1 + (n - df[tok] + 0.5) / (df[tok] + 0.5))
+                weight = idf * freq * (k1 + 1) / (freq + norm)
+                self.postings.setdefault(tok, []).append((i, weight))
+
+    def search(
+        self,
+        query: str,
+        limit: int = 5,
+        min_score: float = 0.0,
+        audience: Optional[str] = None,
+        lang: Optional[str] = None,
+    ) -> List[Dict[str, str]]:
+        scores: Dict[int, float] = {}
+        for tok in set(search_tokens(query)):
+            for i, weight in self.postings.get(tok, ()):
+                doc = self.docs[i]
+                if (audience and doc["audience"] != audience) or (lang and doc["lang"] != lang):
+                    continue
+                scores[i] = scores.get(i, 0.0) + weight
+        best = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+        return [self.docs[i] for i, score in best if score > min_score]
+
+
+SEARCH_INDEX = SearchIndex(build_search_documents())
+
+# Ниже этого порога совпадение обычно случайное («вопрос», «ребёнок») — лучше ничего не предлагать
+SUGGEST_MIN_SCORE = 2.0
+SUGGEST_LIMIT = 3
+
+
+def build_suggestions_keyboard(text: str, lang: str) -> Optional[InlineKeyboardMarkup]:
+    docs = SEARCH_INDEX.search(text, limit=SUGGEST_LIMIT, min_score=SUGGEST_MIN_SCORE, audience="patient", lang=lang)
+    if not docs:
+        return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton(d["title"], callback_data=d["callback"])] for d in docs])
+
+
+INLINE_CACHE_TIME = 300
+
+
+def build_inline_result(doc: Dict[str, str]) -> InlineQueryResultArticle:
+    text = f"{doc['title']}\n\n{doc['text']}\n\n{t('inline_ask_own', doc['lang'])} {deeplink('question')}"
+    return InlineQueryResultArticle(
+        id=doc["id"],
+        title=doc["title"],
+        description=doc["text"][:100],
+        input_message_content=InputTextMessageContent(text),
+    )
+
+
+# Результаты собираем заранее: на каждый запрос остаётся только выбрать готовые объекты
+INLINE_RESULTS: Dict[str, InlineQueryResultArticle] = {doc["id"]: build_inline_result(doc) for doc in SEARCH_INDEX.docs}
+INLINE_DEFAULT_RESULTS = per_lang(
+    lambda lang: [INLINE_RESULTS[doc["id"]] for doc in SEARCH_INDEX.docs if doc["lang"] == lang][:10]
+)
+
+
+async def inline_faq_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Inline-режим: @bot <вопрос> в любом чате — врач может сразу переслать ответ пациенту.
+    Запрос ищется по всем языкам; пустой запрос показывает список на языке пользователя.
+    """
+    query = update.inline_query
+    text = (query.query or "").strip()
+    if text:
+        results = [INLINE_RESULTS[doc["id"]] for doc in SEARCH_INDEX.search(text, limit=10)]
+        await query.answer(results, cache_time=INLINE_CACHE_TIME)
+        return
+    # список зависит от языка пользователя — такой ответ нельзя кешировать для всех
+    await query.answer(INLINE_DEFAULT_RESULTS[get_lang(update, context)], cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+
+# -------------------------
+# Ответ владельца пользователю (через reply)
+# -------------------------
+
+# Только строка заголовка целиком: так её печатает USER_HEADER
+USER_HEADER_RE = re.compile(r"^User ID: (\d+)$", re.MULTILINE)
+
+
+def reply_target(chat_id: int, message: Message, quote: Optional[TextQuote]) -> Optional[int]:
+    """
+    Кому адресован ответ консультанта. Адресата знает outbox: кому принадлежит доставленное
+    сообщение и с какой позиции начинается блок каждого пользователя в сводке. Текст
+    пользователя внутри сообщения (в нём может быть что угодно, в том числе «User ID: …»)
+    на выбор адресата не влияет. Сводку с несколькими пользователями — только по цитате.
+    Сообщения, которых в outbox нет (отправлены мимо очереди или удалены по сроку хранения),
+    принимаем, лишь если в тексте ровно одна строка заголовка.
+    """
+    blocks = OUTBOX.recipients(chat_id, message.message_id) if OUTBOX is not None else None
+    if blocks is None:
+        headers = USER_HEADER_RE.findall(message.text)
+        return int(headers[0]) if len(headers) == 1 else None
+    if len(blocks) == 1:
+        return blocks[0][0]
+    if quote is None:
+        return None
+    end = quote.position + utf16_len(quote.text)
+    for i, (user_id, offset) in enumerate(blocks):
+        next_offset = blocks[i + 1][1] if i + 1 < len(blocks) else None
+        if offset <= quote.position and (next_offset is None or end <= next_offset):
+            return user_id
+    # цитата в заголовке сводки или захватывает два блока
+    return None
+
+
+async def owner_auto_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.effective_user or not is_operator(update.effective_user.id):
+        return
+    msg = update.message
+    if not msg or not msg.text:
+        return
+    if not msg.reply_to_message or not msg.reply_to_message.text:
+        return
+
+    if "User ID:" not in msg.reply_to_message.text:
+        return
+
+    user_id = reply_target(msg.chat_id, msg.reply_to_message, msg.quote)
+    if user_id is None:
+        await msg.reply_text(
+            "Не удалось определить, кому ответ. Если в сообщении несколько пользователей — "
+            "выделите текст в блоке нужного и ответьте на цитату."
+        )
+        return
+
+    if not await safe_send(context.bot, user_id, msg.text):
+        await msg.reply_text("Не удалось доставить ответ пользователю — подробности в логах.")
+        return
+    record_operator_reply(context.bot_data, update.effective_user.id, user_id)
+
+# -------------------------
+# Админ-команды владельца: счётчики в памяти, без обхода user_data и таблиц
+# -------------------------
+
+ACTIVE_WINDOW_MINUTES = 15
+LATENCY_SAMPLES = 500
+LEADS_KEEP = 500
+
+
+class RuntimeStats:
+    """
+    Живые счётчики процесса. Обновляются на каждом апдейте за O(1),
+    поэтому /stats и /active отвечают мгновенно при любом числе пользователей.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.updates = 0
+        # user_id -> время последнего апдейта; порядок — от давних к свежим
+        self.last_seen: "OrderedDict[int, float]" = OrderedDict()
+        self.free_mode: set = set()
+        self.latency: Dict[str, deque] = {}
+        self._inflight: Dict[int, Tuple[str, float]] = {}
+        # user_id -> размер user_data в байтах (pickle, как в persistence), сумма — инкрементально
+        self.user_bytes: Dict[int, int] = {}
+        self.user_bytes_total = 0
+
+    def touch(self, user_id: int, now: float) -> None:
+        self.last_seen[user_id] = now
+        self.last_seen.move_to_end(user_id)
+        # дольше суток не храним: /active смотрит только на последние часы
+        while self.last_seen:
+            oldest_id, oldest = next(iter(self.last_seen.items()))
+            if now - oldest < 86400:
+                break
+            del self.last_seen[oldest_id]
+
+    def active_since(self, cutoff: float) -> List[Tuple[int, float]]:
+        active = []
+        for user_id in reversed(self.last_seen):
+            seen = self.last_seen[user_id]
+            if seen < cutoff:
+                break
+            active.append((user_id, seen))
+        return active
+
+    def update_started(self, update: Update) -> None:
+        self.updates += 1
+        self._inflight[update.update_id] = (update_kind(update), time.perf_counter())
+
+    def update_finished(self, update: Update, user_data: Optional[Dict[str, Any]]) -> None:
+        started = self._inflight.pop(update.update_id, None)
+        if started is not None:
+            kind, t0 = started
+            samples = self.latency.get(kind)
+            if samples is None:
+                samples = self.latency[kind] = deque(maxlen=LATENCY_SAMPLES)
+            samples.append(time.perf_counter() - t0)
+        user = update.effective_user
+        if user and user_data is not None:
+            if user_data.get("free_mode"):
+                self.free_mode.add(user.id)
+            else:
+                self.free_mode.discard(user.id)
+            if user.id not in self.user_bytes or random.random() < USER_DATA_SIZE_SAMPLE:
+                self.measure_user(user.id, user_data)
+
+    def measure_user(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        size = len(pickle.dumps(user_data, protocol=pickle.HIGHEST_PROTOCOL))
+        self.user_bytes_total += size - self.user_bytes.get(user_id, 0)
+        self.user_bytes[user_id] = size
+
+    def drop_user_size(self, user_id: int) -> None:
+        self.user_bytes_total -= self.user_bytes.pop(user_id, 0)
+
+    def user_bytes_report(self) -> Tuple[int, int, int]:
+        # (пользователей с замером, байт всего, байт у самого «тяжёлого»); max — только по запросу /stats
+        return len(self.user_bytes), self.user_bytes_total, max(self.user_bytes.values(), default=0)
+
+
+def update_kind(update: Update) -> str:
+    if update.callback_query:
+        return "callback:" + (update.callback_query.data or "").split("_", 1)[0]
+    if update.inline_query:
+        return "inline"
+    if update.message:
+        text = update.message.text or ""
+        return "command" if text.startswith("/") else "message"
+    return "other"
+
 
-    context.user_data["contact"]["name"] = text
-    kb = build_contact_method_keyboard(lang, update.effective_user)
-    await update.message.reply_text("Как с вами связаться?", reply_markup=kb)
-    return CONTACT_HOW
+STATS = RuntimeStats()
 
 
-async def contact_how(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    text = (update.message.text or "").strip()
+async def finish_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Последняя группа: все обработчики отработали, фиксируем время ответа.
+    # user_data — через get: context.user_data заново создал бы запись, удалённую /forget
+    user = update.effective_user
+    STATS.update_finished(update, context.application.user_data.get(user.id) if user else None)
 
-    if is_cancel(text, lang):
-        await update.message.reply_text("Отменено. Возвращаю вас в главное меню.", reply_markup=main_menu_keyboard(lang))
-        return ConversationHandler.END
 
-    if is_back(text, lang):
-        await update.message.reply_text(
-            t("name_ask", lang),
-            reply_markup=ReplyKeyboardMarkup([[t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
-        )
-        return CONTACT_NAME
+def record_lead(bot_data: Dict[str, Any], user_id, name: str, contact: str, source: str) -> None:
+    leads = bot_data.setdefault("leads", [])
+    leads.append(
+        {"at": time.time(), "user_id": user_id, "name": PII.encrypt(name), "contact": PII.encrypt(contact), "source": source}
+    )
+    if len(leads) > LEADS_KEEP:
+        del leads[: len(leads) - LEADS_KEEP]
+    day = time.strftime("%Y-%m-%d")
+    counts = bot_data.setdefault("lead_counts", {})
+    counts[day] = counts.get(day, 0) + 1
 
-    if text == "Оставить номер телефона":
-        context.user_data["contact"]["how"] = "Телефон"
-        kb = ReplyKeyboardMarkup(
-            [[KeyboardButton("Отправить номер телефона", request_contact=True)], [t("btn_back", lang), t("btn_cancel", lang)]],
-            resize_keyboard=True,
-            one_time_keyboard=True,
-        )
-        await update.message.reply_text("Нажмите кнопку ниже, чтобы отправить номер телефона:", reply_markup=kb)
-        return CONTACT_PHONE
 
-    if text == "Использовать мой @username":
-        user = update.effective_user
-        username = getattr(user, "username", None) if user else None
-        if not username:
-            await update.message.reply_text("У вас не установлен username в Telegram. Выберите другой способ связи.")
-            return CONTACT_HOW
+def process_memory_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        import resource
 
-        context.user_data["contact"]["how"] = "Telegram username"
-        context.user_data["contact"]["phone"] = f"@{username}"
-        await update.message.reply_text(
-            t("comment_ask", lang),
-            reply_markup=ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
-        )
-        return CONTACT_COMMENT
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-    if text.startswith("Другая форма связи"):
-        context.user_data["contact"]["how"] = "Другая форма связи"
-        await update.message.reply_text(
-            "Напишите удобный способ связи (email или другой мессенджер):",
-            reply_markup=ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
-        )
-        return CONTACT_PHONE
 
-    await update.message.reply_text("Пожалуйста, выберите один из предложенных вариантов.", reply_markup=build_contact_method_keyboard(lang, update.effective_user))
-    return CONTACT_HOW
+def format_age(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    return f"{seconds // 86400} д {seconds % 86400 // 3600} ч"
 
 
-async def contact_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    data = context.user_data.get("contact", {})
-    how = data.get("how")
+def percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
 
-    if update.message.contact:
-        phone_number = update.message.contact.phone_number
-        context.user_data["contact"]["phone"] = phone_number
-        if not how:
-            context.user_data["contact"]["how"] = "Телефон"
 
-        await update.message.reply_text(
-            t("comment_ask", lang),
-            reply_markup=ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
-        )
-        return CONTACT_COMMENT
+async def admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "Команды владельца:\n"
+        "/stats — сводка по боту\n"
+        f"/active — кто писал за последние {ACTIVE_WINDOW_MINUTES} мин\n"
+        "/leads [today|yesterday|week] — заявки за период\n"
+        "/queue — кто ждёт ответа и что не доставлено\n"
+        "/mute <user_id>, /unmute <user_id> — не пересылать сообщения пользователя\n"
+        "/reload — сбросить ошибки транспорта и сразу разослать очередь\n"
+        "/profile, /flame [сек] — время обработчиков и CPU-профиль (при PROFILING=1)\n"
+        "/forget <user_id> — удалить все данные пользователя\n"
+        "/digest — разослать накопленные сводки сейчас (при DIGEST_INTERVAL_MINUTES)"
+    )
 
-    text = (update.message.text or "").strip()
 
-    if is_cancel(text, lang):
-        await update.message.reply_text("Отменено. Возвращаю вас в главное меню.", reply_markup=main_menu_keyboard(lang))
-        return ConversationHandler.END
+def user_data_size_line() -> str:
+    measured, total, largest = STATS.user_bytes_report()
+    average = total // measured if measured else 0
+    return f"user_data: {total / 1024:.1f} КБ, в среднем {average} Б на пользователя, максимум {largest} Б"
+
+
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    state = routing_state(context.bot_data)
+    lead_counts = context.bot_data.get("lead_counts", {})
+    lines = [
+        f"Аптайм: {format_age(now - STATS.started)}, апдейтов: {STATS.updates}",
+        f"Активны за {ACTIVE_WINDOW_MINUTES} мин: {len(STATS.active_since(now - ACTIVE_WINDOW_MINUTES * 60))}, "
+        f"за сутки: {len(STATS.last_seen)}",
+        f"Свободный вопрос: {len(STATS.free_mode)}",
+        f"Ждут ответа консультанта: {len(state['waiting'])}",
+        f"Не доставлено консультантам: {OUTBOX.pending_total if OUTBOX else 0}",
+        f"Заявок сегодня: {lead_counts.get(time.strftime('%Y-%m-%d'), 0)}",
+        f"Пользователей в памяти: {len(context.application.user_data)}, процесс: {process_memory_mb():.1f} МБ",
+        user_data_size_line(),
+        f"Bot API: {'недоступен (circuit open)' if TELEGRAM_CIRCUIT.is_open else 'ok'}",
+        f"Задержка event loop: {LOOP_LAG.lag * 1000:.0f} мс (макс. {LOOP_LAG.max_lag * 1000:.0f} мс)",
+    ]
+    if STATS.latency:
+        lines += ["", "Время обработки, мс (p50 / p95 / max, n):"]
+        for kind, samples in sorted(STATS.latency.items()):
+            values = sorted(samples)
+            lines.append(
+                f"{kind}: {percentile(values, 0.5) * 1000:.1f} / {percentile(values, 0.95) * 1000:.1f} / "
+                f"{values[-1] * 1000:.1f}, {len(values)}"
+            )
+    await update.message.reply_text("\n".join(lines))
+
+
+async def admin_active(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    active = STATS.active_since(now - ACTIVE_WINDOW_MINUTES * 60)
+    if not active:
+        await update.message.reply_text(f"За последние {ACTIVE_WINDOW_MINUTES} мин никто не писал.")
+        return
+    lines = [f"Активны за {ACTIVE_WINDOW_MINUTES} мин: {len(active)}"]
+    for user_id, seen in active[:30]:
+        mark = " (свободный вопрос)" if user_id in STATS.free_mode else ""
+        lines.append(f"{user_id} — {int(now - seen) // 60} мин назад{mark}")
+    await update.message.reply_text("\n".join(lines))
 
-    if is_back(text, lang):
-        kb = build_contact_method_keyboard(lang, update.effective_user)
-        await update.message.reply_text("Как с вами связаться?", reply_markup=kb)
-        return CONTACT_HOW
 
-    if how == "Другая форма связи":
-        context.user_data["contact"]["phone"] = text
-        await update.message.reply_text(
-            t("comment_ask", lang),
-            reply_markup=ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
-        )
-        return CONTACT_COMMENT
+LEADS_PERIODS = {"today": 0, "yesterday": 1, "week": 6}
 
-    if not is_valid_phone(text):
-        await update.message.reply_text(
-            t("phone_invalid", lang),
-            reply_markup=ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
+
+async def admin_leads(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    period = (context.args[0].lower() if context.args else "today")
+    if period not in LEADS_PERIODS:
+        await update.message.reply_text("Использование: /leads [today|yesterday|week]")
+        return
+    days_back = LEADS_PERIODS[period]
+    today = time.mktime(time.strptime(time.strftime("%Y-%m-%d"), "%Y-%m-%d"))
+    since = today - days_back * 86400
+    until = today + 86400 if period != "yesterday" else today
+
+    # Заявки лежат по времени — идём с конца, пока не выйдем за начало периода
+    found = []
+    for lead in reversed(context.bot_data.get("leads", [])):
+        if lead["at"] < since:
+            break
+        if lead["at"] < until:
+            found.append(lead)
+    if not found:
+        await update.message.reply_text("Заявок за этот период нет.")
+        return
+    lines = [f"Заявок: {len(found)}"]
+    for lead in found[:30]:
+        at = time.strftime("%d.%m %H:%M", time.localtime(lead["at"]))
+        lines.append(
+            render("lead_line", **{**lead, "at": at, "name": PII.decrypt(lead["name"]), "contact": PII.decrypt(lead["contact"])})
         )
-        return CONTACT_PHONE
+    await update.message.reply_text("\n".join(lines))
 
-    context.user_data["contact"]["phone"] = text
-    if not how:
-        context.user_data["contact"]["how"] = "Телефон"
 
-    await update.message.reply_text(
-        t("comment_ask", lang),
-        reply_markup=ReplyKeyboardMarkup([[t("btn_back", lang), t("btn_cancel", lang)]], resize_keyboard=True, one_time_keyboard=True),
-    )
-    return CONTACT_COMMENT
+async def admin_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    now = time.time()
+    state = routing_state(context.bot_data)
+    waiting = sorted(state["waiting"].items(), key=lambda item: item[1]["since"])
+    lines = [
+        f"Ждут ответа: {len(waiting)}",
+        f"Не доставлено консультантам: {OUTBOX.pending_total if OUTBOX else 0}",
+        f"Ждут сводки: {sum(batch['count'] for batch in digest_state(context.bot_data).values())}",
+    ]
+    for user_id, info in waiting[:30]:
+        op = state["assigned"].get(user_id)
+        lines.append(f"{user_id} — {format_age(now - info['since'])}, консультант {op}")
+    await update.message.reply_text("\n".join(lines))
 
 
-async def contact_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    text = (update.message.text or "").strip()
+async def admin_digest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    pending = sum(batch["count"] for batch in digest_state(context.bot_data).values())
+    await digest_job(context)
+    await update.message.reply_text(f"Сводки отправлены, событий: {pending}")
 
-    if is_cancel(text, lang):
-        await update.message.reply_text("Отменено. Возвращаю вас в главное меню.", reply_markup=main_menu_keyboard(lang))
-        return ConversationHandler.END
 
-    if is_back(text, lang):
-        kb = build_contact_method_keyboard(lang, update.effective_user)
-        await update.message.reply_text("Как с вами связаться?", reply_markup=kb)
-        return CONTACT_HOW
+def parse_user_id_arg(context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+    if not context.args or not context.args[0].lstrip("-").isdigit():
+        return None
+    return int(context.args[0])
 
-    context.user_data["contact"]["comment"] = text
 
-    data = context.user_data.get("contact", {})
-    name = data.get("name", "-")
-    phone = data.get("phone", "-")
-    how = data.get("how", "-")
-    comment = data.get("comment", "-")
-    source = data.get("source", "-")
+async def admin_mute(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    muted = context.bot_data.setdefault("muted", set())
+    user_id = parse_user_id_arg(context)
+    if user_id is None:
+        listed = ", ".join(str(uid) for uid in sorted(muted)) or "никого"
+        await update.message.reply_text(f"Использование: /mute <user_id>\nСейчас без пересылки: {listed}")
+        return
+    muted.add(user_id)
+    close_thread(routing_state(context.bot_data), user_id)
+    await update.message.reply_text(f"Сообщения пользователя {user_id} больше не пересылаются. Вернуть: /unmute {user_id}")
 
-    user = update.effective_user
-    user_id = user.id if user else "–"
-    username = getattr(user, "username", None)
-    full_name = getattr(user, "full_name", None)
-
-    owner_lines = [
-        t("lead_sent_owner_title", lang),
-        "",
-        f"User ID: {user_id}",
-        f"Username: @{username}" if username else "Username: –",
-        f"Имя в Telegram: {full_name}" if full_name else "",
-        "",
-        f"Имя (из заявки): {name}",
-        f"Контакт: {phone}",
-        f"Как связаться удобнее: {how}",
-        f"Комментарий: {comment}",
-        f"Источник: {source}",
-    ]
-    owner_text = "\n".join([ln for ln in owner_lines if ln])
 
-    if OWNER_CHAT_ID:
-        try:
-            await context.bot.send_message(chat_id=OWNER_CHAT_ID, text=owner_text)
-        except Exception as e:
-            logger.error(f"Failed to send lead to owner: {e}")
+async def admin_unmute(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = parse_user_id_arg(context)
+    if user_id is None:
+        await update.message.reply_text("Использование: /unmute <user_id>")
+        return
+    context.bot_data.setdefault("muted", set()).discard(user_id)
+    await update.message.reply_text(f"Сообщения пользователя {user_id} снова пересылаются.")
 
-    await update.message.reply_text(t("contact_done_user", lang), reply_markup=main_menu_keyboard(lang))
-    return ConversationHandler.END
+
+async def admin_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Конфигурация и тексты зашиты в код/окружение; «перезагрузка» — это сброс
+    # временного состояния транспорта и немедленная доставка очереди
+    TELEGRAM_CIRCUIT.record_success()
+    OUTBOX_BACKOFF.clear()
+    delivered = await deliver_outbox(context.bot)
+    left = OUTBOX.pending_total if OUTBOX else 0
+    await update.message.reply_text(f"Готово: доставлено {delivered}, в очереди осталось {left}.")
 
 
 # -------------------------
-# FAQ (пациенты)
+# Профилирование (PROFILING=1)
 # -------------------------
 
-PatientFaqItem = Dict[str, Any]
-
-PATIENT_FAQ_LIST: List[PatientFaqItem] = [
-    {
-        "id": "what_is_screening",
-        "title": "Что такое скрининг на носительство наследственных заболеваний?",
-        "answer": (
-            "Скрининг на носительство — это анализ ДНК, который показывает, "
-            "является ли человек носителем генетических изменений, "
-            "связанных с тяжёлыми наследственными заболеваниями.\n\n"
-            "Важно: у самого носителя заболевание, как правило, не проявляется. "
-            "Риск возникает, если оба будущих родителя являются носителями одного и того же заболевания."
-        ),
-    },
-    {
-        "id": "who_needs",
-        "title": "Кому имеет смысл проходить такой скрининг?",
-        "answer": (
-            "Чаще всего скрининг на носительство рекомендуют парам, которые планируют беременность "
-            "или уже ждут ребёнка.\n\n"
-            "Особенно полезен анализ, если:\n"
-            "• в семье были случаи тяжёлых наследственных заболеваний;\n"
-            "• супруги состоят в родстве;\n"
-            "• пара хочет заранее оценить возможные генетические риски.\n\n"
-            "Но пройти скрининг может и любой взрослый человек, который задумывается о здоровье будущих детей."
-        ),
-    },
-    {
-        "id": "when_to_do",
-        "title": "Когда лучше проходить скрининг на носительство?",
-        "answer": (
-            "Оптимальное время — ещё до зачатия. Так у пары есть максимальный выбор вариантов.\n\n"
-            "Но пройти скрининг можно и во время беременности — это тоже даёт полезную информацию "
-            "и помогает планировать дальнейшие шаги вместе с врачами."
-        ),
-    },
-]
+HANDLER_TIMINGS = HandlerTimings(SLOW_HANDLER_MS / 1000)
+STALL_WATCHDOG = StallWatchdog(STALL_THRESHOLD_MS / 1000)
+LOOP_THREAD_ID: Optional[int] = None
+PROFILE_STOP = threading.Event()
 
-def build_patient_faq_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [[InlineKeyboardButton(item["title"], callback_data=f"faq_{item['id']}")] for item in PATIENT_FAQ_LIST]
-    keyboard.append([InlineKeyboardButton("В главное меню", callback_data="faq_back")])
-    return InlineKeyboardMarkup(keyboard)
 
+def instrument_handlers(application: Application) -> int:
+    """
+    Оборачиваем callback каждого зарегистрированного обработчика замером времени.
+    У ConversationHandler своего callback нет — оборачиваем вложенные обработчики
+    входа, всех состояний (включая TIMEOUT) и fallbacks.
+    """
+    wrapped = 0
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                nested = list(handler.entry_points) + list(handler.fallbacks)
+                for state_handlers in handler.states.values():
+                    nested.extend(state_handlers)
+            else:
+                nested = [handler]
+            for inner in nested:
+                inner.callback = HANDLER_TIMINGS.wrap(inner.callback)
+                wrapped += 1
+    return wrapped
+
+
+async def capture_profile(seconds: float) -> str:
+    if LOOP_THREAD_ID is None:
+        return ""
+    PROFILE_STOP.clear()
+    return await asyncio.to_thread(sample_profile, LOOP_THREAD_ID, seconds, PROFILE_SAMPLE_HZ, PROFILE_STOP)
+
+
+async def profile_to_file() -> None:
+    # SIGUSR1: kill -USR1 <pid>, результат — файл в PROFILE_DIR
+    folded = await capture_profile(PROFILE_SECONDS)
+    path = os.path.join(PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(folded)
+    logger.info("CPU profile written to %s", path)
+
+
+def start_profiling(application: Application) -> None:
+    global LOOP_THREAD_ID
+    LOOP_THREAD_ID = threading.get_ident()
+    _background_tasks.append(asyncio.create_task(STALL_WATCHDOG.heartbeat()))
+    STALL_WATCHDOG.start(LOOP_THREAD_ID)
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, lambda: _background_tasks.append(asyncio.create_task(profile_to_file()))
+        )
+    except (NotImplementedError, RuntimeError, AttributeError):
+        pass
+    logger.info(
+        "Profiling on: slow handler %.0f ms, stall %.0f ms, sampling %.0f Hz",
+        SLOW_HANDLER_MS,
+        STALL_THRESHOLD_MS,
+        PROFILE_SAMPLE_HZ,
+    )
 
-async def faq_menu_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    text = t("faq_menu_title", lang)
-    kb = build_patient_faq_keyboard()
-    if update.message:
-        await update.message.reply_text(text, reply_markup=kb, parse_mode="Markdown")
-    else:
-        await update.callback_query.edit_message_text(text, reply_markup=kb, parse_mode="Markdown")
 
+def stop_profiling() -> None:
+    STALL_WATCHDOG.stop()
+    PROFILE_STOP.set()
 
-async def faq_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
-    if data == "faq_back":
-        await query.edit_message_text("Возвращаю в главное меню…")
-        return await show_main_menu(update, context)
 
-    faq_id = data.replace("faq_", "", 1)
-    item = next((x for x in PATIENT_FAQ_LIST if x["id"] == faq_id), None)
-    if not item:
-        await query.edit_message_text("Выберите вопрос из меню ниже.", reply_markup=build_patient_faq_keyboard())
+async def admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not PROFILING:
+        await update.message.reply_text("Профилирование выключено, включается переменной PROFILING=1.")
         return
-
-    await query.edit_message_text(item["answer"], reply_markup=build_patient_faq_keyboard())
+    rows = HANDLER_TIMINGS.report()
+    lines = ["Обработчики, мс (p50 / p95 / max стена, средний CPU, n):"]
+    for name, n, p50, p95, worst, cpu in rows:
+        lines.append(f"{name}: {p50 * 1000:.1f} / {p95 * 1000:.1f} / {worst * 1000:.1f}, {cpu * 1000:.1f}, {n}")
+    if len(lines) == 1:
+        lines.append("замеров пока нет")
+    lines.append("")
+    lines.append(f"Зависаний loop > {STALL_THRESHOLD_MS:.0f} мс: {len(STALL_WATCHDOG.stalls)}")
+    if STALL_WATCHDOG.stalls:
+        at, stalled, stack = STALL_WATCHDOG.stalls[-1]
+        # последние кадры стека — там, где loop и застрял
+        tail = "\n".join(stack.strip().splitlines()[-6:])
+        lines.append(f"Последнее: {time.strftime('%H:%M:%S', time.localtime(at))}, {stalled * 1000:.0f} мс\n{tail}")
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+
+async def admin_flame(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not PROFILING:
+        await update.message.reply_text("Профилирование выключено, включается переменной PROFILING=1.")
+        return
+    seconds = PROFILE_SECONDS
+    if context.args and context.args[0].isdigit():
+        seconds = min(float(context.args[0]), 300)
+    await update.message.reply_text(f"Снимаю профиль {seconds:.0f} с…")
+    # Фоном: пока идёт сэмплирование, бот должен обрабатывать апдейты как обычно,
+    # иначе в профиль попадёт простаивающий loop
+    _background_tasks.append(asyncio.create_task(send_profile(context.bot, update.effective_chat.id, seconds)))
+
+
+async def send_profile(bot, chat_id: int, seconds: float) -> None:
+    folded = await capture_profile(seconds)
+    if not folded:
+        await safe_send(bot, chat_id, "Не удалось снять профиль.")
+        return
+    try:
+        await bot.send_document(
+            chat_id,
+            document=folded.encode(),
+            filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+            caption="flamegraph.pl profile.folded > profile.svg или speedscope.app",
+        )
+    except Exception as e:
+        logger.error("Failed to send CPU profile: %s", e)
 
 
 # -------------------------
-# Меню для врачей
+# Персональные данные: срок хранения и /forget
 # -------------------------
 
-DOCTOR_MENU_SCREENING = "doctor_menu_screening"
-DOCTOR_MENU_HOW_TO_RECOMMEND = "doctor_menu_how_to_recommend"
-DOCTOR_MENU_WHICH_TEST = "doctor_menu_which_test"
-DOCTOR_MENU_PATIENT_TYPES = "doctor_menu_patient_types"
-DOCTOR_MENU_CONTACT = "doctor_menu_contact"
-DOCTOR_MENU_FAQ = "doctor_menu_faq"
+def erase_user_data(application: Application, user_id: int) -> Dict[str, int]:
+    """
+    Удаляем пользователя из всех хранилищ бота: user_data/chat_data (и их копии в persistence),
+    заявки и маршрутизация в bot_data, очередь исходящих, напоминания, счётчики в памяти.
+    """
+    erased = {"user_data": 0, "leads": 0, "outbox": 0, "jobs": 0}
+    if user_id in application.user_data:
+        erased["user_data"] = 1
+    application.drop_user_data(user_id)
+    if user_id in application.chat_data:
+        # личный чат с ботом: chat_id совпадает с user_id
+        application.drop_chat_data(user_id)
+
+    bot_data = application.bot_data
+    leads = bot_data.get("leads", [])
+    kept = [lead for lead in leads if lead.get("user_id") != user_id]
+    erased["leads"] = len(leads) - len(kept)
+    if erased["leads"]:
+        bot_data["leads"] = kept
+    forget_routing(routing_state(bot_data), user_id)
+    bot_data.get("muted", set()).discard(user_id)
+    for op in list(digest_state(bot_data)):
+        pop_digest_user(bot_data, op, user_id)
+
+    if OUTBOX is not None:
+        erased["outbox"] = OUTBOX.forget(user_id)
+    if application.job_queue is not None:
+        for job in application.job_queue.get_jobs_by_name(f"contact_reminder_{user_id}"):
+            job.schedule_removal()
+            erased["jobs"] += 1
+
+    STATS.last_seen.pop(user_id, None)
+    STATS.free_mode.discard(user_id)
+    STATS.drop_user_size(user_id)
+    logger.info("Erased data of user %s: %s", user_id, erased)
+    return erased
+
+
+FORGET_KEYBOARD = per_lang(
+    lambda lang: InlineKeyboardMarkup(
+        [[
+            InlineKeyboardButton(t("btn_forget_yes", lang), callback_data="forget_yes"),
+            InlineKeyboardButton(t("btn_forget_no", lang), callback_data="forget_no"),
+        ]]
+    )
+)
 
 
-def build_doctor_main_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("Что такое скрининг на носительство для практикующего врача?", callback_data=DOCTOR_MENU_SCREENING)],
-        [InlineKeyboardButton("Как объяснить пациенту, зачем это нужно?", callback_data=DOCTOR_MENU_HOW_TO_RECOMMEND)],
-        [InlineKeyboardButton("Какой тест выбрать в практике?", callback_data=DOCTOR_MENU_WHICH_TEST)],
-        [InlineKeyboardButton("Каким пациентам особенно важно предложить тест?", callback_data=DOCTOR_MENU_PATIENT_TYPES)],
-        [InlineKeyboardButton("Оставить контакты", callback_data="contact_from_doctor")],
-        [InlineKeyboardButton("FAQ для врачей", callback_data=DOCTOR_MENU_FAQ)],
-        [InlineKeyboardButton("В главное меню", callback_data="doc_back_main")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
+async def forget_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lang = get_lang(update, context)
+    await update.message.reply_text(t("forget_confirm", lang), reply_markup=FORGET_KEYBOARD[lang])
 
 
-async def doctor_menu_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = build_doctor_main_keyboard()
+async def forget_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    lang = get_lang(update, context)
+    await query.answer()
+    if query.data != "forget_yes":
+        await query.edit_message_text(t("forget_kept", lang))
+        return
+    erase_user_data(context.application, query.from_user.id)
+    await query.edit_message_text(t("forget_done", lang))
+    await query.message.reply_text(t("main_menu_title", lang), reply_markup=main_menu_keyboard(lang))
+
+
+async def admin_forget(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = parse_user_id_arg(context)
+    if user_id is None:
+        await update.message.reply_text("Использование: /forget <user_id> — удалить все данные пользователя")
+        return
+    erased = erase_user_data(context.application, user_id)
     await update.message.reply_text(
-        "Я врач\n\nВыберите, что вам интересно:",
-        reply_markup=keyboard,
+        f"Данные пользователя {user_id} удалены: user_data {erased['user_data']}, заявок {erased['leads']}, "
+        f"сообщений в очереди {erased['outbox']}, напоминаний {erased['jobs']}."
     )
 
 
-async def doctor_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
+async def sweep_retention(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Понемногу за проход: порция отправленных сообщений из outbox по индексу,
+    заявки из начала списка (он упорядочен по времени), старые тексты ожидающих.
+    """
+    cutoff = time.time() - PII_RETENTION_DAYS * 86400
+    swept_outbox = OUTBOX.sweep(cutoff, RETENTION_BATCH) if OUTBOX is not None else 0
+
+    leads = context.bot_data.get("leads", [])
+    expired = 0
+    while expired < len(leads) and expired < RETENTION_BATCH and leads[expired]["at"] < cutoff:
+        expired += 1
+    if expired:
+        del leads[:expired]
+
+    for waiting in routing_state(context.bot_data)["waiting"].values():
+        if waiting["since"] < cutoff:
+            waiting.pop("text", None)
+
+    if swept_outbox or expired:
+        logger.info("Retention sweep: %d outbox rows, %d leads older than %.0f days", swept_outbox, expired, PII_RETENTION_DAYS)
+
+
+ADMIN_COMMANDS = {
+    "admin": admin_help,
+    "stats": admin_stats,
+    "active": admin_active,
+    "leads": admin_leads,
+    "queue": admin_queue,
+    "mute": admin_mute,
+    "unmute": admin_unmute,
+    "reload": admin_reload,
+    "profile": admin_profile,
+    "flame": admin_flame,
+    "forget": admin_forget,
+    "digest": admin_digest,
+}
 
-    if data == "doc_back_main":
-        await query.edit_message_text("Возвращаю в главное меню…")
-        return await show_main_menu(update, context)
 
-    text = ""
-    keyboard = None
+# -------------------------
+# Очистка user_data неактивных пользователей
+# -------------------------
 
-    if data == DOCTOR_MENU_SCREENING:
-        text = (
-            "Скрининг на носительство для практикующего врача\n\n"
-            "Инструмент, который помогает заранее выявить пары с повышенным риском "
-            "рождения ребёнка с наследственным заболеванием.\n\n"
-            "Для врача это может быть полезно:\n"
-            "• как часть планирования беременности;\n"
-            "• чтобы экономить время на объяснениях;\n"
-            "• чтобы снижать число неожиданных тяжёлых случаев."
-        )
-        keyboard = build_doctor_main_keyboard()
+async def touch_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Отметка активности для вытеснения старых user_data; сам апдейт обрабатывают следующие группы
+    STATS.update_started(update)
+    if update.effective_user:
+        now = time.time()
+        context.user_data["last_seen"] = now
+        STATS.touch(update.effective_user.id, now)
 
-    elif data == DOCTOR_MENU_HOW_TO_RECOMMEND:
-        text = (
-            "Как объяснить пациенту, зачем это нужно?\n\n"
-            "Часто помогают простые формулировки:\n"
-            "• «Это анализ, который помогает заранее понять риски наследственных заболеваний у детей»\n"
-            "• «Он не ставит диагноз — он отвечает на вопрос: есть ли у пары скрытый риск»\n"
-            "• «Если риск есть, появляется выбор вариантов, что делать дальше»"
-        )
-        keyboard = build_doctor_main_keyboard()
 
-    elif data == DOCTOR_MENU_WHICH_TEST:
-        text = (
-            "Какой тест выбрать в практике?\n\n"
-            "Обычно отталкиваются от:\n"
-            "• семейного анамнеза;\n"
-            "• этнических особенностей;\n"
-            "• тактики планирования беременности.\n\n"
-            "Если нужно — можно оставить контакты, чтобы обсудить сценарии под вашу практику."
-        )
-        keyboard = build_doctor_main_keyboard()
+async def evict_idle_users(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Сначала удаляем тех, кто не появлялся дольше USER_DATA_TTL_DAYS,
+    затем, если пользователей всё ещё больше USER_DATA_MAX_USERS, — самых давно неактивных.
+    Это удаление, а не выгрузка: drop_user_data стирает запись и из persistence, вернувшийся
+    пользователь начинает с чистого листа (незаконченная форма и ответы анкеты теряются).
+    Заодно снимает ответы анкеты (flow_summary) старше PII_RETENTION_DAYS у оставшихся.
+    """
+    application = context.application
+    cutoff = time.time() - USER_DATA_TTL_DAYS * 86400
+    last_seen = {}
+    summary_cutoff = time.time() - PII_RETENTION_DAYS * 86400
+    stale_summaries = []
+    for user_id, data in application.user_data.items():
+        last_seen[user_id] = data.get("last_seen", 0)
+        # срок хранения ответов анкеты — как у заявок; обход user_data и так делаем здесь
+        summary = data.get("flow_summary")
+        if summary is not None and summary.get("at", 0) < summary_cutoff:
+            stale_summaries.append(user_id)
+    for user_id in stale_summaries:
+        application.user_data[user_id].pop("flow_summary", None)
+    if stale_summaries:
+        application.mark_data_for_update_persistence(user_ids=stale_summaries)
+
+    expired = [user_id for user_id, seen in last_seen.items() if seen < cutoff]
+    overflow = len(last_seen) - len(expired) - USER_DATA_MAX_USERS
+    if overflow > 0:
+        alive = ((seen, user_id) for user_id, seen in last_seen.items() if seen >= cutoff)
+        expired.extend(user_id for _, user_id in heapq.nsmallest(overflow, alive))
+
+    # вместе с user_data уходят и его диалоги: иначе waiting/assigned растут без предела
+    state = routing_state(application.bot_data)
+    for user_id in expired:
+        application.drop_user_data(user_id)
+        forget_routing(state, user_id)
+        STATS.drop_user_size(user_id)
+
+    # размеры — из замеров после апдейтов (RuntimeStats.measure_user), без pickle всех пользователей
+    logger.info("user_data: deleted %d idle, kept %d users; %s", len(expired), len(application.user_data), user_data_size_line())
 
-    elif data == DOCTOR_MENU_PATIENT_TYPES:
-        text = (
-            "Каким пациентам особенно важно предложить тест?\n\n"
-            "Часто выделяют группы:\n"
-            "• семейный анамнез по наследственным заболеваниям;\n"
-            "• близкородственные браки;\n"
-            "• неблагоприятные исходы беременности в прошлом;\n"
-            "• популяции с высокой частотой отдельных заболеваний.\n\n"
-            "Но скрининг может быть и частью обычной подготовки к беременности."
-        )
-        keyboard = build_doctor_main_keyboard()
 
-    elif data == DOCTOR_MENU_CONTACT:
-        text = "Оставить контакты можно в главном меню."
-        keyboard = build_doctor_main_keyboard()
+# -------------------------
+# Проверки здоровья и корректная остановка
+# -------------------------
 
-    elif data == DOCTOR_MENU_FAQ:
-        return await doctor_faq_menu_entry(update, context)
+class LoopLagMonitor:
+    """
+    Раз в interval секунд засыпаем и смотрим, насколько позже проснулись.
+    Опоздание — это время, которое event loop был занят чем-то синхронным.
+    """
 
-    if text and keyboard:
-        await query.edit_message_text(text, reply_markup=keyboard)
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.last_tick = time.monotonic()
 
+    async def run(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag = max(0.0, now - expected)
+            self.max_lag = max(self.max_lag, self.lag)
+            self.last_tick = now
 
-DoctorFaqItem = Dict[str, Any]
+    def alive(self, threshold: float) -> bool:
+        return self.lag < threshold and time.monotonic() - self.last_tick < self.interval + threshold
 
-DOCTOR_FAQ_LIST: List[DoctorFaqItem] = [
-    {
-        "id": "how_to_start",
-        "title": "С чего начать внедрение скрининга на носительство в практике?",
-        "answer": (
-            "1) Определить, в каких группах пациентов это наиболее уместно.\n"
-            "2) Понять, какие панели вы используете как базовые.\n"
-            "3) Подготовить 2–3 простые фразы для объяснения пациентам.\n"
-            "4) При необходимости — иметь «материал для чтения», чтобы пациент пришёл на повторный разговор подготовленным."
-        ),
-    },
-    {
-        "id": "what_if_patient_afraid",
-        "title": "Что делать, если пациент боится анализа?",
-        "answer": (
-            "Обычно помогает спокойная рамка:\n"
-            "«Этот анализ не говорит, что обязательно будет проблема. Он помогает понять, есть ли скрытый риск — "
-            "и если да, у нас появляется выбор, что делать дальше»."
-        ),
-    },
-]
 
+LOOP_LAG = LoopLagMonitor()
+SHUTTING_DOWN = False
+_background_tasks: List[asyncio.Task] = []
 
-def build_doctor_faq_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [[InlineKeyboardButton(item["title"], callback_data=f"dfaq_{item['id']}")] for item in DOCTOR_FAQ_LIST]
-    keyboard.append([InlineKeyboardButton("В главное меню", callback_data="dfaq_back")])
-    return InlineKeyboardMarkup(keyboard)
 
+def is_ready(application: Application) -> bool:
+    # Готов принимать трафик: токен проверен (getMe), хранилище открыто, polling запущен
+    if SHUTTING_DOWN or OUTBOX is None or not application.running:
+        return False
+    try:
+        application.bot.bot
+    except RuntimeError:
+        return False
+    return True
 
-async def doctor_faq_menu_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = get_lang(update)
-    text = t("faq_doctor_title", lang) + t("doctor_intro", lang)
-    kb = build_doctor_faq_keyboard()
-    if update.message:
-        await update.message.reply_text(text, reply_markup=kb, parse_mode="Markdown")
-    else:
-        q = update.callback_query
-        await q.edit_message_text(text, reply_markup=kb, parse_mode="Markdown")
 
+def render_metrics(application: Application) -> str:
+    metrics = {
+        "carrier_bot_event_loop_lag_seconds": LOOP_LAG.lag,
+        "carrier_bot_event_loop_lag_max_seconds": LOOP_LAG.max_lag,
+        "carrier_bot_updates_total": STATS.updates,
+        "carrier_bot_active_users": len(STATS.active_since(time.time() - ACTIVE_WINDOW_MINUTES * 60)),
+        "carrier_bot_outbox_pending": OUTBOX.pending_total if OUTBOX else 0,
+        "carrier_bot_ready": int(is_ready(application)),
+    }
+    return "".join(f"{name} {value:g}\n" for name, value in metrics.items())
 
-async def doctor_faq_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    data = query.data
-    if data == "dfaq_back":
-        await query.edit_message_text("Возвращаю в главное меню…")
-        return await show_main_menu(update, context)
 
-    faq_id = data.replace("dfaq_", "", 1)
-    item = next((x for x in DOCTOR_FAQ_LIST if x["id"] == faq_id), None)
-    if not item:
-        await query.edit_message_text("Выберите вопрос из меню ниже.", reply_markup=build_doctor_faq_keyboard())
-        return
+def health_response(application: Application, path: str) -> Tuple[int, str]:
+    if path == "/healthz":
+        if LOOP_LAG.alive(LOOP_LAG_THRESHOLD):
+            return 200, "ok\n"
+        return 503, f"event loop lag {LOOP_LAG.lag:.3f}s\n"
+    if path == "/readyz":
+        return (200, "ready\n") if is_ready(application) else (503, "not ready\n")
+    if path == "/metrics":
+        return 200, render_metrics(application)
+    return 404, "not found\n"
 
-    await query.edit_message_text(item["answer"], reply_markup=build_doctor_faq_keyboard())
 
+async def serve_health_request(application: Application, reader, writer) -> None:
+    # Минимальный HTTP/1.0: только строка запроса, заголовки пропускаем
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) > 1 else "/"
+        status, body = health_response(application, path)
+        reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}[status]
+        payload = body.encode()
+        writer.write(
+            f"HTTP/1.0 {status} {reason}\r\nContent-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
 
-# -------------------------
-# Ответ владельца пользователю (через reply)
-# -------------------------
 
-async def owner_auto_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.effective_user or update.effective_user.id != OWNER_CHAT_ID:
-        return
-    msg = update.message
-    if not msg or not msg.text:
-        return
-    if not msg.reply_to_message or not msg.reply_to_message.text:
+async def start_health_server(application: Application) -> None:
+    _background_tasks.append(asyncio.create_task(LOOP_LAG.run()))
+    if not HEALTH_PORT:
         return
+    server = await asyncio.start_server(
+        functools.partial(serve_health_request, application), HEALTH_HOST, HEALTH_PORT
+    )
+    _background_tasks.append(asyncio.create_task(server.serve_forever()))
+    logger.info("Health server listening on %s:%s", HEALTH_HOST, HEALTH_PORT)
 
-    original_text = msg.reply_to_message.text
-    match = re.search(r"User ID:\s*(\d+)", original_text)
-    if not match:
+
+def begin_shutdown(application: Application) -> None:
+    """
+    SIGTERM/SIGINT: сразу перестаём считаться готовыми и ставим дедлайн на досылку,
+    затем штатная остановка PTB — polling, необработанные апдейты, задачи, persistence.
+    """
+    global SHUTTING_DOWN, DRAIN_DEADLINE
+    if SHUTTING_DOWN:
         return
+    SHUTTING_DOWN = True
+    DRAIN_DEADLINE = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    logger.info("Shutdown requested, draining for up to %.0fs", SHUTDOWN_DRAIN_SECONDS)
+    application.stop_running()
+
+
+def install_shutdown_handlers(application: Application) -> None:
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, begin_shutdown, application)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остаются обработчики run_polling по умолчанию
+            return
+
 
-    user_id = int(match.group(1))
+async def post_stop(application: Application) -> None:
+    # Апдейты и задачи уже обработаны; досылаем очередь, пока бот ещё может отправлять
+    global SHUTTING_DOWN, DRAIN_DEADLINE
+    SHUTTING_DOWN = True
+    if DRAIN_DEADLINE is None:
+        DRAIN_DEADLINE = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    # накопленные сводки — в ту же очередь: успеют уйти сейчас или сразу после перезапуска
+    if OUTBOX is not None:
+        for op in list(digest_state(application.bot_data)):
+            for key, text, blocks in take_digest(application.bot_data, op):
+                OUTBOX.put(op, text, key, blocks=blocks)
+    remaining = max(0.0, DRAIN_DEADLINE - time.monotonic())
     try:
-        await context.bot.send_message(chat_id=user_id, text=msg.text)
-    except Exception as e:
-        logger.error("Failed to forward owner reply to %s: %s", user_id, e)
+        delivered = await asyncio.wait_for(deliver_outbox(application.bot), timeout=remaining)
+    except asyncio.TimeoutError:
+        delivered = 0
+    logger.info(
+        "Outbox drained: %d delivered, %d left for next start", delivered, OUTBOX.pending_total if OUTBOX else 0
+    )
 
 
-def main():
-    if not BOT_TOKEN:
-        raise RuntimeError("Не задан BOT_TOKEN!")
+async def post_shutdown(application: Application) -> None:
+    # persistence уже сброшена на диск в Application.shutdown()
+    global OUTBOX
+    stop_profiling()
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    if OUTBOX is not None:
+        OUTBOX.close()
+        OUTBOX = None
+
+
+async def post_init(application: Application) -> None:
+    global OUTBOX, OUTBOX_LOCK, OUTBOX_WAKE
+    OUTBOX = Outbox(OUTBOX_DB, PII)
+    OUTBOX_LOCK = asyncio.Lock()
+    OUTBOX_WAKE = asyncio.Event()
+    # всё, что не успели отправить до перезапуска, уходит сразу после старта
+    OUTBOX_WAKE.set()
+    _background_tasks.append(asyncio.create_task(outbox_worker(application.bot)))
+
+    await restore_contact_reminders(application)
+    await start_health_server(application)
+    if PROFILING:
+        start_profiling(application)
+    install_shutdown_handlers(application)
+    if application.job_queue is not None:
+        interval = USER_DATA_SWEEP_MINUTES * 60
+        application.job_queue.run_repeating(evict_idle_users, interval=interval, first=interval, name="evict_idle_users")
+        application.job_queue.run_repeating(reassign_idle_threads, interval=300, first=300, name="reassign_idle_threads")
+        retention_interval = RETENTION_SWEEP_MINUTES * 60
+        application.job_queue.run_repeating(
+            sweep_retention, interval=retention_interval, first=retention_interval, name="sweep_retention"
+        )
+        if DIGEST_INTERVAL_MINUTES > 0:
+            digest_interval = DIGEST_INTERVAL_MINUTES * 60
+            application.job_queue.run_repeating(
+                digest_job, interval=digest_interval, first=digest_interval, name="digest"
+            )
+
+
+async def handle_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # При разомкнутом circuit breaker ответы в обработчиках падают сразу и массово —
+    # это ожидаемо, без трейсбэка на каждый апдейт
+    if isinstance(context.error, TelegramUnavailable):
+        logger.warning("Reply skipped: %s", context.error)
+        return
+    logger.error("Update %s caused an error", getattr(update, "update_id", None), exc_info=context.error)
+
 
-    app = Application.builder().token(BOT_TOKEN).build()
+def build_application(
+    token: str,
+    request: Optional[BaseRequest] = None,
+    get_updates_request: Optional[BaseRequest] = None,
+    persistence: Optional[BasePersistence] = None,
+) -> Application:
+    """
+    Собирает Application со всеми обработчиками. По умолчанию — боевые HTTPXRequest
+    и PicklePersistence; simulation.py подставляет сюда свой транспорт без сети.
+    """
+    app = (
+        Application.builder()
+        .token(token)
+        .request(CircuitBreakerRequest(request or build_send_request(), TELEGRAM_CIRCUIT))
+        .get_updates_request(get_updates_request or build_polling_request())
+        .persistence(persistence or PicklePersistence(filepath=PERSISTENCE_FILE))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Контактная форма — вход по кнопке главного меню + по inline из plan/doctor
     from re import escape
-    pattern = rf"^{escape(t('btn_contact', 'ru'))}$|^{escape(t('btn_contact', 'en'))}$"
-    contact_conv = ConversationHandler(
-        entry_points=[
-            MessageHandler(filters.Regex(pattern), contact_start),
-            CallbackQueryHandler(contact_start_from_plan, pattern=r"^contact_from_plan$"),
-            CallbackQueryHandler(contact_start_from_doctor, pattern=r"^contact_from_doctor$"),
-        ],
-        states={
-            CONTACT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, contact_name)],
-            CONTACT_PHONE: [MessageHandler(((filters.TEXT & ~filters.COMMAND) | filters.CONTACT), contact_phone)],
-            CONTACT_HOW: [MessageHandler(filters.TEXT & ~filters.COMMAND, contact_how)],
-            CONTACT_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, contact_comment)],
-        },
-        fallbacks=[MessageHandler(filters.Regex(r"^❌ Отмена$|^❌ Cancel$"), contact_comment)],
-        allow_reentry=True,
-    )
+    pattern = "|".join(rf"^{escape(t('btn_contact', lang))}$" for lang in LANGS)
+    cancel_pattern = "|".join(rf"^{escape(t('btn_cancel', lang))}$" for lang in LANGS)
+    # Состояние формы хранится на пользователя, а не на сообщение: кнопки входа из плана,
+    # врача и сценариев лежат в разных сообщениях. PTB предупреждает о CallbackQueryHandler
+    # при per_message=False — здесь это ожидаемо, поэтому предупреждение заглушено
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="If 'per_message=False'", category=PTBUserWarning)
+        contact_conv = ConversationHandler(
+            entry_points=[
+                MessageHandler(filters.Regex(pattern), with_contact_reminder(contact_start)),
+                CallbackQueryHandler(with_contact_reminder(contact_start_from_plan), pattern=r"^contact_from_plan$"),
+                CallbackQueryHandler(with_contact_reminder(contact_start_from_doctor), pattern=r"^contact_from_doctor$"),
+                CallbackQueryHandler(with_contact_reminder(contact_start_from_flow), pattern=r"^contact_from_flow:"),
+            ],
+            states={
+                CONTACT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, with_contact_reminder(contact_name))],
+                CONTACT_PHONE: [
+                    MessageHandler(((filters.TEXT & ~filters.COMMAND) | filters.CONTACT), with_contact_reminder(contact_phone))
+                ],
+                CONTACT_HOW: [MessageHandler(filters.TEXT & ~filters.COMMAND, with_contact_reminder(contact_how))],
+                CONTACT_COMMENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, with_contact_reminder(contact_comment))],
+                ConversationHandler.TIMEOUT: [TypeHandler(Update, contact_timeout)],
+            },
+            fallbacks=[MessageHandler(filters.Regex(cancel_pattern), with_contact_reminder(contact_comment))],
+            conversation_timeout=CONTACT_TIMEOUT_HOURS * 3600 if CONTACT_TIMEOUT_HOURS > 0 else None,
+            allow_reentry=True,
+            name="contact_conv",
+            persistent=True,
+            per_message=False,
+        )
+
+    app.add_handler(TypeHandler(Update, touch_user), group=-1)
+    app.add_error_handler(handle_error)
+    app.add_handler(TypeHandler(Update, finish_update), group=100)
+
+    # Команды владельца — раньше всех остальных, чтобы не попасть в общее меню
+    if OWNER_CHAT_ID:
+        owner_only = filters.Chat(chat_id=OWNER_CHAT_ID)
+        for command, callback in ADMIN_COMMANDS.items():
+            app.add_handler(CommandHandler(command, callback, filters=owner_only))
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("language", choose_language))
+    app.add_handler(CommandHandler("forget", forget_start))
+    app.add_handler(CallbackQueryHandler(forget_callback, pattern=r"^forget_(yes|no)$"))
+    app.add_handler(CallbackQueryHandler(language_callback, pattern=r"^lang_"))
     app.add_handler(contact_conv)
 
-    # Владелец отвечает реплаем на сообщение с User ID -> бот пересылает пользователю
+    # Консультант отвечает реплаем на сообщение с User ID -> бот пересылает пользователю
     app.add_handler(
         MessageHandler(
-            filters.TEXT & ~filters.COMMAND & filters.Chat(OWNER_CHAT_ID),
+            filters.TEXT & ~filters.COMMAND & filters.Chat(chat_id=STAFF_CHAT_IDS),
             owner_auto_reply,
         )
     )
 
     # Контакт из inline режима вопроса (когда пользователь нажал request_contact)
-    app.add_handler(MessageHandler(filters.CONTACT & ~filters.Chat(OWNER_CHAT_ID), free_contact_phone_handler))
+    app.add_handler(MessageHandler(filters.CONTACT & ~filters.Chat(chat_id=STAFF_CHAT_IDS), free_contact_phone_handler))
     app.add_handler(CallbackQueryHandler(free_contact_callback, pattern=r"^free_contact_"))
 
     # Главное меню + авто-распознавание вопроса
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Chat(chat_id=STAFF_CHAT_IDS), handle_main_menu))
 
     # Inline-меню
     app.add_handler(CallbackQueryHandler(plan_callback, pattern=r"^plan_"))
     app.add_handler(CallbackQueryHandler(doctor_menu_callback, pattern=r"^(doctor_menu_|doc_back_)"))
     app.add_handler(CallbackQueryHandler(faq_answer, pattern=r"^faq_"))
     app.add_handler(CallbackQueryHandler(doctor_faq_answer, pattern=r"^dfaq_"))
+    app.add_handler(CallbackQueryHandler(flow_callback, pattern=r"^flow:"))
+
+    # Inline-режим (нужно включить /setinline у @BotFather)
+    app.add_handler(InlineQueryHandler(inline_faq_search))
+
+    if PROFILING:
+        logger.info("Profiling: %d handler callbacks instrumented", instrument_handlers(app))
+
+    return app
+
+
+def main():
+    if not BOT_TOKEN:
+        raise RuntimeError("Не задан BOT_TOKEN!")
 
-    app.run_polling()
+    build_application(BOT_TOKEN).run_polling()
 
 
 if __name__ == "__main__":
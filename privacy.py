@@ -0,0 +1,125 @@
+"""
+Шифрование персональных данных на уровне отдельных полей.
+
+Ключ — PII_ENCRYPTION_KEY (Fernet, base64). Можно указать несколько через запятую:
+первым шифруем, любым расшифровываем — так ключ меняется без миграции данных.
+Без ключа значения хранятся как есть. Пакет cryptography нужен только с ключом.
+
+    python privacy.py --genkey
+    python privacy.py --bench 100000
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import logging
+import tempfile
+from typing import List, Optional
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+except ImportError:  # шифрование включается только при заданном ключе
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+
+class FieldCipher:
+    """
+    encrypt/decrypt для строковых полей. Зашифрованные значения помечены префиксом,
+    поэтому старые незашифрованные данные читаются как раньше, а включение ключа
+    не требует переписывать уже сохранённое.
+    """
+
+    PREFIX = "enc1:"
+
+    def __init__(self, keys: str = ""):
+        key_list = [key.strip() for key in keys.split(",") if key.strip()]
+        if key_list and Fernet is None:
+            raise RuntimeError("PII_ENCRYPTION_KEY задан, но пакет cryptography не установлен: pip install cryptography")
+        self._fernet = MultiFernet([Fernet(key) for key in key_list]) if key_list else None
+
+    @property
+    def enabled(self) -> bool:
+        return self._fernet is not None
+
+    def encrypt(self, value: Optional[str]) -> Optional[str]:
+        if self._fernet is None or value is None:
+            return value
+        return self.PREFIX + self._fernet.encrypt(str(value).encode()).decode("ascii")
+
+    def decrypt(self, value):
+        if not isinstance(value, str) or not value.startswith(self.PREFIX):
+            return value
+        if self._fernet is None:
+            return "[зашифровано]"
+        try:
+            return self._fernet.decrypt(value[len(self.PREFIX):].encode("ascii")).decode()
+        except InvalidToken:
+            logger.error("Cannot decrypt a PII field: unknown key or corrupted value")
+            return "[не удалось расшифровать]"
+
+
+def generate_key() -> str:
+    if Fernet is None:
+        raise RuntimeError("pip install cryptography")
+    return Fernet.generate_key().decode("ascii")
+
+
+# -------------------------
+# Бенчмарк: сколько стоит шифрование на типичной заявке
+# -------------------------
+
+SAMPLE_LEAD = (
+    "Новая заявка\nUser ID: 123456789\nUsername: @example\nИмя в Telegram: Анна\n"
+    "Имя (из заявки): Анна Иванова\nКонтакт: +79991234567\nКак связаться удобнее: Телефон\n"
+    "Комментарий: планируем беременность, у мужа в семье был случай муковисцидоза\nИсточник: plan"
+)
+
+
+def _bench_store(cipher: FieldCipher, n: int) -> float:
+    # Та же схема записи, что у Outbox: INSERT в WAL-режиме, одна строка — одно сообщение
+    with tempfile.TemporaryDirectory() as tmp:
+        db = sqlite3.connect(os.path.join(tmp, "bench.sqlite3"), isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE outbox (id INTEGER PRIMARY KEY, key TEXT UNIQUE, text TEXT)")
+        started = time.perf_counter()
+        for i in range(n):
+            db.execute("INSERT INTO outbox (key, text) VALUES (?, ?)", (f"lead:{i}", cipher.encrypt(SAMPLE_LEAD)))
+        for (text,) in db.execute("SELECT text FROM outbox"):
+            cipher.decrypt(text)
+        elapsed = time.perf_counter() - started
+        db.close()
+    return elapsed
+
+
+def _bench(n: int) -> None:
+    plain = FieldCipher()
+    encrypted = FieldCipher(generate_key())
+
+    started = time.perf_counter()
+    for _ in range(n):
+        encrypted.decrypt(encrypted.encrypt(SAMPLE_LEAD))
+    cipher_elapsed = time.perf_counter() - started
+    print(f"encrypt+decrypt: {cipher_elapsed / n * 1e6:.1f} µs/field ({len(SAMPLE_LEAD.encode())} bytes)")
+
+    for name, cipher in (("plain", plain), ("encrypted", encrypted)):
+        elapsed = _bench_store(cipher, n)
+        print(f"store {name}: {n / elapsed:,.0f} rows/s (write + read), {elapsed / n * 1e6:.1f} µs/row")
+
+
+def main(argv: List[str]) -> int:
+    if argv and argv[0] == "--genkey":
+        print(generate_key())
+        return 0
+    if argv and argv[0] == "--bench":
+        _bench(int(argv[1]) if len(argv) > 1 else 100_000)
+        return 0
+    print(__doc__.strip())
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
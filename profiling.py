@@ -0,0 +1,151 @@
+"""
+Инструменты для поиска тормозов: время обработчиков, зависания event loop
+и сэмплирующий профилировщик со свёрнутыми стеками (формат flamegraph.pl / speedscope).
+
+Модуль не зависит от telegram; как подключать его к обработчикам — решает main.py.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# -------------------------
+# Время обработчиков
+# -------------------------
+
+class HandlerTimings:
+    """
+    Для каждого обработчика — последние samples замеров (стена, CPU).
+    CPU считается по thread_time: он не растёт, пока корутина ждёт ответа Telegram,
+    поэтому большая разница «стена − CPU» — это сеть, а близкие значения — наш код.
+    Замер приблизительный: в ожидании могут выполняться чужие задачи.
+    """
+
+    def __init__(self, slow_seconds: float, samples: int = 500):
+        self.slow_seconds = slow_seconds
+        self.samples = samples
+        self.timings: Dict[str, Deque[Tuple[float, float]]] = {}
+
+    def record(self, name: str, wall: float, cpu: float) -> None:
+        bucket = self.timings.get(name)
+        if bucket is None:
+            bucket = self.timings[name] = deque(maxlen=self.samples)
+        bucket.append((wall, cpu))
+        if wall >= self.slow_seconds:
+            logger.warning("Slow handler %s: %.0f ms wall, %.0f ms cpu", name, wall * 1000, cpu * 1000)
+
+    def wrap(self, callback: Callable[..., Any]) -> Callable[..., Any]:
+        if getattr(callback, "__profiled__", False):
+            return callback
+        name = getattr(callback, "__qualname__", repr(callback))
+
+        @functools.wraps(callback)
+        async def timed(*args, **kwargs):
+            wall0, cpu0 = time.perf_counter(), time.thread_time()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - wall0, time.thread_time() - cpu0)
+
+        timed.__profiled__ = True
+        return timed
+
+    def report(self, limit: int = 15) -> List[Tuple[str, int, float, float, float, float]]:
+        """(имя, n, p50, p95, max по стене, средний CPU) — самые медленные по p95 сверху."""
+        rows = []
+        for name, bucket in self.timings.items():
+            walls = sorted(wall for wall, _ in bucket)
+            n = len(walls)
+            cpu_avg = sum(cpu for _, cpu in bucket) / n
+            rows.append((name, n, walls[n // 2], walls[min(n - 1, int(n * 0.95))], walls[-1], cpu_avg))
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:limit]
+
+
+# -------------------------
+# Зависания event loop
+# -------------------------
+
+class StallWatchdog:
+    """
+    Корутина-«пульс» обновляет метку времени, отдельный поток следит за ней.
+    Если пульса нет дольше threshold — loop занят синхронной работой, и поток
+    снимает его стек в этот момент (sys._current_frames), пока виновник ещё выполняется.
+    """
+
+    def __init__(self, threshold: float, keep: int = 20):
+        self.threshold = threshold
+        self.beat = time.monotonic()
+        self.stalls: Deque[Tuple[float, float, str]] = deque(maxlen=keep)
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+
+    async def heartbeat(self) -> None:
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def start(self, loop_thread_id: int) -> None:
+        self._thread_id = loop_thread_id
+        self.beat = time.monotonic()
+        threading.Thread(target=self._watch, name="stall-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _watch(self) -> None:
+        reported_beat = None
+        # пульс спит threshold/4, поэтому такая задержка ещё нормальна
+        limit = self.threshold * 1.25
+        while not self._stop.wait(self.threshold / 4):
+            beat = self.beat
+            stalled = time.monotonic() - beat
+            if stalled < limit or beat == reported_beat:
+                continue
+            reported_beat = beat
+            frame = sys._current_frames().get(self._thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            self.stalls.append((time.time(), stalled, stack))
+            logger.warning("Event loop stalled for %.0f ms, stack:\n%s", stalled * 1000, stack)
+
+
+# -------------------------
+# Сэмплирующий профилировщик
+# -------------------------
+
+def fold_stack(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def sample_profile(thread_id: int, seconds: float, hz: float, stop: Optional[threading.Event] = None) -> str:
+    """
+    Снимает стек потока thread_id hz раз в секунду в течение seconds.
+    Результат — свёрнутые стеки «a;b;c count», по строке на стек:
+    flamegraph.pl profile.folded > profile.svg или speedscope.app.
+    Запускать в отдельном потоке (asyncio.to_thread), чтобы не мешать самому loop.
+    """
+    counts: Counter = Counter()
+    interval = 1.0 / hz
+    stop = stop or threading.Event()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not stop.is_set():
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            counts[fold_stack(frame)] += 1
+        stop.wait(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
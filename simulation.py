@@ -0,0 +1,1047 @@
+"""
+Симуляция Telegram без токена и сети: Application из main.py работает как обычно,
+но вместо HTTPXRequest получает FakeBotAPI — транспорт, который хранит отправленные
+сообщения в памяти, записывает каждый вызов Bot API и умеет отвечать с задержкой
+или ошибкой. Апдейты от «пользователей» подаются в app.process_update.
+
+    python simulation.py                          — сценарии: deeplink, анкета, FAQ, ответ владельца, сбои API, circuit breaker, сводки
+    python simulation.py --users 2000             — нагрузка: пользователи параллельно проходят анкету
+    python simulation.py --users 2000 --latency 50 --concurrency 200
+    python simulation.py --bench 10000           — запись заявки в outbox: цель < 1 мс (с PII_ENCRYPTION_KEY — с шифрованием)
+    python simulation.py --users 500 --operators 1,2,4,8 --rate 50 --service 50   — время ответа при росте пула консультантов
+
+Код выхода ненулевой, если сценарий упал или в нагрузке потерялась заявка, — так его можно звать из CI.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import types
+import asyncio
+import logging
+import tempfile
+import argparse
+import itertools
+import contextlib
+from collections import Counter, OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# Настройки main.py читаются при импорте: владелец и очередь исходящих — свои, в памяти
+os.environ.setdefault("OWNER_CHAT_ID", "100")
+os.environ.setdefault("OUTBOX_DB", ":memory:")
+os.environ.setdefault("HEALTH_PORT", "0")
+
+from telegram import Update  # noqa: E402
+from telegram.error import NetworkError, TimedOut  # noqa: E402
+from telegram.ext import DictPersistence  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+import main  # noqa: E402
+from privacy import FieldCipher, generate_key  # noqa: E402
+
+SIM_TOKEN = "123456:SIMULATION"
+SIM_BOT = {"id": 123456, "is_bot": True, "first_name": "Carrier Bot", "username": "carrier_sim_bot"}
+MESSAGES_PER_CHAT = 50
+
+# Ответы Bot API на ошибки: (HTTP-статус, описание); transport — исключения транспорта
+FAULTS: Dict[str, Tuple[int, str]] = {
+    "flood": (429, "Too Many Requests: retry after {retry_after}"),
+    "forbidden": (403, "Forbidden: bot was blocked by the user"),
+    "bad_request": (400, "Bad Request: chat not found"),
+    "server": (502, "Bad Gateway"),
+}
+
+
+class Call(NamedTuple):
+    method: str
+    params: Dict[str, Any]
+    at: float
+
+
+class Fault(NamedTuple):
+    error: str  # ключ FAULTS, "network" или "timeout"
+    chat_id: Optional[int]
+    retry_after: int
+
+
+# -------------------------
+# Транспорт вместо Bot API
+# -------------------------
+
+class FakeBotAPI(BaseRequest):
+    """
+    Подменяет HTTP-транспорт Application. Все вызовы — в calls, отправленные
+    сообщения — по чатам (последние MESSAGES_PER_CHAT), чтобы пользователь мог
+    нажать inline-кнопку, а оператор — ответить реплаем.
+    latency — задержка каждого ответа в секундах; fail() — очередь ошибок на метод.
+    listeners — функции, которые видят каждое доставленное сообщение (например, консультант в нагрузке).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: List[Call] = []
+        self.methods: Counter = Counter()
+        self.messages: Dict[int, "OrderedDict[int, Dict[str, Any]]"] = {}
+        self._faults: Dict[str, Deque[Fault]] = {}
+        self._message_ids = itertools.count(1)
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    def fail(self, method: str, error: str = "network", times: int = 1, chat_id: Optional[int] = None,
+             retry_after: int = 1) -> None:
+        """Следующие times вызовов method (в чат chat_id, если задан) завершатся ошибкой error."""
+        if error not in FAULTS and error not in ("network", "timeout"):
+            raise ValueError(f"Unknown fault {error!r}, expected network, timeout or one of {sorted(FAULTS)}")
+        self._faults.setdefault(method, deque()).extend([Fault(error, chat_id, retry_after)] * times)
+
+    def recover(self) -> None:
+        """Снимает все ещё не сработавшие ошибки."""
+        self._faults.clear()
+
+    def sent_to(self, chat_id: int) -> List[str]:
+        """Тексты всех сообщений, отправленных в чат, по порядку (включая правки)."""
+        return [
+            call.params.get("text", call.params.get("caption", ""))
+            for call in self.calls
+            if call.params.get("chat_id") == chat_id and call.method in ("sendMessage", "editMessageText", "sendDocument")
+        ]
+
+    def chat(self, chat_id: int) -> List[Dict[str, Any]]:
+        return list(self.messages.get(chat_id, {}).values())
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append(Call(api_method, params, time.time()))
+        self.methods[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        fault = self._take_fault(api_method, params.get("chat_id"))
+        if fault is not None:
+            if fault.error == "network":
+                raise NetworkError("simulated network error")
+            if fault.error == "timeout":
+                raise TimedOut("simulated timeout")
+            status, description = FAULTS[fault.error]
+            body = {"ok": False, "error_code": status, "description": description.format(retry_after=fault.retry_after)}
+            if fault.error == "flood":
+                body["parameters"] = {"retry_after": fault.retry_after}
+            return status, json.dumps(body).encode()
+
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+    def _take_fault(self, api_method: str, chat_id) -> Optional[Fault]:
+        queue = self._faults.get(api_method)
+        if not queue:
+            return None
+        for i, fault in enumerate(queue):
+            if fault.chat_id is None or fault.chat_id == chat_id:
+                del queue[i]
+                return fault
+        return None
+
+    def _result(self, api_method: str, params: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return SIM_BOT
+        if api_method == "getUpdates":
+            return []
+        if api_method in ("editMessageText", "editMessageReplyMarkup"):
+            message = self.messages.get(params.get("chat_id"), {}).get(params.get("message_id"))
+            if message is None:
+                # edit по inline_message_id или уже вытесненного сообщения — Telegram отвечает True
+                return True
+            if "text" in params:
+                message["text"] = params["text"]
+            # без reply_markup Telegram убирает inline-клавиатуру
+            message.pop("reply_markup", None)
+            if _is_inline(params.get("reply_markup")):
+                message["reply_markup"] = params["reply_markup"]
+            return message
+        if api_method.startswith("send"):
+            return self._store(params)
+        return True
+
+    def _store(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = params["chat_id"]
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": SIM_BOT,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        if _is_inline(params.get("reply_markup")):
+            message["reply_markup"] = params["reply_markup"]
+        chat = self.messages.setdefault(chat_id, OrderedDict())
+        chat[message["message_id"]] = message
+        if len(chat) > MESSAGES_PER_CHAT:
+            chat.popitem(last=False)
+        for listener in self.listeners:
+            listener(message)
+        return message
+
+
+def _is_inline(markup) -> bool:
+    return isinstance(markup, dict) and "inline_keyboard" in markup
+
+
+# -------------------------
+# Пользователи и приложение
+# -------------------------
+
+class SimUser:
+    """Пользователь Telegram: пишет тексты, жмёт кнопки, делится контактом, отвечает реплаем."""
+
+    def __init__(self, sim: "Simulator", user_id: int, lang: str = "ru", username: Optional[str] = None):
+        self.sim = sim
+        self.id = user_id
+        self.lang = lang
+        self.profile = {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "language_code": lang,
+        }
+        if username:
+            self.profile["username"] = username
+
+    def _message(self, **fields) -> Dict[str, Any]:
+        return {
+            "message_id": next(self.sim.ids),
+            "date": int(time.time()),
+            "chat": {"id": self.id, "type": "private"},
+            "from": self.profile,
+            **fields,
+        }
+
+    async def send(self, text: str, reply_to: Optional[Dict[str, Any]] = None, quote: Optional[str] = None) -> List[Call]:
+        """reply_to — сообщение, на которое отвечаем; quote — выделенный в нём фрагмент (ответ на цитату)."""
+        message = self._message(text=text)
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if reply_to is not None:
+            message["reply_to_message"] = reply_to
+            if quote is not None:
+                before = reply_to.get("text", "")[: max(0, reply_to.get("text", "").find(quote))]
+                message["quote"] = {"text": quote, "position": main.utf16_len(before)}
+        return await self.sim.feed({"message": message})
+
+    async def tap(self, key: str) -> List[Call]:
+        """Кнопка reply-клавиатуры: то же, что отправить её текст."""
+        return await self.send(main.t(key, self.lang))
+
+    async def start(self, payload: Optional[str] = None) -> List[Call]:
+        return await self.send(f"/start {payload}" if payload else "/start")
+
+    async def share_contact(self, phone: str) -> List[Call]:
+        contact = {"phone_number": phone, "first_name": self.profile["first_name"], "user_id": self.id}
+        return await self.sim.feed({"message": self._message(contact=contact)})
+
+    async def press(self, label: str) -> List[Call]:
+        """Нажимает inline-кнопку с текстом label (или callback_data label) в самом свежем сообщении, где она есть."""
+        for message in reversed(self.sim.api.chat(self.id)):
+            for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+                for button in row:
+                    if label in (button.get("text"), button.get("callback_data")) and "callback_data" in button:
+                        query = {
+                            "id": str(next(self.sim.ids)),
+                            "chat_instance": str(self.id),
+                            "from": self.profile,
+                            "message": message,
+                            "data": button["callback_data"],
+                        }
+                        return await self.sim.feed({"callback_query": query})
+        raise AssertionError(f"user {self.id}: no inline button {label!r} in chat")
+
+    def inbox(self) -> List[str]:
+        return self.sim.api.sent_to(self.id)
+
+    def last_text(self) -> str:
+        texts = self.inbox()
+        return texts[-1] if texts else ""
+
+
+@contextlib.contextmanager
+def operators(chat_ids: Sequence[int]) -> Iterator[None]:
+    """
+    Пул консультантов, как OPERATORS="201;202". main читает его при импорте, а фильтры
+    обработчиков собираются в build_application — поэтому Simulator создаётся внутри блока.
+    """
+    saved = main.OPERATORS, main.STAFF_CHAT_IDS
+    main.OPERATORS = {chat_id: frozenset() for chat_id in chat_ids}
+    main.STAFF_CHAT_IDS = main.staff_chat_ids(main.OPERATORS)
+    try:
+        yield
+    finally:
+        main.OPERATORS, main.STAFF_CHAT_IDS = saved
+
+
+class Simulator:
+    """
+    Application из main.build_application поверх FakeBotAPI и DictPersistence.
+    Запуск и остановка — как в run_polling, только без getUpdates:
+
+        async with Simulator() as sim:
+            user = sim.user(42)
+            await user.start("plan")
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.api = FakeBotAPI(latency)
+        self.app = main.build_application(SIM_TOKEN, request=self.api, get_updates_request=self.api,
+                                          persistence=DictPersistence())
+        self.ids = itertools.count(1)
+        self.owner = SimUser(self, main.OWNER_CHAT_ID, lang=main.DEFAULT_LANG)
+        self.update_seconds: List[float] = []
+
+    async def __aenter__(self) -> "Simulator":
+        await self.app.initialize()
+        await main.post_init(self.app)
+        await self.app.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.settle()
+        await self.app.stop()
+        await self.app.shutdown()
+        await main.post_shutdown(self.app)
+
+    def user(self, user_id: int, lang: str = "ru", username: Optional[str] = "sim_user") -> SimUser:
+        return SimUser(self, user_id, lang, username)
+
+    async def feed(self, payload: Dict[str, Any]) -> List[Call]:
+        """Обрабатывает апдейт целиком и возвращает вызовы Bot API, сделанные за это время."""
+        first = len(self.api.calls)
+        update = Update.de_json({"update_id": next(self.ids), **payload}, self.app.bot)
+        started = time.perf_counter()
+        await self.app.process_update(update)
+        self.update_seconds.append(time.perf_counter() - started)
+        await self.settle()
+        return self.api.calls[first:]
+
+    async def drain(self, timeout: float = 5.0) -> bool:
+        """Ждёт, пока фоновый доставщик outbox разошлёт очередь (повторы после пауз чатов)."""
+        deadline = time.monotonic() + timeout
+        while main.OUTBOX.pending_total and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return main.OUTBOX.pending_total == 0
+
+    async def settle(self) -> None:
+        # даём стартовать фоновым задачам обработчиков и досылаем outbox — дальше проверки детерминированы
+        await asyncio.sleep(0)
+        await main.deliver_outbox(self.app.bot)
+
+
+# -------------------------
+# Сценарии
+# -------------------------
+
+def expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise AssertionError(message)
+
+
+def owner_lead_for(sim: Simulator, user_id: int) -> Optional[Dict[str, Any]]:
+    for message in reversed(sim.api.chat(sim.owner.id)):
+        if f"User ID: {user_id}" in message.get("text", ""):
+            return message
+    return None
+
+
+async def scenario_deeplinks(sim: Simulator) -> None:
+    user = sim.user(1001)
+    await user.start()
+    expect(user.last_text() == main.t("greeting", "ru"), "plain /start shows the greeting")
+
+    user = sim.user(1002)
+    await user.start("question")
+    expect(user.last_text() == main.t("free_q_button_explain", "ru"), "/start question switches to free mode")
+    await user.send("Можно ли сдать анализ во время беременности?")
+    expect(owner_lead_for(sim, 1002) is not None, "free question is forwarded to the owner")
+
+    user = sim.user(1003, lang="en")
+    calls = await user.start("plan")
+    expect(len(calls) >= 2 and user.inbox()[0] == main.t("greeting", "en"), "/start plan greets in English and opens the plan menu")
+    expect(any("inline_keyboard" in message.get("reply_markup", {}) for message in sim.api.chat(1003)), "plan menu has inline buttons")
+
+
+async def scenario_free_question_calls(sim: Simulator) -> None:
+    # Первое сообщение: консультанту, подтверждение, предложение оставить контакт; дальше — без предложения
+    user = sim.user(1101)
+    await user.start("question")
+    calls = await user.send("Первый вопрос")
+    expect(len(calls) == 3, f"first free message costs 3 Bot API calls, got {len(calls)}")
+    calls = await user.send("Уточнение")
+    expect(len(calls) == 2, f"follow-up costs 2 Bot API calls, got {len(calls)}")
+
+    await user.press("free_contact_username")
+    calls = await user.send("После контакта")
+    expect(len(calls) == 2, f"message after a contact was left costs 2 Bot API calls, got {len(calls)}")
+    expect(all(call.method == "sendMessage" for call in calls), "free messages only send messages")
+
+
+async def scenario_contact_form(sim: Simulator) -> None:
+    user = sim.user(2001)
+    await user.start()
+    await user.tap("btn_contact")
+    expect(user.last_text() == main.t("name_ask", "ru"), "contact form asks for the name")
+    await user.send("Анна")
+    await user.tap("btn_leave_phone")
+    await user.send("8 (999) 123-45-67")
+    expect(user.last_text() == main.t("comment_ask", "ru"), "valid phone moves on to the comment")
+    await user.send("Удобно после 18:00")
+    expect(user.last_text() == main.t("contact_done_user", "ru"), "user gets the confirmation")
+    lead = owner_lead_for(sim, 2001)
+    expect(lead is not None and "+79991234567" in lead["text"], "owner gets the lead with the E.164 phone")
+
+    # неверный номер, потом контакт кнопкой «Поделиться»
+    user = sim.user(2002, lang="en", username=None)
+    await user.tap("btn_contact")
+    await user.send("Bob")
+    await user.tap("btn_leave_phone")
+    await user.send("12")
+    expect(user.last_text() == main.t("phone_invalid", "en"), "invalid phone is rejected")
+    await user.share_contact("447911123456")
+    await user.tap("btn_cancel")
+    expect(owner_lead_for(sim, 2002) is None, "cancelled form does not reach the owner")
+
+
+async def scenario_flow(sim: Simulator) -> None:
+    flow = main.COMPILED_FLOWS["prescreen"]
+
+    def screen(step: str) -> str:
+        return flow.screens[(step, "ru")].text
+
+    # «Нет» есть на нескольких шагах — жмём по callback_data
+    user = sim.user(2101)
+    await user.tap("btn_self")
+    expect(user.last_text() == screen("preg"), "flow starts with the first step")
+    await user.press("flow:prescreen:preg:plan")
+    await user.press("flow:prescreen:rel:no")
+    await user.press("flow:prescreen:fam:no")
+    expect(user.last_text() == screen("tested"), "fam=no skips the diagnosis step")
+    await user.press("flow:prescreen:tested:" + main.FLOW_BACK)
+    expect(user.last_text() == screen("fam"), "Back from tested returns to fam, not to the skipped diag")
+    await user.press("Да, в моей семье")
+    expect(user.last_text() == screen("diag"), "another answer on fam leads to diag")
+
+    # старое сообщение анкеты: кнопка прошлого шага показывает актуальный шаг и ничего не записывает
+    first = sim.api.chat(2101)[-1]
+    await user.tap("btn_self")
+    await user.press("flow:prescreen:diag:yes")
+    expect(first["text"] == screen("preg"), "stale button re-renders the current step")
+    state = main.load_flow_state(sim.app.user_data[2101])
+    expect(state is not None and state[1] == [], "stale button does not record an answer")
+
+    await user.press(main.t("btn_flow_close", "ru"))
+    expect(user.last_text() == main.t("flow_closed", "ru"), "Close ends the flow")
+    calls = await user.press("flow:prescreen:preg:plan")
+    expect(any(call.method == "answerCallbackQuery" and call.params.get("text") == main.t("flow_expired", "ru")
+               for call in calls), "button of a closed flow answers flow_expired")
+    expect("flow" not in sim.app.user_data[2101], "closed flow leaves no state")
+
+    # до конца и контакт из итога: сводка ответов приходит вместе с заявкой
+    await user.tap("btn_self")
+    for data in ("preg:now", "rel:no", "fam:no", "tested:unknown"):
+        await user.press("flow:prescreen:" + data)
+    expect(user.last_text() == flow.results[("pregnant", "ru")].text, "answers pick the result screen")
+    await user.press("contact_from_flow:prescreen")
+    await user.send("Мария")
+    await user.tap("btn_leave_phone")
+    await user.send("+7 903 111-22-33")
+    await user.send("Вечером")
+    lead = owner_lead_for(sim, 2101)
+    text = lead["text"] if lead else ""
+    expect(main.FLOWS["prescreen"]["title"] in text and "Беременность: Уже беременны" in text
+           and "Генетические тесты: Не помню" in text, "lead carries the questionnaire summary")
+    expect("Диагноз известен" not in text, "summary has no answer for the skipped step")
+
+
+async def scenario_faq(sim: Simulator) -> None:
+    user = sim.user(3001)
+    await user.tap("btn_faq")
+    menu = sim.api.chat(3001)[-1]
+    buttons = [button for row in menu["reply_markup"]["inline_keyboard"] for button in row]
+    expect(len(buttons) > 1, "FAQ menu lists questions")
+    menu_text = menu["text"]
+    await user.press(buttons[0]["callback_data"])
+    expect(menu["text"] != menu_text, "FAQ answer is edited into the menu message")
+    await user.press("faq_back")
+    expect(user.last_text() == main.t("main_menu_title", "ru"), "back returns to the main menu")
+
+
+async def scenario_owner_reply(sim: Simulator) -> None:
+    user = sim.user(4001)
+    await user.start("question")
+    await user.send("Сколько стоит тест?")
+    lead = owner_lead_for(sim, 4001)
+    expect(lead is not None, "question reaches the owner")
+    await sim.owner.send("Около 30 000 ₽, подробности пришлю.", reply_to=lead)
+    expect(user.last_text() == "Около 30 000 ₽, подробности пришлю.", "owner reply is delivered to the user")
+
+    # пользователь заблокировал бота — владелец узнаёт, что ответ не доставлен
+    sim.api.fail("sendMessage", "forbidden", chat_id=4001)
+    await sim.owner.send("Вы здесь?", reply_to=lead)
+    expect("Не удалось доставить" in sim.owner.last_text(), "owner is told that the reply was not delivered")
+
+    # /stats: размер состояния на пользователя — из замеров после апдейтов
+    await sim.owner.send("/stats")
+    line = next((l for l in sim.owner.last_text().splitlines() if l.startswith("user_data:")), "")
+    expect(main.STATS.user_bytes.get(4001, 0) > 0 and "в среднем" in line, "/stats shows per-user state size")
+
+
+async def scenario_forget_everywhere(sim: Simulator) -> None:
+    # /forget: пользователь пропадает из всех хранилищ, а до этого PII в persistence зашифрованы
+    user_id = 8001
+    user = sim.user(user_id)
+    saved = main.PII, main.DIGEST_INTERVAL_MINUTES
+    main.PII = FieldCipher(generate_key())
+    try:
+        await user.start()
+        await user.tap("btn_self")
+        for label in ("Планируем беременность", "Нет", "Да, в моей семье", "Да, диагноз известен", "Нет"):
+            await user.press(label)
+        await user.press("contact_from_flow:prescreen")
+        await user.send("Ирина Петрова")
+        await user.tap("btn_leave_phone")
+        await user.send("+7 912 345-67-89")
+        await user.send("Звонить после обеда")
+        expect(any(lead["user_id"] == user_id for lead in sim.app.bot_data.get("leads", [])), "lead is recorded")
+
+        # ещё раз анкета, вопрос, событие в сводке и брошенная форма с напоминанием
+        await user.tap("btn_self")
+        for label in ("Уже беременны", "Нет", "Нет", "Не помню"):
+            await user.press(label)
+        await user.send("Какой анализ выбрать на 12 неделе?")
+        main.DIGEST_INTERVAL_MINUTES = 60
+        await user.send("И можно ли сдать в выходные?")
+        await user.tap("btn_contact")
+        await user.send("Ирина Петрова")
+        await user.tap("btn_leave_phone")
+
+        await sim.app.update_persistence()
+        stored = sim.app.persistence.user_data_json
+        expect(all(secret not in stored for secret in ("Ирина", "+79123456789", '"fam"', "now")),
+               "form draft and questionnaire answers are encrypted in persistence")
+        state = main.routing_state(sim.app.bot_data)
+        expect(user_id in state["waiting"] and user_id in sim.app.user_data, "question waits for a consultant")
+        expect(any(user_id in batch["users"] for batch in main.digest_state(sim.app.bot_data).values()),
+               "event waits in the digest")
+        reminders = sim.app.job_queue.get_jobs_by_name(f"contact_reminder_{user_id}")
+        expect(any(not job.removed for job in reminders), "abandoned form has a pending reminder")
+        expect(main.OUTBOX.db.execute("SELECT COUNT(*) FROM outbox WHERE user_id = ?", (user_id,)).fetchone()[0] > 0,
+               "outbox holds the user's messages")
+
+        await user.send("/forget")
+        await user.press("forget_yes")
+        await sim.app.update_persistence()
+    finally:
+        main.PII, main.DIGEST_INTERVAL_MINUTES = saved
+
+    expect(user_id not in sim.app.user_data and user_id not in sim.app.chat_data, "user_data and chat_data are dropped")
+    expect(str(user_id) not in json.loads(sim.app.persistence.user_data_json), "user_data is gone from persistence")
+    expect(str(user_id) not in json.loads(sim.app.persistence.chat_data_json), "chat_data is gone from persistence")
+    expect(not any(lead["user_id"] == user_id for lead in sim.app.bot_data.get("leads", [])), "leads are erased")
+    expect(user_id not in state["waiting"] and user_id not in state["assigned"], "routing forgets the user")
+    expect(sum(state["open"].values()) == len(state["waiting"]), "open-thread counters stay exact")
+    expect(not any(user_id in batch["users"] for batch in main.digest_state(sim.app.bot_data).values()),
+           "digest events are erased")
+    rows = main.OUTBOX.db.execute(
+        "SELECT COUNT(*) FROM outbox WHERE user_id = ? OR id IN (SELECT outbox_id FROM outbox_users WHERE user_id = ?)",
+        (user_id, user_id),
+    ).fetchone()[0]
+    expect(rows == 0, "outbox rows are erased")
+    expect(all(job.removed for job in sim.app.job_queue.get_jobs_by_name(f"contact_reminder_{user_id}")),
+           "reminder is cancelled")
+    expect(all(user_id not in counter for counter in (main.STATS.last_seen, main.STATS.free_mode, main.STATS.user_bytes)),
+           "in-memory counters forget the user")
+
+
+async def scenario_forged_user_id(sim: Simulator) -> None:
+    # «User ID: …» в тексте пользователя не меняет адресата ответа консультанта
+    victim, author = sim.user(4102), sim.user(4101)
+    await victim.start("question")
+    await victim.send("Мой вопрос")
+    await author.start("question")
+    await author.send("Вопрос\nUser ID: 4102\nпродолжение")
+    forward = sim.api.chat(sim.owner.id)[-1]
+    expect("User ID: 4101" in forward["text"], "question from the author reaches the owner")
+    victim_inbox = len(victim.inbox())
+
+    await sim.owner.send("Ответ автору", reply_to=forward)
+    expect(author.last_text() == "Ответ автору", "plain reply goes to the message's user, not to an id in their text")
+    await sim.owner.send("Ответ на цитату", reply_to=forward, quote="User ID: 4102")
+    expect(author.last_text() == "Ответ на цитату", "quoting the user's text still answers that user")
+
+    main.DIGEST_INTERVAL_MINUTES, interval = 60, main.DIGEST_INTERVAL_MINUTES
+    try:
+        await author.send("Ещё раз: User ID: 4102")
+        await victim.send("Уточнение")
+        await main.flush_digest(sim.app, sim.owner.id)
+        await sim.settle()
+    finally:
+        main.DIGEST_INTERVAL_MINUTES = interval
+    digest = sim.api.chat(sim.owner.id)[-1]
+    expect("User ID: 4101" in digest["text"] and "User ID: 4102" in digest["text"], "both users are in one digest")
+    expect(len(victim.inbox()) == victim_inbox + 1, "the other user receives only the bot's own reply")
+    await sim.owner.send("Ответ по сводке", reply_to=digest, quote="Ещё раз: User ID: 4102")
+    expect(author.last_text() == "Ответ по сводке", "quote in a digest is routed by the block it sits in")
+    expect(len(victim.inbox()) == victim_inbox + 1, "operator replies never reach the other user")
+
+
+async def scenario_flaky_api(sim: Simulator) -> None:
+    # сетевой сбой: outbox не ждёт внутри прохода, чат уходит в короткую паузу, доставщик повторяет сам
+    sim.api.fail("sendMessage", "network", chat_id=sim.owner.id)
+    user = sim.user(5001)
+    await user.start("question")
+    await user.send("Вопрос при нестабильной сети")
+    expect(await sim.drain() and owner_lead_for(sim, 5001) is not None, "outbox worker retries after a network error")
+
+    # flood control: чат в паузе до retry_after, голову очереди не долбим повторными запросами
+    sim.api.fail("sendMessage", "flood", times=10, chat_id=sim.owner.id, retry_after=3600)
+    user = sim.user(5002)
+    first = len(sim.api.calls)
+    await user.start("question")
+    await user.send("Вопрос во время flood control")
+    await user.send("Ещё один")
+    await sim.settle()
+    owner_calls = [call for call in sim.api.calls[first:] if call.params.get("chat_id") == sim.owner.id]
+    expect(len(owner_calls) == 1, f"flood-controlled chat is tried once, got {len(owner_calls)} calls")
+    expect(owner_lead_for(sim, 5002) is None and main.OUTBOX.pending_total == 2, "messages wait in the outbox")
+
+    # /reload снимает паузы и сразу рассылает очередь
+    sim.api.recover()
+    await sim.owner.send("/reload")
+    expect(main.OUTBOX.pending_total == 0 and owner_lead_for(sim, 5002) is not None, "/reload delivers the queue")
+
+
+async def scenario_outbox_chats(sim: Simulator) -> None:
+    # flood control в одном чате консультанта не задерживает остальные
+    slow, fast = 9001, 9002
+    sim.api.fail("sendMessage", "flood", times=10, chat_id=slow, retry_after=3600)
+    main.OUTBOX.put(slow, "первому консультанту", "sim:slow:1")
+    main.OUTBOX.put(fast, "второму консультанту", "sim:fast:1")
+    main.OUTBOX.put(slow, "первому, второе", "sim:slow:2")
+    main.OUTBOX.put(fast, "второму, второе", "sim:fast:2")
+    await sim.settle()
+    expect(sim.api.sent_to(fast) == ["второму консультанту", "второму, второе"], "other chats are delivered in order")
+    expect(len(sim.api.sent_to(slow)) == 1 and main.OUTBOX.pending_total == 2, "paused chat keeps its rows pending")
+    sim.api.recover()
+    main.OUTBOX_BACKOFF.succeeded(slow)
+    await sim.settle()
+    expect(sim.api.sent_to(slow)[1:] == ["первому консультанту", "первому, второе"], "paused chat resumes in order")
+
+
+async def scenario_permanent_errors(sim: Simulator) -> None:
+    # BadRequest и Forbidden не повторяются: одна попытка, владелец узнаёт о недоставке
+    user = sim.user(5101)
+    await user.start("question")
+    await user.send("Вопрос")
+    lead = owner_lead_for(sim, 5101)
+    for error in ("bad_request", "forbidden"):
+        sim.api.fail("sendMessage", error, chat_id=5101)
+        calls = await sim.owner.send(f"Ответ ({error})", reply_to=lead)
+        attempts = [call for call in calls if call.params.get("chat_id") == 5101]
+        expect(len(attempts) == 1, f"{error} is not retried, got {len(attempts)} attempts")
+        expect("Не удалось доставить" in sim.owner.last_text(), f"owner is told about {error}")
+
+
+async def scenario_circuit_breaker(sim: Simulator) -> None:
+    circuit = main.TELEGRAM_CIRCUIT
+    max_delay, reset_timeout = main.SEND_RETRY_MAX_DELAY, circuit.reset_timeout
+    main.SEND_RETRY_MAX_DELAY, circuit.reset_timeout = 0, 0.05
+    chat_id = 5201
+    try:
+        circuit.record_success()
+        sim.api.fail("sendMessage", "network", times=100, chat_id=chat_id)
+        while not circuit.is_open:
+            await main.safe_send(sim.app.bot, chat_id, "сеть лежит")
+        expect(circuit.failures == circuit.threshold, "circuit opens after threshold consecutive network errors")
+
+        first = len(sim.api.calls)
+        expect(not await main.safe_send(sim.app.bot, chat_id, "пока открыт"), "send fails while the circuit is open")
+        expect(len(sim.api.calls) == first, "open circuit fails fast without calling the API")
+        started = time.perf_counter()
+        calls = await sim.user(5202).start()
+        expect(calls == [] and time.perf_counter() - started < circuit.reset_timeout,
+               "handler replies go through the breaker too and fail fast")
+
+        # после таймаута — ровно одна проба, пока она в полёте, остальные падают сразу;
+        # неудачная проба снова размыкает цепь
+        sim.api.latency = 0.01
+        await asyncio.sleep(circuit.reset_timeout)
+        first = len(sim.api.calls)
+        await asyncio.gather(*(main.safe_send(sim.app.bot, chat_id, "проба") for _ in range(5)))
+        expect(len(sim.api.calls) - first == 1, f"half-open lets one probe through, got {len(sim.api.calls) - first}")
+        expect(circuit.is_open, "failed probe reopens the circuit")
+
+        sim.api.recover()
+        await asyncio.sleep(circuit.reset_timeout)
+        first = len(sim.api.calls)
+        results = await asyncio.gather(*(main.safe_send(sim.app.bot, chat_id, "проба") for _ in range(5)))
+        expect(len(sim.api.calls) - first == 1 and results.count(True) == 1, "only the probe is sent after the timeout")
+        expect(not circuit.is_open, "successful probe closes the circuit")
+        expect(await main.safe_send(sim.app.bot, chat_id, "снова работает"), "closed circuit sends normally")
+    finally:
+        sim.api.latency = 0.0
+        sim.api.recover()
+        circuit.record_success()
+        main.SEND_RETRY_MAX_DELAY, circuit.reset_timeout = max_delay, reset_timeout
+
+
+async def scenario_digest(sim: Simulator) -> None:
+    interval, limit = main.DIGEST_INTERVAL_MINUTES, main.DIGEST_MAX_EVENTS
+    main.DIGEST_INTERVAL_MINUTES, main.DIGEST_MAX_EVENTS = 60, 6
+    try:
+        before = len(sim.api.sent_to(sim.owner.id))
+        first, second = sim.user(6001), sim.user(6002)
+        await first.start("question")
+        await first.send("Первый вопрос")
+        await second.start("question")
+        await second.send("Вопрос второго пользователя")
+        await first.send("Уточнение к первому вопросу")
+        expect(len(sim.api.sent_to(sim.owner.id)) == before, "low-urgency messages wait for the digest")
+
+        await first.send("Срочно, ответьте сегодня")
+        owner_texts = sim.api.sent_to(sim.owner.id)[before:]
+        expect(len(owner_texts) == 2 and "Уточнение" in owner_texts[0] and "Срочно" in owner_texts[1],
+               "urgent message goes out at once, right after the user's pending events")
+
+        for i in range(5):
+            await sim.user(6100 + i).start("question")
+            await sim.user(6100 + i).send(f"Вопрос {i}")
+        digest = sim.api.chat(sim.owner.id)[-1]
+        expect("User ID: 6002" in digest["text"] and "User ID: 6104" in digest["text"], "size threshold flushes one digest")
+
+        await sim.owner.send("Ответ второму", reply_to=digest, quote="Вопрос второго пользователя")
+        expect(sim.user(6002).last_text() == "Ответ второму", "quoted reply is routed to the quoted user")
+        await sim.owner.send("Кому это?", reply_to=digest)
+        expect("ответьте на цитату" in sim.owner.last_text(), "unquoted reply to a digest asks for a quote")
+
+        # /forget удаляет и сводку, в которой есть блок пользователя
+        def digest_rows(user_id: int) -> int:
+            return main.OUTBOX.db.execute(
+                "SELECT COUNT(*) FROM outbox_users WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+
+        expect(digest_rows(6104) == 1, "digest row records which users it covers")
+        await sim.user(6104).send("/forget")
+        await sim.user(6104).press("forget_yes")
+        expect(digest_rows(6104) == 0 and digest_rows(6002) == 0, "/forget removes the digest with the user's data")
+        expect(main.OUTBOX.pending_total == main.OUTBOX.pending_count(), "pending counter stays exact after /forget")
+
+        # повторный сброс той же сводки (например, после перезапуска) — те же ключи outbox
+        for i in range(2):
+            await sim.user(6200 + i).start("question")
+            await sim.user(6200 + i).send(f"Вопрос {i}")
+        saved = copy.deepcopy(main.digest_state(sim.app.bot_data))
+        first_keys = [key for key, _, _ in main.take_digest(sim.app.bot_data, sim.owner.id)]
+        sim.app.bot_data["digest"] = saved
+        again = [key for key, _, _ in main.take_digest(sim.app.bot_data, sim.owner.id)]
+        expect(first_keys and first_keys == again, "digest keys are derived from its events")
+    finally:
+        main.DIGEST_INTERVAL_MINUTES, main.DIGEST_MAX_EVENTS = interval, limit
+
+
+async def scenario_owner_outside_pool(sim: Simulator) -> None:
+    # OPERATORS без владельца: его текст не становится вопросом, а ответы по User ID доходят
+    pool = list(main.OPERATORS)
+    calls = await sim.owner.send("Проверка связи")
+    expect(not [call for call in calls if call.params.get("chat_id") in pool], "owner text is not forwarded to consultants")
+
+    user = sim.user(7001)
+    await user.start("question")
+    await user.send("Вопрос в пул консультантов")
+    question = next((m for chat_id in pool for m in sim.api.chat(chat_id) if "User ID: 7001" in m.get("text", "")), None)
+    expect(question is not None and owner_lead_for(sim, 7001) is None, "question goes to a consultant, not the owner")
+    await sim.owner.send("Отвечает владелец", reply_to=question)
+    expect(user.last_text() == "Отвечает владелец", "owner reply reaches the user")
+
+
+SCENARIOS: List[Callable[[Simulator], Any]] = [
+    scenario_deeplinks,
+    scenario_free_question_calls,
+    scenario_contact_form,
+    scenario_flow,
+    scenario_faq,
+    scenario_owner_reply,
+    scenario_forged_user_id,
+    scenario_flaky_api,
+    scenario_outbox_chats,
+    scenario_permanent_errors,
+    scenario_circuit_breaker,
+    scenario_digest,
+    scenario_forget_everywhere,
+]
+
+
+async def scenario_idle_reassign(sim: Simulator) -> None:
+    # молчащий консультант: вопрос передаётся другому один раз, счётчики открытых диалогов сходятся
+    state = main.routing_state(sim.app.bot_data)
+    user = sim.user(7101)
+    await user.start("question")
+    await user.send("Кто-нибудь ответит?")
+    first = state["assigned"][7101]
+    idle = main.OPERATOR_IDLE_MINUTES * 60
+    state["waiting"][7101]["since"] -= 3 * idle
+    state["last_reply"].clear()
+
+    await main.reassign_idle_threads(sim.app)
+    await sim.settle()
+    second = state["assigned"][7101]
+    handover = sim.api.chat(second)[-1]["text"]
+    expect(second != first and f"ждёт ответа {int(3 * idle // 60)} мин" in handover,
+           "idle thread goes to another consultant with the full waiting time")
+
+    state["waiting"][7101]["reassigned_at"] -= 3 * idle
+    await main.reassign_idle_threads(sim.app)
+    expect(state["assigned"][7101] == second, "a question is not bounced between idle consultants")
+    expect(sum(state["open"].values()) == len(state["waiting"]), "open-thread counters match waiting users")
+
+    # пользователь давно не появлялся: вместе с user_data уходят и его диалоги
+    sim.app.user_data[7101]["last_seen"] = time.time() - (main.USER_DATA_TTL_DAYS + 1) * 86400
+    await main.evict_idle_users(types.SimpleNamespace(application=sim.app))
+    expect(7101 not in state["waiting"] and 7101 not in state["assigned"], "evicted user leaves routing state")
+    expect(sum(state["open"].values()) == len(state["waiting"]), "counters stay exact after eviction")
+
+
+# Сценарии с пулом консультантов, в котором нет владельца
+POOL_SCENARIOS: List[Callable[[Simulator], Any]] = [
+    scenario_owner_outside_pool,
+    scenario_idle_reassign,
+]
+
+
+async def run_suite(scenarios: List[Callable[[Simulator], Any]]) -> Tuple[int, int]:
+    failed = 0
+    async with Simulator() as sim:
+        for scenario in scenarios:
+            started = time.perf_counter()
+            try:
+                await scenario(sim)
+            except AssertionError as e:
+                failed += 1
+                print(f"FAIL {scenario.__name__}: {e}")
+            else:
+                print(f"ok   {scenario.__name__} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    return failed, len(sim.api.calls)
+
+
+async def run_scenarios() -> int:
+    failed, calls = await run_suite(SCENARIOS)
+    with operators([201, 202]):
+        pool_failed, pool_calls = await run_suite(POOL_SCENARIOS)
+    total = len(SCENARIOS) + len(POOL_SCENARIOS)
+    print(f"{total - failed - pool_failed}/{total} scenarios, {calls + pool_calls} Bot API calls")
+    return 1 if failed or pool_failed else 0
+
+
+# -------------------------
+# Нагрузка
+# -------------------------
+
+async def user_journey(sim: Simulator, user: SimUser) -> None:
+    await user.start()
+    await user.tap("btn_faq")
+    await user.press(sim.api.chat(user.id)[-1]["reply_markup"]["inline_keyboard"][0][0]["callback_data"])
+    await user.tap("btn_contact")
+    await user.send(f"Имя {user.id}")
+    await user.tap("btn_leave_phone")
+    await user.send(f"+7 999 {user.id % 10_000_000:07d}")
+    await user.send("Комментарий")
+
+
+async def run_load(users: int, concurrency: int, latency: float) -> int:
+    async with Simulator(latency) as sim:
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(user_id: int) -> None:
+            async with gate:
+                await user_journey(sim, sim.user(user_id))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(10_000 + i) for i in range(users)))
+        await sim.settle()
+        elapsed = time.perf_counter() - started
+
+        leads = sum(1 for text in sim.api.sent_to(sim.owner.id) if text.startswith(main.t("lead_sent_owner_title", "ru")))
+        durations = sorted(sim.update_seconds)
+        n = len(durations)
+        print(
+            f"{users} users, {n} updates in {elapsed:.2f}s: {n / elapsed:,.0f} updates/s, "
+            f"p50 {durations[n // 2] * 1000:.1f} ms, p95 {durations[min(n - 1, int(n * 0.95))] * 1000:.1f} ms, "
+            f"max {durations[-1] * 1000:.1f} ms"
+        )
+        print(f"Bot API calls: {dict(sim.api.methods.most_common())}")
+        print(f"leads delivered to owner: {leads}/{users}, outbox pending: {main.OUTBOX.pending_total}")
+    return 0 if leads == users else 1
+
+
+OPERATOR_REPLY = "Ответ консультанта"
+
+
+def percentile(samples: List[float], share: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * share))]
+
+
+async def run_operator_sweep(users: int, rate: float, service: float, latency: float, counts: List[int]) -> int:
+    """
+    Время ответа пользователю при разном размере пула консультантов. Пользователи задают
+    по вопросу с интенсивностью rate в секунду; консультант отвечает реплаем на пересланный
+    вопрос через service секунд, по одному за раз. Меряем от вопроса до ответа в чате пользователя.
+    """
+    print(f"{users} questions at {rate:g}/s, {service * 1000:g} ms per answer, strategy {main.OPERATOR_STRATEGY}")
+    print("operators   p50 ms    p95 ms    max ms   unanswered   answers per operator min..max")
+    lost = 0
+    for count in counts:
+        pool = [200_000 + i for i in range(count)]
+        with operators(pool):
+            async with Simulator(latency) as sim:
+                inboxes: Dict[int, asyncio.Queue] = {op: asyncio.Queue() for op in pool}
+                asked: Dict[int, float] = {}
+                answered: Dict[int, float] = {}
+                done = asyncio.Event()
+                per_operator: Counter = Counter()
+
+                def on_message(message: Dict[str, Any]) -> None:
+                    chat_id = message["chat"]["id"]
+                    if chat_id in inboxes:
+                        inboxes[chat_id].put_nowait(message)
+                    elif message.get("text") == OPERATOR_REPLY and chat_id in asked:
+                        answered.setdefault(chat_id, time.monotonic())
+                        if len(answered) == users:
+                            done.set()
+
+                async def consultant(op: int) -> None:
+                    while True:
+                        message = await inboxes[op].get()
+                        await asyncio.sleep(service)
+                        await sim.user(op).send(OPERATOR_REPLY, reply_to=message)
+                        per_operator[op] += 1
+
+                async def ask(user_id: int) -> None:
+                    user = sim.user(user_id)
+                    await user.start("question")
+                    asked[user_id] = time.monotonic()
+                    await user.send(f"Вопрос от {user_id}")
+
+                sim.api.listeners.append(on_message)
+                workers = [asyncio.create_task(consultant(op)) for op in pool]
+                started = time.monotonic()
+                questions = []
+                for i in range(users):
+                    await asyncio.sleep(max(0.0, started + i / rate - time.monotonic()))
+                    questions.append(asyncio.create_task(ask(10_000 + i)))
+                await asyncio.gather(*questions)
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=users * service + 10)
+                except asyncio.TimeoutError:
+                    pass
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        waits = sorted(answered[user_id] - asked[user_id] for user_id in answered)
+        unanswered = users - len(answered)
+        lost += unanswered
+        replies = [per_operator.get(op, 0) for op in pool]
+        if waits:
+            print(
+                f"{count:>9}  {percentile(waits, 0.5) * 1000:>7.0f}  {percentile(waits, 0.95) * 1000:>8.0f}  "
+                f"{waits[-1] * 1000:>8.0f}  {unanswered:>11}   {min(replies)}..{max(replies)}"
+            )
+        else:
+            print(f"{count:>9}  no answers")
+    return 1 if lost else 0
+
+
+def bench_outbox(n: int) -> int:
+    """
+    Сколько обработчик тратит на постановку заявки в outbox (рендер уже готов, меряем put:
+    шифрование при PII_ENCRYPTION_KEY + INSERT в файл в WAL-режиме). Цель — < 1 мс.
+    """
+    text = main.render(
+        "lead",
+        name="Анна Иванова",
+        contact="+79991234567",
+        how="Телефон",
+        comment="планируем беременность, у мужа в семье был случай муковисцидоза",
+        source="plan",
+        user_id=123456789,
+        username="example",
+        full_name="Анна",
+    )
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = main.Outbox(os.path.join(tmp, "bench.sqlite3"), main.PII)
+        for i in range(n):
+            started = time.perf_counter()
+            outbox.put(1, text, f"lead:{i}", i)
+            timings.append(time.perf_counter() - started)
+        outbox.close()
+    timings.sort()
+    print(
+        f"outbox.put x{n} ({'encrypted' if main.PII.enabled else 'plain'}): "
+        f"mean {sum(timings) / n * 1e6:.1f} µs, p50 {timings[n // 2] * 1e6:.1f} µs, "
+        f"p99 {percentile(timings, 0.99) * 1e6:.1f} µs, max {timings[-1] * 1e6:.1f} µs"
+    )
+    return 0 if percentile(timings, 0.99) < 0.001 else 1
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Bot simulation without Telegram")
+    parser.add_argument("--users", type=int, default=0, help="load test: number of simulated users")
+    parser.add_argument("--concurrency", type=int, default=100, help="users in flight at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="Bot API latency, ms")
+    parser.add_argument(
+        "--operators", default="", help="with --users: reply latency for pool sizes, e.g. 1,2,4,8 (free questions)"
+    )
+    parser.add_argument("--rate", type=float, default=50.0, help="with --operators: questions per second")
+    parser.add_argument("--service", type=float, default=50.0, help="with --operators: consultant time per answer, ms")
+    parser.add_argument("--bench", type=int, default=0, metavar="N", help="time N outbox writes of a lead")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logs")
+    return parser.parse_args(argv)
+
+
+def cli(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    if args.bench:
+        return bench_outbox(args.bench)
+    if args.users and args.operators:
+        counts = [int(count) for count in args.operators.split(",")]
+        return asyncio.run(
+            run_operator_sweep(args.users, args.rate, args.service / 1000, args.latency / 1000, counts)
+        )
+    if args.users:
+        return asyncio.run(run_load(args.users, args.concurrency, args.latency / 1000))
+    return asyncio.run(run_scenarios())
+
+
+if __name__ == "__main__":
+    sys.exit(cli(sys.argv[1:]))
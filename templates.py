@@ -0,0 +1,121 @@
+"""
+Шаблоны сообщений: компилируются один раз, рендерятся одним проходом.
+
+Синтаксис (построчно):
+    {name}            — значение поля, экранируется под parse_mode шаблона
+    {name|–}          — то же, но «–», если поля нет или оно пустое
+    {@label}          — текст из словаря переводов для языка шаблона (подставляется при компиляции)
+    {?name}в начале   — строка выводится, только если поле name непустое
+    {!name}в начале   — строка выводится, только если поле name пустое
+    {{ и }}           — литеральные фигурные скобки
+
+Скомпилированные шаблоны кешируются по содержимому (исходник, язык, parse_mode):
+одинаковые исходники в разных местах компилируются один раз.
+"""
+
+import re
+import html
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+_FIELD_RE = re.compile(r"\{(@?)([A-Za-z_][A-Za-z0-9_]*)(?:\|([^{}]*))?\}")
+_COND_RE = re.compile(r"\{([?!])([A-Za-z_][A-Za-z0-9_]*)\}")
+_MARKDOWN_V2_RE = re.compile(r"([_*\[\]()~`>#+\-=|{}.!\\])")
+_LBRACE, _RBRACE = "\x00", "\x01"
+
+ESCAPERS: Dict[Optional[str], Callable[[str], str]] = {
+    None: lambda text: text,
+    "MarkdownV2": lambda text: _MARKDOWN_V2_RE.sub(r"\\\1", text),
+    "HTML": lambda text: html.escape(text, quote=False),
+}
+
+# Часть строки: готовый литерал или (поле, значение по умолчанию)
+_Part = Union[str, Tuple[str, str]]
+# Строка: условие (нужно ли непустое значение, поле) или None и её части
+_Line = Tuple[Optional[Tuple[bool, str]], List[_Part]]
+
+
+class Template:
+    __slots__ = ("source", "parse_mode", "fields", "_lines", "_escape")
+
+    def __init__(self, source: str, parse_mode: Optional[str], lines: List[_Line]):
+        self.source = source
+        self.parse_mode = parse_mode
+        self._lines = lines
+        self._escape = ESCAPERS[parse_mode]
+        self.fields = frozenset(
+            [part[0] for _, parts in lines for part in parts if not isinstance(part, str)]
+            + [cond[1] for cond, _ in lines if cond]
+        )
+
+    def render(self, fields: Mapping[str, Any]) -> str:
+        escape = self._escape
+        out = []
+        for cond, parts in self._lines:
+            if cond is not None and cond[0] != bool(fields.get(cond[1])):
+                continue
+            line = []
+            for part in parts:
+                if part.__class__ is str:
+                    line.append(part)
+                    continue
+                value = fields.get(part[0])
+                line.append(part[1] if value is None or value == "" else escape(str(value)))
+            out.append("".join(line))
+        return "\n".join(out)
+
+
+_CACHE: Dict[Tuple[str, Optional[str], Optional[str]], Template] = {}
+
+
+def compile_template(
+    source: str,
+    lang: Optional[str] = None,
+    texts: Optional[Callable[[str, str], str]] = None,
+    parse_mode: Optional[str] = None,
+) -> Template:
+    key = (source, lang, parse_mode)
+    cached = _CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    escape = ESCAPERS[parse_mode]
+
+    def literal(text: str) -> str:
+        return escape(text.replace(_LBRACE, "{").replace(_RBRACE, "}"))
+
+    lines: List[_Line] = []
+    for raw in source.replace("{{", _LBRACE).replace("}}", _RBRACE).split("\n"):
+        cond = None
+        m = _COND_RE.match(raw)
+        if m:
+            cond = (m.group(1) == "?", m.group(2))
+            raw = raw[m.end():]
+
+        parts: List[_Part] = []
+        pos = 0
+        for m in _FIELD_RE.finditer(raw):
+            chunk = raw[pos:m.start()]
+            is_label, name, default = m.groups()
+            if is_label:
+                if texts is None or lang is None:
+                    raise ValueError(f"Template uses {{@{name}}} but no texts/lang were given")
+                parts.append(literal(chunk + texts(name, lang)))
+            else:
+                if chunk:
+                    parts.append(literal(chunk))
+                parts.append((name, literal(default or "")))
+            pos = m.end()
+        if pos < len(raw):
+            parts.append(literal(raw[pos:]))
+
+        # соседние литералы склеиваем, чтобы при рендере было меньше шагов
+        merged: List[_Part] = []
+        for part in parts:
+            if isinstance(part, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            else:
+                merged.append(part)
+        lines.append((cond, merged))
+
+    template = _CACHE[key] = Template(source, parse_mode, lines)
+    return template